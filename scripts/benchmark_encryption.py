@@ -0,0 +1,69 @@
+""" Measure the throughput of the face encryption of main.py for each AES mode, face (ROI) size and number of
+encryption threads. Each frame holds --faces square faces of the given size, encrypted with Encryptor.encryptFrame.
+Only CTR mode uses more than one thread. """
+
+import argparse
+import time
+
+import numpy as np
+import prettytable as pt
+
+from src.jetson.AES import MODES, DEFAULT_CHUNK_SIZE
+from src.jetson.encryptor import Encryptor
+
+
+def benchmark(mode, roi_size, faces, repeats, workers=1, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Time the encryption of a frame of faces.
+    @param mode: AES mode, one of the MODES in src/jetson/AES.py.
+    @param roi_size: Height and width of each face in pixels.
+    @param faces: Number of faces in the frame.
+    @param repeats: Number of times the frame is encrypted.
+    @param workers: Number of encryption threads.
+    @param chunk_size: Bytes encrypted per thread pool task.
+    @return: Mean time per frame in seconds and throughput in MB/s.
+    """
+
+    columns = int(np.ceil(np.sqrt(faces)))
+    rows = int(np.ceil(faces / columns))
+    img = np.random.randint(0, 256, (rows * roi_size, columns * roi_size, 3), dtype=np.uint8)
+    boxes = [((i % columns) * roi_size, (i // columns) * roi_size, (i % columns + 1) * roi_size,
+              (i // columns + 1) * roi_size) for i in range(faces)]
+
+    encryptor = Encryptor(mode, workers, chunk_size)
+    encryptor.encryptFrame(img, boxes)
+    since = time.perf_counter()
+    for _ in range(repeats):
+        encryptor.encryptFrame(img, boxes)
+    frame_time = (time.perf_counter() - since) / repeats
+
+    return frame_time, faces * roi_size * roi_size * 3 / frame_time / 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the throughput of the face encryption by AES mode and '
+                                                 'face size.')
+    parser.add_argument('--sizes', type=int, nargs='+', help='Face sizes (height and width in pixels) to measure.',
+                        default=[32, 64, 128, 256, 512])
+    parser.add_argument('--modes', type=str, nargs='+', choices=MODES, help='AES modes to measure.', default=MODES)
+    parser.add_argument('--faces', type=int, help='Number of faces per frame.', default=4)
+    parser.add_argument('--repeats', type=int, help='Number of frames encrypted per measurement.', default=20)
+    parser.add_argument('--threads', type=int, nargs='+', help='Numbers of encryption threads to measure (CTR mode '
+                                                               'only).', default=[1, 2, 3, 4])
+    parser.add_argument('--chunk_size', type=int, help='Bytes encrypted per thread pool task.',
+                        default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    x = pt.PrettyTable()
+    x.field_names = ['Face size', 'Mode', 'Threads', 'Frame time (ms)', 'Throughput (MB/s)', 'Speedup']
+    for roi_size in args.sizes:
+        for mode in args.modes:
+            single_time = None
+            for workers in (args.threads if mode == 'ctr' else [1]):
+                frame_time, throughput = benchmark(mode, roi_size, args.faces, args.repeats, workers, args.chunk_size)
+                single_time = single_time or frame_time
+                x.add_row([roi_size, mode, workers, '{:.2f}'.format(frame_time * 1000), '{:.1f}'.format(throughput),
+                           '{:.2f}x'.format(single_time / frame_time)])
+    print(x)
+
+    exit(0)
@@ -0,0 +1,73 @@
+""" Compare the write time and size per frame of the formats main.py can store encrypted frames in (IMAGE_FORMAT in
+config.json), and check that the encrypted faces survive so they can be decrypted. Frames are read from --image or
+generated, with --faces encrypted faces of --face_size pixels. The size of ROI records does not include their
+background keyframe, which is written once every KEYFRAME_INTERVAL seconds. """
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+import prettytable as pt
+
+from src.jetson.encryptor import Encryptor, clip_boxes
+from src.jetson.storage import IMAGE_FORMATS, decode_frame, encode_frame, encode_keyframe
+
+
+def benchmark(img, boxes, image_format, repeats):
+    """
+    Time the encoding of an encrypted frame.
+    @param img: A frame.
+    @param boxes: Face boxes of the frame.
+    @param image_format: One of the IMAGE_FORMATS in src/jetson/storage.py.
+    @param repeats: Number of times the frame is encoded.
+    @return: Mean encoding time in seconds, bytes per frame, and whether the faces decrypt exactly.
+    """
+
+    encryptor = Encryptor()
+    encrypted, init_vec_list = encryptor.encryptFrame(img.copy(), boxes)
+    coordinates = clip_boxes(boxes, img.shape)
+
+    keyframe = 'keyframe.efr' if image_format == 'roi' else None
+    since = time.perf_counter()
+    for _ in range(repeats):
+        data = encode_frame(encrypted, coordinates, image_format, keyframe)
+    encode_time = (time.perf_counter() - since) / repeats
+
+    background = None
+    if keyframe is not None:
+        background = decode_frame(encode_keyframe(encrypted, coordinates))
+    decrypted = encryptor.decryptFrame(decode_frame(data, background), boxes, init_vec_list)
+    exact = all(np.array_equal(decrypted[y1:y2, x1:x2], img[y1:y2, x1:x2]) for x1, y1, x2, y2 in coordinates)
+
+    return encode_time, len(data), exact
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the write time and size of the encrypted frame formats.')
+    parser.add_argument('--image', type=str, help='Frame to encrypt. A smooth frame of --size is generated if not '
+                                                  'given.', default=None)
+    parser.add_argument('--size', type=int, nargs=2, help='Width and height of the generated frame.',
+                        default=[820, 616])
+    parser.add_argument('--faces', type=int, help='Number of faces per frame.', default=4)
+    parser.add_argument('--face_size', type=int, help='Height and width of each face in pixels.', default=96)
+    parser.add_argument('--repeats', type=int, help='Number of frames encoded per measurement.', default=20)
+    args = parser.parse_args()
+
+    if args.image is not None:
+        img = cv2.imread(args.image)
+    else:
+        img = cv2.resize(np.random.randint(0, 256, (8, 8, 3), dtype=np.uint8), tuple(args.size))
+    rng = np.random.RandomState(0)
+    boxes = [(x, y, x + args.face_size, y + args.face_size)
+             for x, y in zip(rng.randint(0, img.shape[1] - args.face_size, args.faces),
+                             rng.randint(0, img.shape[0] - args.face_size, args.faces))]
+
+    x = pt.PrettyTable()
+    x.field_names = ['Format', 'Write time (ms)', 'KB per frame', 'Faces exact']
+    for image_format in IMAGE_FORMATS:
+        encode_time, size, exact = benchmark(img, boxes, image_format, args.repeats)
+        x.add_row([image_format, '{:.2f}'.format(encode_time * 1000), '{:.1f}'.format(size / 1024), exact])
+    print(x)
+
+    exit(0)
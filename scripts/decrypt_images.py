@@ -0,0 +1,164 @@
+""" Recover the faces of the encrypted images taken in a date/time range for authorised review. The images and the
+initialization vectors of their faces are looked up in the IMAGE and BBOX tables, the images are read from the
+directory main.py wrote them to (in any IMAGE_FORMAT of config.json, as files or in segments), decrypted in a pool of
+worker processes and written to the output directory as lossless PNGs. Decrypting needs the key file main.py encrypted
+with (ENCRYPTION_KEY_FILE in config.json). Faces of images stored as JPEG cannot be recovered exactly, the lossy
+compression alters the encrypted pixels. """
+
+import argparse
+import datetime
+import functools
+import itertools
+import os
+import time
+from multiprocessing import Pool
+
+import cv2
+from tqdm import tqdm
+
+from src.db.db_connection import sql_select
+from src.jetson.encryptor import Encryptor, load_key, parse_init_vec
+from src.jetson.storage import read_frame, read_segment_frame
+
+SELECT_BOXES = ("SELECT IMAGE.Image_Name, BBOX.X_Min, BBOX.Y_Min, BBOX.X_Max, BBOX.Y_Max, BBOX.Init_Vector{} "
+                "FROM IMAGE JOIN BBOX ON IMAGE.Image_Name = BBOX.Image_Name "
+                "WHERE TIMESTAMP(IMAGE.Image_Date, IMAGE.Image_Time) BETWEEN %(start)s AND %(end)s "
+                "ORDER BY IMAGE.Image_Date, IMAGE.Image_Time, IMAGE.Image_Name, BBOX.`{}`")
+# Columns of images recorded in segment files (RECORD_SEGMENTS in config.json)
+SEGMENT_COLUMNS = ", IMAGE.Segment_Name, IMAGE.Frame_Index"
+# Columns of BBOX in the database, the only values accepted for --bbox_key
+SHOW_BBOX_COLUMNS = "SHOW COLUMNS FROM BBOX"
+
+# Encryptor of each worker process, created by init_worker
+encryptor = None
+
+
+def parse_time(value, end=False):
+    """
+    Parse a date/time argument.
+    @param value: An ISO date ('2020-10-01') or date and time ('2020-10-01 13:30:00').
+    @param end: A date alone means the end of the day instead of its start.
+    @return: A datetime.
+    """
+
+    if len(value) == len('YYYY-MM-DD'):
+        date = datetime.date.fromisoformat(value)
+        return datetime.datetime.combine(date, datetime.time.max if end else datetime.time.min)
+    return datetime.datetime.fromisoformat(value)
+
+
+def check_bbox_key(bbox_key, columns):
+    """
+    Check the column the faces of an image are ordered by before it is put into the query.
+    @param bbox_key: Column name given with --bbox_key.
+    @param columns: Column names of the BBOX table.
+    @return: The column name.
+    """
+
+    if bbox_key not in columns:
+        raise ValueError('BBOX has no column {!r}, expected one of {}'.format(bbox_key, ', '.join(columns)))
+    return bbox_key
+
+
+def group_images(rows):
+    """
+    Group the rows of the BBOX query by image.
+    @param rows: (image name, x min, y min, x max, y max, init vector[, segment name, frame index]) rows, the rows of
+    an image next to each other, in the order they were inserted.
+    @return: A generator of (image name, boxes, init vectors, (segment name, frame index) or None) tuples, the boxes of
+    an image in the order they were encrypted: by their offset in the encrypted buffer, or in row order for faces
+    encrypted one by one.
+    """
+
+    for image_name, image_rows in itertools.groupby(rows, key=lambda row: row[0]):
+        image_rows = list(image_rows)
+        init_vecs = [bytes(row[5]) for row in image_rows]
+        offsets = [parse_init_vec(init_vec)[3] for init_vec in init_vecs]
+        order = range(len(image_rows))
+        if None not in offsets:
+            order = sorted(order, key=lambda i: offsets[i])
+        segment = tuple(image_rows[0][6:8]) if len(image_rows[0]) > 6 and image_rows[0][6] else None
+        yield image_name, [image_rows[i][1:5] for i in order], [init_vecs[i] for i in order], segment
+
+
+def init_worker(key):
+    """
+    Create the encryptor of a worker process.
+    @param key: The encryption key.
+    """
+
+    global encryptor
+    encryptor = Encryptor(key=key)
+
+
+def decrypt_image(image, input_dir, output_dir):
+    """
+    Decrypt the faces of an image and write it to the output directory as a PNG.
+    @param image: An (image name, boxes, init vectors, segment) tuple returned by group_images.
+    @param input_dir: Directory of the encrypted images or segments.
+    @param output_dir: Directory the decrypted image is written to.
+    @return: The image name and the number of bytes of the image, 0 if the image is missing.
+    """
+
+    image_name, boxes, init_vecs, segment = image
+    if segment is not None:
+        img = read_segment_frame(os.path.join(input_dir, segment[0]), int(segment[1]))
+    else:
+        img = read_frame(os.path.join(input_dir, image_name))
+    if img is None:
+        return image_name, 0
+
+    img = encryptor.decryptFrame(img, boxes, init_vecs)
+    # images written by the image writer are named by their date/hour subdirectory
+    output_path = os.path.join(output_dir, os.path.splitext(image_name)[0] + '.png')
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    cv2.imwrite(output_path, img)
+    return image_name, img.nbytes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Decrypt the faces of the images taken in a date/time range.')
+    parser.add_argument('--start', type=str, required=True, help='Start of the range, an ISO date or date and time '
+                                                                 '(e.g. 2020-10-01 or "2020-10-01 13:30:00").')
+    parser.add_argument('--end', type=str, required=True, help='End of the range, a date alone includes the whole '
+                                                               'day.')
+    parser.add_argument('--input_dir', type=str, help='Directory of the encrypted images (OUTPUT_DIR of main.py).',
+                        default='encrypt_imgs')
+    parser.add_argument('--output_dir', type=str, help='Directory the decrypted images are written to.',
+                        default='decrypted_imgs')
+    parser.add_argument('--key_file', type=str, required=True, help='File holding the encryption key as a hex '
+                                                                    'string.')
+    parser.add_argument('--workers', type=int, help='Number of decrypting processes.', default=os.cpu_count())
+    parser.add_argument('--bbox_key', type=str, required=True, help='Auto-increment key column of BBOX. Faces '
+                                                                    'encrypted one by one (legacy mode) are '
+                                                                    'decrypted in its order.')
+    parser.add_argument('--segments', action='store_true', help='Read images recorded in segment files (needs the '
+                                                                'Segment_Name and Frame_Index columns of IMAGE).')
+    args = parser.parse_args()
+
+    start, end = parse_time(args.start), parse_time(args.end, end=True)
+    os.makedirs(args.output_dir, exist_ok=True)
+    bbox_key = check_bbox_key(args.bbox_key, [row[0] for row in sql_select(SHOW_BBOX_COLUMNS)])
+    query = SELECT_BOXES.format(SEGMENT_COLUMNS if args.segments else '', bbox_key)
+    images = group_images(sql_select(query, {'start': start, 'end': end}))
+    decrypt = functools.partial(decrypt_image, input_dir=args.input_dir, output_dir=args.output_dir)
+
+    decrypted, missing, total_bytes = 0, [], 0
+    since = time.time()
+    with Pool(args.workers, initializer=init_worker, initargs=(load_key(args.key_file),)) as pool:
+        progress = tqdm(pool.imap_unordered(decrypt, images, chunksize=4), unit='img')
+        for image_name, image_bytes in progress:
+            if image_bytes == 0:
+                missing.append(image_name)
+                continue
+            decrypted += 1
+            total_bytes += image_bytes
+            progress.set_postfix(MBps='{:.1f}'.format(total_bytes / 1e6 / (time.time() - since)))
+
+    elapsed = time.time() - since
+    print('Decrypted {} images ({:.1f} MB) in {:.1f}s: {:.1f} images/s, {:.1f} MB/s'.format(
+        decrypted, total_bytes / 1e6, elapsed, decrypted / max(elapsed, 1e-9), total_bytes / 1e6 / max(elapsed, 1e-9)))
+    if missing:
+        print('{} images were not found in {}, e.g. {}'.format(len(missing), args.input_dir, missing[0]))
+
+    exit(0)
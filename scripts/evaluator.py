@@ -10,7 +10,7 @@ from scripts.goggle_classifier import get_model
 from scripts.constants import VIDEO_EXT
 from scripts.utils import check_rotation, correct_rotation, bbox_iou
 from src.jetson.face_detector import FaceDetector
-from src.jetson.classifier import Classifier
+from src.jetson.classifier import Classifier, load_classifier
 
 
 class Evaluator():
@@ -42,7 +42,7 @@ class Evaluator():
         self.detector = FaceDetector(detector=detector, detector_type=detector_type,
                                      cuda=cuda and torch.cuda.is_available(), set_default_dev=True)
 
-        weights = torch.load(classifier, map_location=self.device)
+        weights = load_classifier(classifier, self.device)
         if isinstance(weights, dict):
             # if the .pth is just a state_dict, we need to
             # load the model from goggle_classifier.py
@@ -11,12 +11,14 @@ from tqdm import tqdm
 
 from scripts.constants import IMAGE_EXT, VIDEO_EXT
 from scripts.utils import check_rotation, correct_rotation
+from src.jetson.classifier import EYE_SIZE, crop_eyes
 from src.jetson.face_detector import FaceDetector
 
 """
 Given a folder of images or videos, run a face detector (literally a FaceDetector) on all images 
 or videos in the folder. Detect and crop all faces in the images or every 1/rate frames from the videos. 
-Save the resulting crops as .jpgs in an output folder. 
+Save the resulting crops as .jpgs in an output folder. With --eyes, aligned eye-band crops are saved instead, 
+to train an eye classifier (goggle_classifier.py --eyes). 
 """
 
 warnings.filterwarnings('once')
@@ -48,16 +50,23 @@ def get_videos(input_dir):
 
 
 def crop_and_save_img(frame, file_num, output_dir):
-    """Run frame through FaceDetector and save the cropped face image."""
+    """Run frame through FaceDetector and save the cropped face (or eye-band) image."""
     if frame is not None and not 0:
+        if args.eyes:
+            _, landmarks = face_detector.detect(frame, landmarks=True)
+            for face_num, landmark in enumerate(landmarks):
+                eyes = crop_eyes(frame, landmark, EYE_SIZE)
+                cv2.imwrite(os.path.join(output_dir, f'{file_num}_{face_num}.jpg'), eyes)
+            return
+
         boxes = face_detector.detect(frame)
-        for box in boxes:
+        for face_num, box in enumerate(boxes):
             # Get individual coordinates as integers
             x1, y1, x2, y2, _ = [int(math.ceil(b)) for b in box]
             face = frame[y1:y2, x1:x2]
             if face is None or 0 in face.shape:
                 continue
-            face_file_name = os.path.join(output_dir, f'{file_num}.jpg')
+            face_file_name = os.path.join(output_dir, f'{file_num}_{face_num}.jpg')
             cv2.imwrite(face_file_name, face)
 
 
@@ -101,6 +110,8 @@ if __name__ == "__main__":
     parser.add_argument('--images', default=False, action='store_true',
                         help='Crop faces from images instead of videos.')
     parser.add_argument('--rate', default=5, type=int, help="Crop faces from every 1/rate frames of the video.")
+    parser.add_argument('--eyes', default=False, action='store_true',
+                        help='Save aligned eye-band crops instead of faces (retinaface only).')
     parser.add_argument('--horiz', default=False, action='store_true', help='Rotate the video. If your output images '
                                                                             'are all sideways, enable this.')
     args = parser.parse_args()
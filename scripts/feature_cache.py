@@ -0,0 +1,165 @@
+""" Train a Mobilenet with frozen layers from a cache of features. The frozen layers of Mobilenet (see the --frozen
+option of goggle_classifier.py) are run once over the dataset and their outputs are stored in memory-mapped files.
+Only the unfrozen layers are trained, reading their inputs from the cache instead of decoding, augmenting and running
+every image through the frozen layers every epoch. The .pth file generated is the entire Mobilenet and is used in
+main.py for classification. """
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import Dataset, DataLoader
+from torch.utils.tensorboard import SummaryWriter
+
+import scripts.goggle_classifier as goggle_classifier
+from scripts.goggle_classifier import MapDataset, classifier_transforms, get_metrics, get_model, split_dataset, \
+    train_model
+
+
+class MobilenetSuffix(nn.Module):
+    """The unfrozen layers of a Mobilenet, from the first unfrozen feature layer to the classifier."""
+
+    def __init__(self, model, last_layer_to_freeze):
+        """
+        @param model: A Mobilenet. The layers are shared, so training the suffix trains the model.
+        @param last_layer_to_freeze: The last frozen feature layer of the model.
+        """
+        super().__init__()
+        self.features = model.features[int(last_layer_to_freeze) + 1:]
+        self.classifier = model.classifier
+
+    def forward(self, x):
+        x = self.features(x)
+        x = nn.functional.adaptive_avg_pool2d(x, 1).reshape(x.shape[0], -1)
+        return self.classifier(x)
+
+
+class FeatureCacheDataset(Dataset):
+    """Dataset serving the cached features and labels written by build_feature_cache."""
+
+    def __init__(self, path):
+        """
+        @param path: Path of the cache, without extension.
+        """
+        with open(path + '.json', 'r') as meta_file:
+            meta = json.load(meta_file)
+
+        self.features = np.memmap(path + '.dat', dtype=meta['dtype'], mode='r', shape=tuple(meta['shape']))
+        self.labels = np.load(path + '_labels.npy')
+
+    def __getitem__(self, item):
+        return torch.from_numpy(self.features[item].astype(np.float32)), int(self.labels[item])
+
+    def __len__(self):
+        return len(self.labels)
+
+
+def build_feature_cache(prefix, dataset, path, views=1, batch_size=32, num_workers=4, dtype=np.float16):
+    """
+    Run the frozen layers of a Mobilenet once over a dataset and store their outputs in a memory-mapped file.
+    @param prefix: The frozen layers (e.g. model.features[:10]).
+    @param dataset: Dataset of transformed images and labels.
+    @param path: Path of the cache, without extension. <path>.dat holds the features, <path>_labels.npy
+    the labels and <path>.json the shape of the features.
+    @param views: Number of times each image is passed through the frozen layers. Use more than one
+    view with a random training augmentation to cache several augmented versions of each image.
+    @param batch_size: Number of images run through the frozen layers at once.
+    @param num_workers: Number of DataLoader workers decoding and transforming the images.
+    @param dtype: Data type the features are stored as. float16 halves the size of the cache.
+    @return: A FeatureCacheDataset serving the cache.
+    """
+
+    prefix = prefix.to(goggle_classifier.device).eval()
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+
+    features = None
+    labels = np.zeros(views * len(dataset), dtype=np.int64)
+    start = 0
+    since = time.time()
+    with torch.no_grad():
+        for view in range(views):
+            for inputs, targets in loader:
+                outputs = prefix(inputs.to(goggle_classifier.device)).cpu().numpy()
+                if features is None:
+                    # the shape of the features is known after the first batch
+                    shape = (views * len(dataset),) + outputs.shape[1:]
+                    features = np.memmap(path + '.dat', dtype=dtype, mode='w+', shape=shape)
+
+                features[start:start + len(outputs)] = outputs
+                labels[start:start + len(outputs)] = targets.numpy()
+                start += len(outputs)
+
+    features.flush()
+    np.save(path + '_labels.npy', labels)
+    with open(path + '.json', 'w') as meta_file:
+        json.dump({'shape': list(features.shape), 'dtype': np.dtype(dtype).name}, meta_file)
+
+    print('Cached {} features of shape {} in {:.0f}s'.format(len(labels), features.shape[1:], time.time() - since))
+    del features
+
+    return FeatureCacheDataset(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Train the unfrozen layers of a Mobilenet classifier from a cache '
+                                                 'of the outputs of its frozen layers.')
+    parser.add_argument('--directory', type=str, help='Relative directory location of dataset in Imagefolder '
+                                                      'structure.')
+    parser.add_argument('--frozen', type=str, help='Last layer to freeze in mobilenet-v2 model. Total 19 layers ('
+                                                   '0-18).', default='9')
+    parser.add_argument('--aug', type=int, help='Augmentations of the cached training views (see goggle_classifier.py '
+                                                '--aug). Only used if --views is more than 0.', default=3)
+    parser.add_argument('--views', type=int, help='Number of augmented views of each training image to cache. 0 '
+                                                  'caches one view with the deterministic validation transforms.',
+                        default=0)
+    parser.add_argument('--cache_dir', type=str, help='Directory the feature cache is written to.',
+                        default='feature_cache')
+    parser.add_argument('--batch_size', type=int, help='Training batch size.', default=32)
+    parser.add_argument('--model', type=str, help='Relative location of a model to load. If given, training will '
+                                                  'start from this point.', default=None)
+    args = parser.parse_args()
+
+    if args.frozen == '-1':
+        parser.error('--frozen must be at least 0, there is nothing to cache without frozen layers')
+
+    goggle_classifier.writer = SummaryWriter()
+    device = goggle_classifier.device
+    print(f"Device is {device}")
+
+    if args.model is not None:
+        model = torch.load(args.model)
+    else:
+        model = get_model(args.frozen)
+    model = model.to(device)
+
+    with open("params.json", "r") as params_file:
+        params = json.load(params_file)
+    goggle_classifier.params = params
+
+    face_datasets, class_names = split_dataset(args.directory)
+    val_transform = classifier_transforms['valaug1' if args.aug == 1 else 'valaug2']
+    train_transform = classifier_transforms['trainaug' + str(args.aug)] if args.views > 0 else val_transform
+
+    # Frozen layers are cached in eval mode, so their BatchNorm statistics are no longer updated
+    os.makedirs(args.cache_dir, exist_ok=True)
+    prefix = model.features[:int(args.frozen) + 1]
+    caches = {'train': build_feature_cache(prefix, MapDataset(face_datasets['train'], train_transform),
+                                           os.path.join(args.cache_dir, 'train'), views=max(1, args.views)),
+              'val': build_feature_cache(prefix, MapDataset(face_datasets['val'], val_transform),
+                                         os.path.join(args.cache_dir, 'val'))}
+
+    data_loaders = {'train': DataLoader(caches['train'], batch_size=args.batch_size, shuffle=True),
+                    'val': DataLoader(caches['val'], batch_size=args.batch_size, shuffle=False)}
+    dataset_sizes = {x: len(caches[x]) for x in ['train', 'val']}
+
+    suffix = train_model(MobilenetSuffix(model, args.frozen), data_loaders, dataset_sizes, params)
+    torch.save(model, 'trained_model.pth')
+
+    # show some results of the training
+    get_metrics(suffix, data_loaders, class_names)
+
+    exit(0)
@@ -1,8 +1,12 @@
 from __future__ import print_function, division
 
 import argparse
+import copy
+import inspect
 import json
 import os
+import platform
+import tempfile
 import time
 import warnings
 
@@ -11,17 +15,28 @@ import prettytable as pt
 import sklearn.metrics as skm
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import torch.optim as optim
 from torch.optim import lr_scheduler
 from torch.utils.data import Dataset, DataLoader
 from torch.utils.tensorboard import SummaryWriter
 from torchvision import transforms, datasets, models
+from torchvision.models import quantization as quantizable_models
+
+from scripts.image_cache import CACHE_SIZE, load_image_cache
+from src.jetson.classifier import EYE_SIZE
 
 # 3 classes to classify between
 NUM_CLASSES = 3
 # 80/20 training/validation split
 VAL_SPLIT = .2
 
+# Training device, TensorBoard writer and hyperparameters. The writer and hyperparameters are set when this script
+# is run, other scripts using train_model and get_metrics may replace all three
+device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+writer = None
+params = {}
+
 """ Train a Mobilenet model to classify images of faces between wearing goggles, glasses, or neither. The .pth file 
 generated is used in main.py for classification. Use Tensorboard (tensorboard --logdir=runs) to see training and 
 validation graphs for loss and accuracy. """
@@ -81,6 +96,20 @@ classifier_transforms = {
         transforms.ToTensor(),
         transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
     ]),
+    # aligned eye-band crops (face_extractor.py --eyes), (height, width) is EYE_SIZE reversed
+    'traineyes': transforms.Compose([
+        transforms.Resize((EYE_SIZE[1], EYE_SIZE[0])),
+        transforms.RandomHorizontalFlip(0.5),
+        transforms.ColorJitter(0.5, 0.5),
+        transforms.RandomRotation(10),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    ]),
+    'valeyes': transforms.Compose([
+        transforms.Resize((EYE_SIZE[1], EYE_SIZE[0])),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    ]),
 }
 
 """
@@ -129,37 +158,321 @@ def get_model(last_layer_to_freeze='-1'):
     return model
 
 
-def load_data(data_location, data_transforms):
+def get_student_model(width_mult=0.5, input_size=160):
     """
-    Create a Pytorch Dataloader for the images specified by args.directory.
+    Initialize a reduced width Mobilenet that runs at a lower input resolution, to be trained
+    with knowledge distillation from a full size model.
+    @param width_mult: Multiplier of the number of channels of every Mobilenet layer.
+    @param input_size: Height and width of the student input. Stored as model.input_size so that
+    the Classifier in src/jetson/classifier.py resizes faces to it.
+    @return: An untrained student Mobilenet.
+    """
+
+    model = models.mobilenet_v2(width_mult=width_mult)
+    model.classifier = nn.Sequential(
+        nn.Dropout(0.2),
+        nn.Linear(model.last_channel, NUM_CLASSES)
+    )
+    model.input_size = input_size
+
+    return model
+
+
+def input_shape(input_size):
+    """
+    Convert an input size to a (height, width) tuple.
+    @param input_size: Height and width of a square input, or a (width, height) tuple.
+    """
+
+    if isinstance(input_size, int):
+        return input_size, input_size
+    return input_size[1], input_size[0]
+
+
+def fit_inputs(model, inputs):
+    """
+    Downscale a batch of images to the input size of a model, if it has one (see get_student_model).
+    @param model: The model the images are passed to.
+    @param inputs: A batch of images.
+    @return: The resized batch of images.
+    """
+
+    input_size = getattr(model, 'input_size', None)
+    if input_size is None or tuple(inputs.shape[-2:]) == input_shape(input_size):
+        return inputs
+
+    return F.interpolate(inputs, size=input_shape(input_size), mode='area')
+
+
+def distillation_loss(outputs, teacher_outputs, labels, temperature, alpha):
+    """
+    Knowledge distillation loss: a weighted sum of the KL divergence between the softened student
+    and teacher class probabilities, and the cross entropy with the true labels.
+    @param outputs: Student logits.
+    @param teacher_outputs: Teacher logits for the same images.
+    @param labels: True labels.
+    @param temperature: Softmax temperature, higher values give softer targets.
+    @param alpha: Weight of the soft target loss.
+    @return: The loss.
+    """
+
+    soft_loss = F.kl_div(F.log_softmax(outputs / temperature, dim=1), F.softmax(teacher_outputs / temperature, dim=1),
+                         reduction='batchmean')
+    # scale by T^2 so the gradients of the soft targets keep their magnitude
+    return alpha * temperature ** 2 * soft_loss + (1 - alpha) * F.cross_entropy(outputs, labels)
+
+
+def prune_conv(conv, keep, dim):
+    """
+    Build a smaller copy of a convolution that keeps only some of its input or output channels.
+    @param conv: The convolution to be pruned.
+    @param keep: Indices of the channels to keep.
+    @param dim: 0 to prune output channels, 1 to prune input channels. Depthwise convolutions
+    are pruned in both.
+    @return: The pruned convolution.
+    """
+
+    depthwise = conv.groups > 1 and conv.groups == conv.in_channels
+    in_channels = len(keep) if dim == 1 or depthwise else conv.in_channels
+    out_channels = len(keep) if dim == 0 or depthwise else conv.out_channels
+
+    pruned = nn.Conv2d(in_channels, out_channels, conv.kernel_size, conv.stride, conv.padding, conv.dilation,
+                       groups=len(keep) if depthwise else 1, bias=conv.bias is not None)
+    with torch.no_grad():
+        weight = conv.weight[keep] if dim == 0 or depthwise else conv.weight[:, keep]
+        pruned.weight.copy_(weight)
+        if conv.bias is not None:
+            pruned.bias.copy_(conv.bias[keep] if dim == 0 or depthwise else conv.bias)
+
+    return pruned.to(conv.weight.device)
+
+
+def prune_batch_norm(bn, keep):
+    """
+    Build a smaller copy of a BatchNorm layer that keeps only some of its channels.
+    @param bn: The BatchNorm layer to be pruned.
+    @param keep: Indices of the channels to keep.
+    @return: The pruned BatchNorm layer.
+    """
+
+    pruned = nn.BatchNorm2d(len(keep), bn.eps, bn.momentum)
+    with torch.no_grad():
+        pruned.weight.copy_(bn.weight[keep])
+        pruned.bias.copy_(bn.bias[keep])
+        pruned.running_mean.copy_(bn.running_mean[keep])
+        pruned.running_var.copy_(bn.running_var[keep])
+
+    return pruned.to(bn.weight.device)
+
+
+def prune_model(model, ratio, divisor=8):
+    """
+    Structured pruning of Mobilenet. The hidden (expanded) channels of every inverted residual block
+    are ranked by the L1 norm of their expansion filters and the weakest are physically removed from
+    the expansion, depthwise and projection layers. Block inputs and outputs keep their size, so
+    residual connections are unchanged.
+    @param model: A trained Mobilenet. It is not modified.
+    @param ratio: Fraction of the hidden channels of each block to remove.
+    @param divisor: The number of kept channels is rounded to a multiple of this, which runs faster.
+    @return: A smaller Mobilenet that should be fine-tuned with train_model.
+    """
+
+    model = copy.deepcopy(model)
+    for block in model.features:
+        # blocks with an expansion layer: expand (conv, bn, relu), depthwise (conv, bn, relu), project conv, bn
+        if not hasattr(block, 'conv') or len(block.conv) != 4:
+            continue
+
+        expand, depthwise, project = block.conv[0], block.conv[1], block.conv[2]
+        hidden = expand[0].out_channels
+        num_keep = max(divisor, int(round(hidden * (1 - ratio) / divisor)) * divisor)
+        if num_keep >= hidden:
+            continue
+
+        importance = expand[0].weight.detach().abs().sum(dim=(1, 2, 3))
+        keep = torch.sort(torch.argsort(importance, descending=True)[:num_keep])[0]
+
+        expand[0] = prune_conv(expand[0], keep, 0)
+        expand[1] = prune_batch_norm(expand[1], keep)
+        depthwise[0] = prune_conv(depthwise[0], keep, 0)
+        depthwise[1] = prune_batch_norm(depthwise[1], keep)
+        block.conv[2] = prune_conv(project, keep, 1)
+
+    return model
+
+
+def count_parameters(model):
+    """
+    Number of parameters of a model.
+    @param model: An eager model.
+    """
+
+    return sum(param.numel() for param in model.parameters())
+
+
+def get_qat_model(float_model, backend):
+    """
+    Initialize a quantizable Mobilenet with the weights of a trained float Mobilenet and prepare it for
+    quantization-aware training. Conv, BatchNorm and ReLU layers are fused and fake quantization is
+    inserted, so fine-tuning learns weights that are robust to INT8 rounding.
+    @param float_model: A trained Mobilenet (returned by get_model or train_model).
+    @param backend: Quantized engine the model will run on, 'fbgemm' (x86) or 'qnnpack' (ARM, Jetson).
+    @return: A Mobilenet prepared for quantization-aware training.
+    """
+
+    model = quantizable_models.mobilenet_v2(pretrained=False, quantize=False)
+    model.classifier = nn.Sequential(
+        nn.Dropout(0.2),
+        nn.Linear(model.last_channel, NUM_CLASSES)
+    )
+    model.load_state_dict(float_model.state_dict())
+    # input size and crop mode of student and eye models, read by the Classifier
+    for name in ('input_size', 'crop_mode'):
+        if hasattr(float_model, name):
+            setattr(model, name, getattr(float_model, name))
+
+    # fusing in training mode keeps BatchNorm layers trainable. torchvision 0.12 and later need is_qat for this,
+    # earlier versions fuse for training whenever the model is in training mode
+    model.train()
+    if 'is_qat' in inspect.signature(model.fuse_model).parameters:
+        model.fuse_model(is_qat=True)
+    else:
+        model.fuse_model()
+    model.qconfig = torch.quantization.get_default_qat_qconfig(backend)
+    torch.quantization.prepare_qat(model, inplace=True)
+
+    return model
+
+
+def convert_qat_model(qat_model):
+    """
+    Convert a model trained with quantization-aware training to an INT8 TorchScript model.
+    @param qat_model: A model returned by get_qat_model and fine-tuned with train_model.
+    @return: The quantized TorchScript model, which runs on the CPU.
+    """
+
+    qat_model = copy.deepcopy(qat_model).cpu().eval()
+    quantized_model = torch.quantization.convert(qat_model)
+
+    return torch.jit.script(quantized_model)
+
+
+def measure_latency(model, input_size=None, runs=50, warmup=10):
+    """
+    Measure the average CPU latency of classifying a single image.
+    @param model: The model to be timed.
+    @param input_size: Height and width of the model input, or a (width, height) tuple. Defaults to
+    model.input_size, or 224.
+    @param runs: Number of timed forward passes.
+    @param warmup: Number of untimed forward passes run first.
+    @return: Average latency in milliseconds.
+    """
+
+    if input_size is None:
+        input_size = getattr(model, 'input_size', 224)
+
+    model = copy.deepcopy(model).cpu().eval()
+    inputs = torch.randn((1, 3) + input_shape(input_size))
+
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(inputs)
+        since = time.time()
+        for _ in range(runs):
+            model(inputs)
+
+    return (time.time() - since) / runs * 1000
+
+
+def model_size(model):
+    """
+    Size of the saved model in megabytes.
+    @param model: An eager or TorchScript model.
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'model.pt')
+        if isinstance(model, torch.jit.ScriptModule):
+            torch.jit.save(model, path)
+        else:
+            torch.save(model.state_dict(), path)
+        return os.path.getsize(path) / 1e6
+
+
+def compare_models(results):
+    """
+    Print a table comparing the accuracy, CPU latency, throughput and size of models.
+    @param results: Dictionary of model name -> (accuracy, latency in ms, size in MB).
+    """
+
+    x = pt.PrettyTable()
+    x.field_names = ['Model', 'Accuracy', 'CPU latency (ms)', 'Throughput (img/s)', 'Size (MB)']
+    for name, (acc, latency, size) in results.items():
+        x.add_row([name, '{:.4f}'.format(acc), '{:.2f}'.format(latency), '{:.1f}'.format(1000 / latency),
+                   '{:.2f}'.format(size)])
+
+    print(x)
+
+
+def split_dataset(data_location, cache=None, seed=None):
+    """
+    Randomly split the images specified by args.directory into a training and a validation set.
     @param data_location: Directory in Imagefolder structure containing the images to train on.
-    @param data_transforms: Dictionary of 'train' and 'val' -> torchvision.transforms.Compose dicts.
-    @return: A dictionary containing a 'train' and 'val' DataLoader,
-    size of training and validation datasets, and dataset class names.
+    @param cache: Optional image cache (see image_cache.py) to read the decoded images from instead.
+    @param seed: Optional seed of the split, so that several runs validate on the same images.
+    @return: A dictionary containing the 'train' and 'val' subsets (of PIL images and labels),
+    and dataset class names.
     """
 
-    dataset = datasets.ImageFolder(os.path.abspath(data_location))
+    if cache is not None:
+        dataset = cache
+    else:
+        dataset = datasets.ImageFolder(os.path.abspath(data_location))
 
     val_size = int(VAL_SPLIT * len(dataset))
     train_size = len(dataset) - val_size
     face_datasets = {}
-    face_datasets['train'], face_datasets['val'] = torch.utils.data.random_split(dataset, [train_size, val_size])
+    # random_split only takes a generator from torch 1.6, the indices are shuffled the same way here
+    generator = torch.Generator().manual_seed(seed) if seed is not None else None
+    indices = torch.randperm(len(dataset), generator=generator).tolist()
+    face_datasets['train'] = torch.utils.data.Subset(dataset, indices[:train_size])
+    face_datasets['val'] = torch.utils.data.Subset(dataset, indices[train_size:])
+
+    return face_datasets, dataset.classes
+
+
+def load_data(data_location, data_transforms, batch_size=4, num_workers=4, pin_memory=False, cache=None, seed=None):
+    """
+    Create a Pytorch Dataloader for the images specified by args.directory.
+    @param data_location: Directory in Imagefolder structure containing the images to train on.
+    @param data_transforms: Dictionary of 'train' and 'val' -> torchvision.transforms.Compose dicts.
+    @param batch_size: Number of images per batch.
+    @param num_workers: Number of DataLoader worker processes.
+    @param pin_memory: Copy batches into pinned memory, which speeds up transfers to the GPU.
+    @param cache: Optional image cache (see image_cache.py) to read the decoded images from.
+    @param seed: Optional seed of the training/validation split.
+    @return: A dictionary containing a 'train' and 'val' DataLoader,
+    size of training and validation datasets, and dataset class names.
+    """
+
+    face_datasets, class_names = split_dataset(data_location, cache, seed)
 
     # use MapDataset to give train and val splits different data augmentations
     face_datasets['train'] = MapDataset(face_datasets['train'], data_transforms['train'])
     face_datasets['val'] = MapDataset(face_datasets['val'], data_transforms['val'])
 
-    data_loaders = {'train': DataLoader(face_datasets['train'], batch_size=4,
-                                        shuffle=True, num_workers=4),
-                    'val': DataLoader(face_datasets['val'], batch_size=4,
-                                      shuffle=True, num_workers=4)}
+    data_loaders = {'train': DataLoader(face_datasets['train'], batch_size=batch_size,
+                                        shuffle=True, num_workers=num_workers, pin_memory=pin_memory),
+                    'val': DataLoader(face_datasets['val'], batch_size=batch_size,
+                                      shuffle=True, num_workers=num_workers, pin_memory=pin_memory)}
     dataset_sizes = {x: len(face_datasets[x]) for x in ['train', 'val']}
 
-    print('class_names are {}'.format(dataset.classes))
-    return data_loaders, dataset_sizes, dataset.classes
+    print('class_names are {}'.format(class_names))
+    return data_loaders, dataset_sizes, class_names
 
 
-def train_model(model, data_loaders, dataset_sizes, params):
+def train_model(model, data_loaders, dataset_sizes, params, teacher=None, epoch_callback=None,
+                save_checkpoints=True):
     """
     Train model on dataset using hyperparameters from params.json
     @param model: The neural net to be trained.
@@ -168,6 +481,11 @@ def train_model(model, data_loaders, dataset_sizes, params):
     @param dataset_sizes: A dictionary of 'train' -> size of training dataset,
     'val' -> size of validation dataset (returned by load_data).
     @param params: Dictionary of hyperparameters.
+    @param teacher: If given, a trained model whose soft targets the model is distilled from,
+    using the 'temperature' and 'alpha' hyperparameters.
+    @param epoch_callback: If given, called with the epoch and the validation accuracy after every
+    epoch. Training stops early if it returns True.
+    @param save_checkpoints: Save the model every 10 epochs.
     @return: The trained model.
     """
 
@@ -179,6 +497,10 @@ def train_model(model, data_loaders, dataset_sizes, params):
     num_epochs = params['num_epochs']
 
     criterion = nn.CrossEntropyLoss()
+    if teacher is not None:
+        teacher.eval()
+        temperature = params.get('temperature', 4.0)
+        alpha = params.get('alpha', 0.7)
     optimizer = optim.SGD(model.parameters(), lr=lr, momentum=momentum)
     scheduler = lr_scheduler.StepLR(optimizer, step_size=step_size, gamma=gamma)
 
@@ -193,6 +515,7 @@ def train_model(model, data_loaders, dataset_sizes, params):
     for epoch in range(num_epochs):
         print('Epoch {}/{}'.format(epoch, num_epochs - 1))
         print('-' * 10)
+        epoch_since = time.time()
 
         # train and validation phase
         for phase in ['train', 'val']:
@@ -213,10 +536,15 @@ def train_model(model, data_loaders, dataset_sizes, params):
 
                 # forward propagation
                 with torch.set_grad_enabled(phase == 'train'):
-                    outputs = model(inputs)
+                    outputs = model(fit_inputs(model, inputs))
                     _, preds = torch.max(outputs, 1)
 
-                    loss = criterion(outputs, labels)
+                    if teacher is not None:
+                        with torch.no_grad():
+                            teacher_outputs = teacher(fit_inputs(teacher, inputs))
+                        loss = distillation_loss(outputs, teacher_outputs, labels, temperature, alpha)
+                    else:
+                        loss = criterion(outputs, labels)
 
                     # backward propagation
                     if phase == 'train':
@@ -234,18 +562,25 @@ def train_model(model, data_loaders, dataset_sizes, params):
 
             if phase == 'train':
                 scheduler.step()
-                writer.add_scalar('Loss/train', epoch_loss, epoch)
-                writer.add_scalar('Accuracy/train', epoch_acc, epoch)
-            else:
-                writer.add_scalar('Loss/val', epoch_loss, epoch)
-                writer.add_scalar('Accuracy/val', epoch_acc, epoch)
+            if writer is not None:
+                writer.add_scalar('Loss/' + phase, epoch_loss, epoch)
+                writer.add_scalar('Accuracy/' + phase, epoch_acc, epoch)
 
             # Save checkpoints every 10 epochs. In this way we can train until overfitting,
             # then compare an overfit and underfit model trained with the same hyperparameters.
-            if epoch != 0 and epoch % 10 == 0:
+            if save_checkpoints and epoch != 0 and epoch % 10 == 0:
                 print('Saving state, epoch:', epoch)
                 torch.save(model, repr(epoch) + '.pth')
 
+        epoch_time = time.time() - epoch_since
+        print('Epoch time: {:.1f}s\n'.format(epoch_time))
+        if writer is not None:
+            writer.add_scalar('Time/epoch', epoch_time, epoch)
+
+        if epoch_callback is not None and epoch_callback(epoch, float(epoch_acc)):
+            print('Stopping early after epoch', epoch)
+            break
+
     time_elapsed = time.time() - since
     print('Training complete in {:.0f}m {:.0f}s \n'.format(
         time_elapsed // 60, time_elapsed % 60))
@@ -254,9 +589,15 @@ def train_model(model, data_loaders, dataset_sizes, params):
     return model
 
 
-def get_metrics(model, data_loaders, class_names):
+def get_metrics(model, data_loaders, class_names, metrics_device=None):
     """Output statistics from final epoch of training,
-    including precision, recall, and the confusion matrix."""
+    including precision, recall, and the confusion matrix.
+    @param metrics_device: Device to run the model on. Defaults to the training device,
+    quantized models must use the CPU.
+    @return: The validation accuracy."""
+
+    if metrics_device is None:
+        metrics_device = device
 
     model.eval()
     full_correct = []
@@ -265,10 +606,10 @@ def get_metrics(model, data_loaders, class_names):
     # collect true and predicted labels for sklearn
     with torch.no_grad():
         for i, (inputs, labels) in enumerate(data_loaders['val']):
-            inputs = inputs.to(device)
-            labels = labels.to(device)
+            inputs = inputs.to(metrics_device)
+            labels = labels.to(metrics_device)
 
-            outputs = model(inputs)
+            outputs = model(fit_inputs(model, inputs))
             _, preds = torch.max(outputs, 1)
 
             for j in range(inputs.size()[0]):
@@ -279,15 +620,16 @@ def get_metrics(model, data_loaders, class_names):
     fone_score = skm.f1_score(full_correct, full_pred, average="weighted")
     precision = skm.precision_score(full_correct, full_pred, average="weighted")
     recall = skm.recall_score(full_correct, full_pred, average="weighted")
-    cm = skm.confusion_matrix(full_correct, full_pred)
+    cm = skm.confusion_matrix(full_correct, full_pred, labels=list(range(NUM_CLASSES)))
 
     print('F1-score: {}'.format(fone_score))
     print('Precision: {}'.format(precision))
     print('Recall: {}\n'.format(recall))
 
-    writer.add_hparams(params, {'hparam/accuracy': acc, 'hparam/f1_score': fone_score,
-                                'hparam/precision': precision, 'hparam/recall': recall})
-    writer.flush()
+    if writer is not None:
+        writer.add_hparams(params, {'hparam/accuracy': acc, 'hparam/f1_score': fone_score,
+                                    'hparam/precision': precision, 'hparam/recall': recall})
+        writer.flush()
 
     # this may be nice to put into Tensorboard at some point
     print("------------------Confusion matrix------------------")
@@ -302,6 +644,8 @@ def get_metrics(model, data_loaders, class_names):
     print(x)
     print('Columns are actual labels, rows are predicted labels\n\n')
 
+    return acc
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Train a Mobilenet classifier on a set of images.')
@@ -314,6 +658,38 @@ if __name__ == "__main__":
                                                 'and contrast.', default=3)
     parser.add_argument('--model', type=str, help='Relative location of a model to load. If given, training will '
                                                   'start from this point.', default=None)
+    parser.add_argument('--eyes', action='store_true', help='Train an eye classifier on aligned eye-band crops '
+                                                            '(face_extractor.py --eyes) instead of whole faces.')
+    parser.add_argument('--batch_size', type=int, help='Number of images per batch.', default=4)
+    parser.add_argument('--workers', type=int, help='Number of DataLoader worker processes.', default=4)
+    parser.add_argument('--pin_memory', action='store_true', help='Copy batches into pinned memory before they are '
+                                                                  'transferred to the GPU.')
+    parser.add_argument('--cache', type=str, help='Path (without extension) of a decoded image cache. It is built '
+                                                  'from --directory if it does not exist (see image_cache.py).',
+                        default=None)
+    parser.add_argument('--cache_size', type=int, help='Height and width of the images in a new image cache, '
+                                                       'larger than the random crops of training.',
+                        default=CACHE_SIZE)
+    parser.add_argument('--distill', action='store_true', help='Distill the model given by --model (the teacher) '
+                                                               'into a smaller student model.')
+    parser.add_argument('--student_width', type=float, help='Width multiplier of the student Mobilenet.', default=0.5)
+    parser.add_argument('--student_size', type=int, help='Input height and width of the student.', default=160)
+    parser.add_argument('--temperature', type=float, help='Distillation softmax temperature.', default=4.0)
+    parser.add_argument('--alpha', type=float, help='Weight of the distillation loss against the cross entropy '
+                                                    'with the true labels.', default=0.7)
+    parser.add_argument('--prune', action='store_true', help='After training, prune channels of the model at each '
+                                                             'ratio of --prune_ratios and fine-tune the pruned models.')
+    parser.add_argument('--prune_ratios', type=float, nargs='+', help='Fractions of the hidden channels of each '
+                                                                      'inverted residual block to remove.',
+                        default=[0.25, 0.5, 0.75])
+    parser.add_argument('--prune_epochs', type=int, help='Number of fine-tuning epochs after pruning.', default=5)
+    parser.add_argument('--qat', action='store_true', help='After training, fine-tune the model with '
+                                                           'quantization-aware training and save an INT8 model.')
+    parser.add_argument('--qat_epochs', type=int, help='Number of quantization-aware training epochs.', default=5)
+    parser.add_argument('--qat_lr', type=float, help='Learning rate of quantization-aware training.', default=1e-4)
+    parser.add_argument('--qat_backend', type=str, help='Quantized engine the INT8 model will run on. fbgemm for '
+                                                        'x86, qnnpack for ARM (Jetson Nano).',
+                        default='qnnpack' if platform.machine() in ('aarch64', 'arm64') else 'fbgemm')
     args = parser.parse_args()
 
     # TensorBoard writer
@@ -324,7 +700,6 @@ if __name__ == "__main__":
     warnings.filterwarnings("ignore")
     plt.ion()
 
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
     print(f"Device is {device}")
 
     # If given, load a pretrained model. The .pth file must be the entire model, not just a state_dict
@@ -337,19 +712,77 @@ if __name__ == "__main__":
 
     # select training and validation augmentations from classifier_transforms
     data_transforms = {
-        'train': classifier_transforms['trainaug' + args.aug],
+        'train': classifier_transforms['trainaug' + str(args.aug)],
         'val': classifier_transforms['valaug1' if args.aug == 1 else 'valaug2']
     }
+    if args.eyes:
+        data_transforms = {'train': classifier_transforms['traineyes'], 'val': classifier_transforms['valeyes']}
+        # the Classifier in src/jetson/classifier.py cuts eye-band crops of this size for the model
+        model.input_size = EYE_SIZE
+        model.crop_mode = 'eyes'
+
+    cache = None
+    if args.cache is not None:
+        cache = load_image_cache(args.directory, args.cache, args.cache_size)
 
-    data_loaders, dataset_sizes, class_names = load_data(args.directory, data_transforms)
+    data_loaders, dataset_sizes, class_names = load_data(args.directory, data_transforms, args.batch_size,
+                                                         args.workers, args.pin_memory, cache)
 
     with open("params.json", "r") as params_file:
         params = json.load(params_file)
 
+    if args.distill:
+        if args.model is None:
+            parser.error('--distill requires a trained teacher model (--model)')
+
+        teacher = model
+        print("------------------Teacher model------------------")
+        teacher_acc = get_metrics(teacher, data_loaders, class_names)
+
+        distill_params = dict(params, temperature=args.temperature, alpha=args.alpha)
+        student = get_student_model(args.student_width, args.student_size).to(device)
+        student = train_model(student, data_loaders, dataset_sizes, distill_params, teacher=teacher)
+        torch.save(student, 'trained_student.pth')
+
+        print("------------------Student model------------------")
+        student_acc = get_metrics(student, data_loaders, class_names)
+        compare_models({'teacher': (teacher_acc, measure_latency(teacher), model_size(teacher)),
+                        'student': (student_acc, measure_latency(student), model_size(student))})
+        exit(0)
+
     model = train_model(model, data_loaders, dataset_sizes, params)
     torch.save(model, 'trained_model.pth')
 
     # show some results of the training
-    get_metrics(model, data_loaders, class_names)
+    float_acc = get_metrics(model, data_loaders, class_names)
+
+    if args.prune:
+        prune_params = dict(params, num_epochs=args.prune_epochs)
+        results = {'unpruned': (float_acc, measure_latency(model), model_size(model))}
+        for ratio in args.prune_ratios:
+            print("------------------Pruning ratio {}------------------".format(ratio))
+            pruned_model = prune_model(model, ratio)
+            print("Parameters: {} -> {}".format(count_parameters(model), count_parameters(pruned_model)))
+            pruned_model = train_model(pruned_model, data_loaders, dataset_sizes, prune_params)
+            torch.save(pruned_model, 'trained_model_pruned{}.pth'.format(ratio))
+
+            pruned_acc = get_metrics(pruned_model, data_loaders, class_names)
+            results['pruned {}'.format(ratio)] = (pruned_acc, measure_latency(pruned_model),
+                                                  model_size(pruned_model))
+        compare_models(results)
+
+    if args.qat:
+        torch.backends.quantized.engine = args.qat_backend
+        qat_params = dict(params, lr=args.qat_lr, num_epochs=args.qat_epochs)
+        qat_model = get_qat_model(model.cpu(), args.qat_backend).to(device)
+        qat_model = train_model(qat_model, data_loaders, dataset_sizes, qat_params)
+
+        quantized_model = convert_qat_model(qat_model)
+        torch.jit.save(quantized_model, 'trained_model_int8.pt')
+
+        print("------------------INT8 model------------------")
+        int8_acc = get_metrics(quantized_model, data_loaders, class_names, metrics_device=torch.device('cpu'))
+        compare_models({'float': (float_acc, measure_latency(model), model_size(model)),
+                        'int8': (int8_acc, measure_latency(quantized_model), model_size(quantized_model))})
 
     exit(0)
@@ -0,0 +1,153 @@
+""" Decode and resize the face crops of a dataset in Imagefolder structure once, and store them in a single uint8
+memory-mapped array with a label index. Training from the cache (goggle_classifier.py --cache) does not decode
+JPEGs from disk every epoch. """
+
+import argparse
+import json
+import os
+import time
+import warnings
+
+import numpy as np
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
+from torchvision import datasets, transforms
+from tqdm import tqdm
+
+# Size of the random crops of the training augmentations (classifier_transforms in goggle_classifier.py)
+CROP_SIZE = 224
+# Default size of the cached images. Larger than CROP_SIZE, like the face crops read from the folder, so the random
+# crops still move
+CACHE_SIZE = 256
+
+
+class ImageCacheDataset(Dataset):
+    """Dataset serving the images and labels written by build_image_cache, like datasets.ImageFolder."""
+
+    def __init__(self, path, transform=None):
+        """
+        @param path: Path of the cache, without extension.
+        @param transform: Optional transform applied to each PIL image.
+        """
+        with open(path + '.json', 'r') as meta_file:
+            meta = json.load(meta_file)
+
+        self.classes = meta['classes']
+        self.transform = transform
+        self.images = np.memmap(path + '.dat', dtype=np.uint8, mode='r', shape=tuple(meta['shape']))
+        self.labels = np.load(path + '_labels.npy')
+
+    def __getitem__(self, item):
+        image = Image.fromarray(np.asarray(self.images[item]))
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, int(self.labels[item])
+
+    def __len__(self):
+        return len(self.labels)
+
+
+def build_image_cache(data_location, path, size=CACHE_SIZE):
+    """
+    Decode and resize every image of a dataset into a memory-mapped array.
+    @param data_location: Directory in Imagefolder structure containing the images.
+    @param path: Path of the cache, without extension. <path>.dat holds the RGB images, <path>_labels.npy
+    the labels and <path>.json the shape of the images and the class names.
+    @param size: Height and width the images are resized to (bilinear, like transforms.Resize). Sizes up to
+    CROP_SIZE make the random crops of the training augmentation a no-op, so training from the cache no longer
+    matches training from the folder. CROP_SIZE itself gives exact parity of the validation transforms.
+    @return: An ImageCacheDataset serving the cache.
+    """
+
+    if size <= CROP_SIZE:
+        warnings.warn('Images cached at {0}x{0} leave no room for the {1}x{1} random crops of the training '
+                      'augmentation, training from this cache differs from training from the folder'.format(
+                          size, CROP_SIZE))
+    dataset = datasets.ImageFolder(os.path.abspath(data_location))
+    shape = (len(dataset), size, size, 3)
+    images = np.memmap(path + '.dat', dtype=np.uint8, mode='w+', shape=shape)
+    labels = np.zeros(len(dataset), dtype=np.int64)
+
+    since = time.time()
+    for i, (image_path, label) in enumerate(tqdm(dataset.samples)):
+        image = dataset.loader(image_path).resize((size, size), Image.BILINEAR)
+        images[i] = np.asarray(image)
+        labels[i] = label
+
+    images.flush()
+    np.save(path + '_labels.npy', labels)
+    with open(path + '.json', 'w') as meta_file:
+        json.dump({'shape': list(shape), 'classes': dataset.classes}, meta_file)
+
+    print('Cached {} images of size {} in {:.0f}s'.format(len(labels), size, time.time() - since))
+    del images
+
+    return ImageCacheDataset(path)
+
+
+def load_image_cache(data_location, path, size=CACHE_SIZE):
+    """
+    Open an image cache, building it first if it does not exist.
+    @param data_location: Directory in Imagefolder structure containing the images.
+    @param path: Path of the cache, without extension.
+    @param size: Height and width of the cached images.
+    @return: An ImageCacheDataset serving the cache.
+    """
+
+    if os.path.exists(path + '.json'):
+        return ImageCacheDataset(path)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return build_image_cache(data_location, path, size)
+
+
+def time_epoch(dataset, batch_size=32, num_workers=4, pin_memory=False):
+    """
+    Time one pass of a DataLoader over a dataset.
+    @param dataset: Dataset of transformed images and labels.
+    @param batch_size: Number of images per batch.
+    @param num_workers: Number of DataLoader worker processes.
+    @param pin_memory: Copy batches into pinned memory.
+    @return: Time in seconds.
+    """
+
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers, pin_memory=pin_memory)
+    since = time.time()
+    for _ in loader:
+        pass
+
+    return time.time() - since
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Decode and resize a dataset of face crops into a memory-mapped '
+                                                 'image cache.')
+    parser.add_argument('--directory', type=str, help='Relative directory location of dataset in Imagefolder '
+                                                      'structure.')
+    parser.add_argument('--cache', type=str, help='Path of the cache, without extension.', default='image_cache')
+    parser.add_argument('--size', type=int, help='Height and width the images are resized to, larger than the '
+                                                 'random crops of training.', default=CACHE_SIZE)
+    parser.add_argument('--benchmark', action='store_true', help='Compare the time of one epoch of loading images '
+                                                                 'from the folder and from the cache.')
+    parser.add_argument('--batch_size', type=int, help='Number of images per batch of the benchmark.', default=32)
+    parser.add_argument('--workers', type=int, help='Number of DataLoader worker processes of the benchmark.',
+                        default=4)
+    args = parser.parse_args()
+
+    build_image_cache(args.directory, args.cache, args.size)
+
+    if args.benchmark:
+        transform = transforms.Compose([
+            transforms.Resize((224, 224)),
+            transforms.ToTensor(),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        ])
+        folder_time = time_epoch(datasets.ImageFolder(os.path.abspath(args.directory), transform), args.batch_size,
+                                 args.workers)
+        cache_time = time_epoch(ImageCacheDataset(args.cache, transform), args.batch_size, args.workers)
+        print('Epoch time: {:.1f}s from the folder, {:.1f}s from the cache ({:.1f}x faster)'.format(
+            folder_time, cache_time, folder_time / cache_time))
+
+    exit(0)
@@ -0,0 +1,219 @@
+""" Run a hyperparameter sweep of goggle_classifier.py. Trials are run in parallel worker processes that read the
+images from a single decoded image cache (see image_cache.py). Trials whose validation accuracy falls below the
+median of the other trials at the same epoch are stopped early. The results of all trials are written to a CSV file
+and printed as a table.
+
+The sweep spec is a JSON file, for example:
+{
+    "method": "random",
+    "num_trials": 20,
+    "parameters": {
+        "lr": {"min": 0.0001, "max": 0.1, "log": true},
+        "momentum": [0.8, 0.9, 0.95],
+        "step_size": [5, 7],
+        "gamma": [0.1, 0.5],
+        "frozen": ["-1", "9", "13"],
+        "aug": [2, 3]
+    }
+}
+With "method": "grid", every parameter must be a list and all combinations are run. Parameters that are not in the
+spec are taken from params.json (lr, momentum, step_size, gamma, num_epochs) or default to --frozen -1 and --aug 3. """
+
+import argparse
+import csv
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import prettytable as pt
+import torch
+
+import scripts.goggle_classifier as goggle_classifier
+from scripts.image_cache import ImageCacheDataset, load_image_cache
+
+
+# Hyperparameters of goggle_classifier.py that are command line options rather than params.json values
+DEFAULT_OPTIONS = {'frozen': '-1', 'aug': 3}
+
+
+def sample_value(values, rng):
+    """
+    Sample a random value of a parameter.
+    @param values: A list of values to choose from, or a {'min', 'max', 'log'} range.
+    @param rng: A random.Random instance.
+    @return: The sampled value.
+    """
+
+    if isinstance(values, list):
+        return rng.choice(values)
+
+    if values.get('log', False):
+        return math.exp(rng.uniform(math.log(values['min']), math.log(values['max'])))
+    if isinstance(values['min'], int) and isinstance(values['max'], int):
+        return rng.randint(values['min'], values['max'])
+    return rng.uniform(values['min'], values['max'])
+
+
+def get_trials(spec, base_params, seed=0):
+    """
+    Generate the hyperparameters of every trial of a sweep.
+    @param spec: Dictionary of the sweep spec (see above).
+    @param base_params: Dictionary of params.json hyperparameters used for parameters not in the spec.
+    @param seed: Seed of the random search.
+    @return: A list of hyperparameter dictionaries.
+    """
+
+    parameters = spec['parameters']
+    base = dict(DEFAULT_OPTIONS, **base_params)
+
+    if spec.get('method', 'grid') == 'grid':
+        names = list(parameters)
+        for name in names:
+            if not isinstance(parameters[name], list):
+                raise ValueError('Grid search parameter {} must be a list of values'.format(name))
+        return [dict(base, **dict(zip(names, values))) for values in itertools.product(*parameters.values())]
+
+    rng = random.Random(seed)
+    return [dict(base, **{name: sample_value(values, rng) for name, values in parameters.items()})
+            for _ in range(spec['num_trials'])]
+
+
+def should_stop(history, trial, epoch, grace_epochs):
+    """
+    Median stopping rule: stop a trial if its best validation accuracy so far is below the median
+    of the validation accuracies of the other trials at the same epoch.
+    @param history: Dictionary of trial number -> list of validation accuracies per epoch.
+    @param trial: Number of the trial.
+    @param epoch: The epoch the trial just finished.
+    @param grace_epochs: Number of epochs every trial runs before it can be stopped.
+    @return: True if the trial should be stopped.
+    """
+
+    if epoch < grace_epochs:
+        return False
+
+    others = [accs[epoch] for other, accs in history.items() if other != trial and len(accs) > epoch]
+    if len(others) < 2:
+        return False
+
+    return max(history[trial]) < statistics.median(others)
+
+
+def run_trial(trial, trial_params, cache_path, threads, grace_epochs, history, seed):
+    """
+    Train a classifier with the hyperparameters of one trial. Runs in a worker process.
+    @param trial: Number of the trial.
+    @param trial_params: Dictionary of hyperparameters, including 'frozen' and 'aug'.
+    @param cache_path: Path of the image cache shared by all trials.
+    @param threads: Number of threads PyTorch may use in this trial.
+    @param grace_epochs: Number of epochs before the trial can be stopped early.
+    @param history: Shared dictionary of trial number -> list of validation accuracies per epoch.
+    @param seed: Seed of the training/validation split, the same for all trials.
+    @return: A dictionary with the hyperparameters and results of the trial.
+    """
+
+    torch.set_num_threads(threads)
+    torch.manual_seed(seed + trial)
+
+    aug = int(trial_params['aug'])
+    data_transforms = {
+        'train': goggle_classifier.classifier_transforms['trainaug' + str(aug)],
+        'val': goggle_classifier.classifier_transforms['valaug1' if aug == 1 else 'valaug2']
+    }
+    # the cache is memory-mapped, so all trials share one copy of the images in the page cache
+    data_loaders, dataset_sizes, _ = goggle_classifier.load_data(None, data_transforms, num_workers=0,
+                                                                 batch_size=int(trial_params.get('batch_size', 4)),
+                                                                 cache=ImageCacheDataset(cache_path), seed=seed)
+
+    history[trial] = []
+
+    def epoch_callback(epoch, val_acc):
+        history[trial] = history[trial] + [val_acc]
+        return should_stop(dict(history), trial, epoch, grace_epochs)
+
+    since = time.time()
+    model = goggle_classifier.get_model(str(trial_params['frozen'])).to(goggle_classifier.device)
+    goggle_classifier.train_model(model, data_loaders, dataset_sizes, trial_params, epoch_callback=epoch_callback,
+                                  save_checkpoints=False)
+
+    accs = history[trial]
+    return dict(trial_params, trial=trial, best_acc=max(accs), final_acc=accs[-1], epochs=len(accs),
+                stopped=len(accs) < trial_params['num_epochs'], time=time.time() - since)
+
+
+def write_results(results, path):
+    """
+    Write the results of a sweep to a CSV file and print them as a table, best trial first.
+    @param results: A list of result dictionaries returned by run_trial.
+    @param path: Path of the CSV file.
+    """
+
+    results = sorted(results, key=lambda result: result['best_acc'], reverse=True)
+    columns = ['trial'] + [column for column in results[0] if column != 'trial']
+
+    with open(path, 'w', newline='') as csv_file:
+        csv_writer = csv.DictWriter(csv_file, fieldnames=columns)
+        csv_writer.writeheader()
+        csv_writer.writerows(results)
+
+    x = pt.PrettyTable()
+    x.field_names = columns
+    for result in results:
+        x.add_row(['{:.4g}'.format(result[column]) if isinstance(result[column], float) else result[column]
+                   for column in columns])
+    print(x)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a parallel hyperparameter sweep of the Mobilenet classifier.')
+    parser.add_argument('--directory', type=str, help='Relative directory location of dataset in Imagefolder '
+                                                      'structure.')
+    parser.add_argument('--spec', type=str, help='JSON file of the sweep spec.')
+    parser.add_argument('--cache', type=str, help='Path (without extension) of the decoded image cache shared by '
+                                                  'the trials. It is built from --directory if it does not exist.',
+                        default='image_cache')
+    parser.add_argument('--workers', type=int, help='Number of trials run in parallel.', default=2)
+    parser.add_argument('--threads', type=int, help='Number of PyTorch threads per trial. Defaults to the number '
+                                                    'of cores divided by --workers.', default=None)
+    parser.add_argument('--grace_epochs', type=int, help='Number of epochs every trial runs before it can be '
+                                                         'stopped early.', default=3)
+    parser.add_argument('--seed', type=int, help='Seed of the random search and of the training/validation '
+                                                 'split.', default=0)
+    parser.add_argument('--output', type=str, help='CSV file the results are written to.', default='sweep.csv')
+    args = parser.parse_args()
+
+    with open("params.json", "r") as params_file:
+        params = json.load(params_file)
+    with open(args.spec, "r") as spec_file:
+        spec = json.load(spec_file)
+
+    trials = get_trials(spec, params, args.seed)
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    print('Running {} trials, {} at a time with {} threads each'.format(len(trials), args.workers, threads))
+
+    load_image_cache(args.directory, args.cache)
+    # download the pretrained weights once, before the trials need them
+    goggle_classifier.models.mobilenet_v2(pretrained=True)
+
+    results = []
+    with multiprocessing.Manager() as manager:
+        history = manager.dict()
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(run_trial, trial, trial_params, args.cache, threads, args.grace_epochs,
+                                       history, args.seed) for trial, trial_params in enumerate(trials)]
+            for future in as_completed(futures):
+                result = future.result()
+                print('Trial {} finished: best val Acc {:.4f} after {} epochs'.format(result['trial'],
+                                                                                     result['best_acc'],
+                                                                                     result['epochs']))
+                results.append(result)
+
+    write_results(results, args.output)
+
+    exit(0)
@@ -4,24 +4,27 @@ from decimal import Decimal
 import datetime
 
 
-def data_insert(image_name: str, image_date: datetime, image_time: datetime, init_vecs: list, bboxes: list, input_dir: str, labels: list):
+def data_insert(image_name: str, image_date: datetime, image_time: datetime, init_vecs: list, bboxes: list, input_dir: str, labels: list,
+                segment_name: str = None, frame_index: int = None):
     """Transfer image to remote storage then inserts image metadata and bounding boxes data in database
 
     Args:
         image_name (string): name of image, should be a unique name to avoid duplicates in database
         image_date (datetime obj): date image was taken
         image_time (datetime obj): time image was taken
-        init_vecs (list): list of decryption keys(strings) for encrypted bounding boxes in image
+        init_vecs (list): initialization vectors (bytes, see BBOX) of the encrypted bounding boxes in image
         bboxes (list): list of bounding boxes, each bounding box containing coordinates, confidence and classification
         labels (list): defines the classification for each bounding box
         input_dir (string): image path in client machine
+        segment_name (string): name of the segment file holding the image, if it was recorded in a segment
+        frame_index (int): index of the image in its segment
     """
 
     # Below ftp transfer has been commented out for testing purposes
     #with ftp_transfer() as transfer:
         #transfer(input_dir, './Documents', image_name)
 
-    sql_insert(IMAGE(image_name, image_date, image_time))
+    sql_insert(IMAGE(image_name, image_date, image_time, segment_name, frame_index))
 
     for bbox, init_vec, label in zip(bboxes, init_vecs, labels):
         sql_insert(BBOX(float(bbox[0]), float(bbox[1]), float(bbox[2]), 
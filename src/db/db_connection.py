@@ -22,12 +22,19 @@ class IMAGE(Table):
             image_name (string) : name of image
             image_date (datetime obj) : date image was taken
             image_time (datetime obj) : time image was taken
+            segment_name (string) : name of the segment file holding the image, if it was recorded in a segment
+            frame_index (int) : index of the image in its segment
     """
 
-    def __init__(self, image_name: str, image_date: datetime, image_time: datetime):
+    def __init__(self, image_name: str, image_date: datetime, image_time: datetime, segment_name: str = None,
+                 frame_index: int = None):
         self.Image_Name = image_name
         self.Image_Date = image_date
         self.Image_Time = image_time
+        # the segment columns are only inserted for images recorded in segments
+        if segment_name is not None:
+            self.Segment_Name = segment_name
+            self.Frame_Index = frame_index
 
 
 class BBOX(Table):
@@ -46,10 +53,12 @@ class BBOX(Table):
             conf (float) : confidence score for bounding box
             goggles (bool) : whether goggles were detected in bounding box
             image_name (string): name of image that contains the bounding box
-            init_vector (string) : decryption key for encrypted bounding box
+            init_vector (bytes) : initialization vector of the encrypted bounding box, the 26 byte '>BB16sQ' record of
+                encryptor.INIT_VEC_FORMAT (version, cipher mode, frame IV, offset) or a bare 16 byte CFB-8 IV in
+                the legacy encryption mode
     """
 
-    def __init__(self, xmin: int, ymin: int, xmax: int, ymax: int, conf: int, goggles: int, image_name: str, init_vector: str):
+    def __init__(self, xmin: int, ymin: int, xmax: int, ymax: int, conf: int, goggles: int, image_name: str, init_vector: bytes):
         self.X_Min = xmin
         self.Y_Min = ymin
         self.X_Max = xmax
@@ -109,6 +118,22 @@ def sql_insert(table: Table):
             print(e)
 
 
+def sql_select(query: str, params: dict = None):
+    """Runs a select query in the database
+
+    Args:
+        query (string): SQL select query, with %(name)s placeholders for params
+        params (dict): values of the placeholders in query
+
+    Yields:
+        tuple: each row of the result
+    """
+    with sql_cursor() as cursor:
+        cursor.execute(query, params)
+        for row in cursor:
+            yield row
+
+
 def sql_clear_table(table_name: Table):
     """Clears all rows in specified table in the database
 
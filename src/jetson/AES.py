@@ -4,19 +4,156 @@ import numpy as np
 from pbkdf2 import PBKDF2
 import salt
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Set, Dict, Tuple, Optional
 
+# Cipher modes that need no padding. 'cfb8' (CFB with PyCrypto's default 8 bit segments) runs the block cipher once
+# per byte and is the default, as in the original records; 'cfb128' and 'ctr' run it once per 16 bytes.
+MODES = ['cfb8', 'cfb128', 'ctr']
+DEFAULT_MODE = 'cfb8'
+# Bytes of the encrypted buffer per thread pool task in CTR mode, a multiple of the 16 byte block size
+DEFAULT_CHUNK_SIZE = 1 << 18
+
+
+def new_cipher(key: bytes,
+               mode: str,
+               IV: bytes):
+    '''
+    Creates an AES cipher object.
+    Args:
+        key: Encryption key
+        mode: One of MODES
+        IV: 16 byte initialization vector (the initial counter block in CTR mode)
+
+    Return:
+        cipher: AES cipher object
+    '''
+    if mode == 'cfb8':
+        return AES.new(key, AES.MODE_CFB, IV)
+    if mode == 'cfb128':
+        return AES.new(key, AES.MODE_CFB, IV, segment_size=128)
+    if mode == 'ctr':
+        return AES.new(key, AES.MODE_CTR, nonce=b'', initial_value=IV)
+    raise ValueError('Unknown encryption mode {}, expected one of {}'.format(mode, MODES))
+
+
+def counter_block(IV: bytes,
+                  blocks: int):
+    '''
+    Computes the CTR mode counter block a number of blocks after the initialization vector.
+    Args:
+        IV: 16 byte initial counter block
+        blocks: Number of 16 byte blocks from the start of the encrypted buffer
+
+    Return:
+        counter: 16 byte counter block
+    '''
+    return ((int.from_bytes(IV, 'big') + blocks) % (1 << 128)).to_bytes(16, 'big')
+
 
 class Encryption():
 
-    def __init__(self):
+    def __init__(self, mode: str = DEFAULT_MODE,
+                 workers: int = 1,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 key: bytes = None):
         '''
         This class handles encryption to prevent identifiable information (facial data)
         from leaving the camera. It also generates a random key that will be used by
         authorized personnel to acces the data.
+        Args:
+            mode: Cipher mode used for encrypting, one of MODES
+            workers: Number of threads encrypting chunks of the facial regions of a frame in parallel (CTR mode
+                only, the CFB modes cannot start in the middle of a buffer). The output does not depend on it.
+            chunk_size: Bytes per chunk, rounded up to a multiple of the block size
+            key: Encryption key, a new random key if None
         '''
+        if mode not in MODES:
+            raise ValueError('Unknown encryption mode {}, expected one of {}'.format(mode, MODES))
+        self.mode = mode
+        self.workers = workers
+        self.chunk_size = -(-chunk_size // AES.block_size) * AES.block_size
+        self.executor = None
+        self.executor_pid = None
+        self.buffer = None # scratch buffer of the regions of a frame
         self.salt = os.urandom(16) #Salt variable (Generates a random byte string)
-        self.key = PBKDF2("passphrase", self.salt).read(16) #Creates key using KDF scheme
+        self.key = key if key is not None else PBKDF2("passphrase", self.salt).read(16) #Creates key using KDF scheme
+
+    def __getstate__(self):
+        # the thread pool is not copied into child processes, they create their own
+        state = self.__dict__.copy()
+        state['executor'] = None
+        state['executor_pid'] = None
+        state['buffer'] = None
+        return state
+
+    def getExecutor(self):
+        '''
+        Returns the thread pool, created on first use and again in a process forked after it was created.
+        '''
+        if self.executor is None or self.executor_pid != os.getpid():
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            self.executor_pid = os.getpid()
+        return self.executor
+
+    def getBuffer(self, size: int):
+        '''
+        Returns a scratch buffer of at least size bytes, reused across frames and grown when needed.
+        '''
+        if self.buffer is None or self.buffer.size < size:
+            self.buffer = np.empty(size, dtype=np.uint8)
+        return self.buffer[:size]
+
+    def transform(self,
+                  data: np.ndarray,
+                  IV: bytes,
+                  mode: str,
+                  decrypt: bool = False):
+        '''
+        Encrypts or decrypts a buffer in place. In CTR mode, buffers larger than a chunk are split into chunks that are
+        encrypted in parallel, each starting from its own counter block, which gives the same output as a single call.
+        Args:
+            data: Writable, contiguous 1D uint8 array
+            IV: Initialization vector
+            mode: Cipher mode, one of MODES
+            decrypt: Decrypt instead of encrypt (the same operation in CTR mode)
+        '''
+        if mode == 'ctr' and self.workers > 1 and len(data) > self.chunk_size:
+            def transform_chunk(start):
+                chunk = memoryview(data[start:start + self.chunk_size])
+                cipher = new_cipher(self.key, mode, counter_block(IV, start // AES.block_size))
+                cipher.encrypt(chunk, output=chunk)
+
+            # the cipher releases the GIL while it runs over a chunk
+            list(self.getExecutor().map(transform_chunk, range(0, len(data), self.chunk_size)))
+            return
+
+        cipher = new_cipher(self.key, mode, IV)
+        view = memoryview(data)
+        if decrypt:
+            cipher.decrypt(view, output=view)
+        else:
+            cipher.encrypt(view, output=view)
+
+    def transformRegion(self,
+                        cipher_method,
+                        ROI: np.ndarray):
+        '''
+        Encrypts or decrypts a region of an image in place. A region of whole rows is contiguous in the image and is
+        transformed directly in its memory, other regions go through the scratch buffer.
+        Args:
+            cipher_method: encrypt or decrypt method of a cipher object
+            ROI: A view of the region of the image
+        '''
+        contiguous = ROI.flags.c_contiguous
+        data = ROI.reshape(-1) if contiguous else self.getBuffer(ROI.size)
+        if not contiguous:
+            np.copyto(data.reshape(ROI.shape), ROI)
+
+        view = memoryview(data)
+        cipher_method(view, output=view)
+        if not contiguous:
+            ROI[...] = data.reshape(ROI.shape)
 
     def encrypt(self,
                 coordinates: List[Tuple[int]],
@@ -34,19 +171,11 @@ class Encryption():
 
         IV = os.urandom(16) #Initialization vector
 
-        mode = AES.MODE_CFB #Sets encryption mode to CFB mode; CFB is great in avoiding the hassle of padding
-        encryptor = AES.new(self.key, mode, IV) #Encryptor
+        encryptor = new_cipher(self.key, self.mode, IV) #Encryptor; none of the modes need padding
 
-        ROI_number = 0
         for c in coordinates:
             x1,y1,x2,y2 = c
-            ROI = image[y1:y2, x1:x2]
-            img_bytes = np.ascontiguousarray(ROI, dtype=None)
-
-            encData = encryptor.encrypt(img_bytes) #Encrypted data
-            data = np.frombuffer(encData, dtype=np.uint8)
-            data = np.reshape(data, (y2-y1, x2-x1, 3))
-            image[y1:y2, x1:x2] = data
+            self.transformRegion(encryptor.encrypt, image[y1:y2, x1:x2])
 
         return image, IV
 
@@ -54,29 +183,179 @@ class Encryption():
     def decrypt(self,
                 coordinates: List[Tuple[int]],
                 image:'numpy.ndarray[numpy.ndarray[numpy.ndarray[numpy.uint8]]]',
-                IV: bytes):
+                IV: bytes,
+                mode: str = None):
         '''
         This method decrypts the facial regions.
         Args:
             coordinates: bounding box coordinates
             image: Image to be decrypted
             IV - Initialization vector
+            mode - Cipher mode the regions were encrypted with, defaults to the mode of this object
 
         Return:
             image: Decrypted image
         '''
-        mode = AES.MODE_CFB #Sets encryption mode to CFB mode; CFB is great in avoiding the hassle of padding
-        decryptor = AES.new(self.key, mode, IV) #Decryptor
+        decryptor = new_cipher(self.key, mode or self.mode, IV) #Decryptor
 
         for c in coordinates:
             x1,y1,x2,y2 = c
+            self.transformRegion(decryptor.decrypt, image[y1:y2, x1:x2])
+
+        return image
+
+
+    def encryptRegions(self,
+                       coordinates: List[Tuple[int]],
+                       image: 'numpy.ndarray[numpy.ndarray[numpy.ndarray[numpy.uint8]]]'):
+        '''
+        This method encrypts all the facial regions of an image in place, as one buffer encrypted with one
+        initialization vector (see transformRegions). Pixels covered by more than one region are encrypted once, as
+        part of the first region that covers them.
+        Args:
+            coordinates: bounding box coordinates, clipped to the image
+            image: Image to be encrypted
+
+        Return:
+            image: Encrypted image
+            IV: Initialization vector for decrypting image
+            offsets: Byte offset of each region in the encrypted buffer
+        '''
+
+        IV = os.urandom(16) #Initialization vector
+        regions, offsets = gather_regions(coordinates, image)
+        self.transformRegions(regions, IV, self.mode)
+
+        return image, IV, offsets
 
-            ROI = image[y1:y2, x1:x2]
-            img_bytes = np.ascontiguousarray(ROI, dtype=None)
 
-            decData = decryptor.decrypt(img_bytes) #Encrypted data
-            data = np.frombuffer(decData, dtype=np.uint8)
-            data = np.reshape(data, (y2-y1, x2-x1, 3))
-            image[y1:y2, x1:x2] = data
+    def decryptRegions(self,
+                       coordinates: List[Tuple[int]],
+                       image: 'numpy.ndarray[numpy.ndarray[numpy.ndarray[numpy.uint8]]]',
+                       IV: bytes,
+                       mode: str = None):
+        '''
+        This method decrypts the facial regions encrypted by encryptRegions.
+        Args:
+            coordinates: bounding box coordinates, in the order they were encrypted
+            image: Image to be decrypted
+            IV - Initialization vector
+            mode - Cipher mode the regions were encrypted with, defaults to the mode of this object
+
+        Return:
+            image: Decrypted image
+        '''
+        regions, _ = gather_regions(coordinates, image)
+        self.transformRegions(regions, IV, mode or self.mode, decrypt=True)
 
         return image
+
+    def transformRegions(self,
+                         regions: list,
+                         IV: bytes,
+                         mode: str,
+                         decrypt: bool = False):
+        '''
+        Encrypts or decrypts the regions gathered by gather_regions in place, as one buffer. A single region of whole
+        rows is transformed directly in the memory of the image, otherwise the regions are packed into the scratch
+        buffer, transformed and scattered back.
+        Args:
+            regions: regions returned by gather_regions
+            IV: Initialization vector
+            mode: Cipher mode, one of MODES
+            decrypt: Decrypt instead of encrypt
+        '''
+        if not regions:
+            return
+
+        ROI, mask, size = regions[0]
+        if len(regions) == 1 and mask is None and ROI.flags.c_contiguous:
+            self.transform(ROI.reshape(-1), IV, mode, decrypt)
+            return
+
+        data = self.getBuffer(sum(size for _, _, size in regions))
+        pack_regions(regions, data)
+        self.transform(data, IV, mode, decrypt)
+        scatter_regions(regions, data)
+
+
+def gather_regions(coordinates: List[Tuple[int]],
+                   image: np.ndarray):
+    '''
+    Finds the pixels of the regions of an image that are not covered by an earlier region.
+    Args:
+        coordinates: bounding box coordinates, clipped to the image
+        image: A 3D numpy array
+
+    Return:
+        regions: view of the region, mask of the pixels it owns (None for all) and number of bytes it owns, for each
+            non-empty region
+        offsets: Byte offset of the pixels of each region in the concatenated pixel bytes
+    '''
+    covered = None
+    regions = []
+    offsets = []
+    offset = 0
+    for i, (x1, y1, x2, y2) in enumerate(coordinates):
+        offsets.append(offset)
+        if x2 <= x1 or y2 <= y1:
+            continue
+
+        ROI = image[y1:y2, x1:x2]
+        mask = None
+        size = ROI.size
+        if covered is None and any(max(x1, a1) < min(x2, a2) and max(y1, b1) < min(y2, b2)
+                                   for a1, b1, a2, b2 in coordinates[:i]):
+            # the mask of covered pixels is only needed once regions overlap
+            covered = np.zeros(image.shape[:2], dtype=bool)
+            for a1, b1, a2, b2 in coordinates[:i]:
+                covered[b1:b2, a1:a2] = True
+        if covered is not None:
+            owned = covered[y1:y2, x1:x2]
+            if owned.any():
+                # overlapping region: only the pixels no earlier region covers
+                mask = ~owned
+                size = int(mask.sum()) * ROI.shape[2]
+            covered[y1:y2, x1:x2] = True
+
+        if size:
+            regions.append((ROI, mask, size))
+            offset += size
+
+    return regions, offsets
+
+
+def pack_regions(regions: list,
+                 data: np.ndarray):
+    '''
+    Copies the pixels of the regions gathered by gather_regions into a buffer.
+    Args:
+        regions: regions returned by gather_regions
+        data: 1D uint8 array the concatenated bytes of all regions are written to
+    '''
+    start = 0
+    for ROI, mask, size in regions:
+        end = start + size
+        if mask is None:
+            np.copyto(data[start:end].reshape(ROI.shape), ROI)
+        else:
+            data[start:end] = ROI[mask].reshape(-1)
+        start = end
+
+
+def scatter_regions(regions: list,
+                    data: np.ndarray):
+    '''
+    Writes bytes back into the regions gathered by gather_regions.
+    Args:
+        regions: regions returned by gather_regions
+        data: 1D uint8 array of the concatenated bytes of all regions
+    '''
+    start = 0
+    for ROI, mask, size in regions:
+        end = start + size
+        if mask is None:
+            ROI[...] = data[start:end].reshape(ROI.shape)
+        else:
+            ROI[mask] = data[start:end].reshape(-1, ROI.shape[2])
+        start = end
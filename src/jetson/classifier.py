@@ -1,82 +1,340 @@
+import inspect
 import cv2
-from PIL import Image
 import numpy as np
 from typing import List, Tuple
 import torch
-from torchvision import transforms
+from torchvision.ops import roi_align
+
+# Input size and normalization of the classifier. These should be the same as the validation
+# transforms applied while training the model (valaug2 in scripts/goggle_classifier.py)
+INPUT_SIZE = 224
+# (width, height) of the aligned eye-band crops of eye classifiers (scripts/goggle_classifier.py --eyes)
+EYE_SIZE = (96, 48)
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
 
 class Classifier:
-    def __init__(self, classifier, cuda: bool):
+    def __init__(self, classifier, cuda: bool, input_size=None):
         """
         Performs classification of facial region into three classes - [Goggles, Glasses, Neither]
         Args:
             classifier - Trained classifier model (Currently, mobilenetv2)
             cuda - True if Nvidia GPU is used
+            input_size - Height and width faces are resized to, or a (width, height) tuple. Defaults to the
+                input_size attribute of the classifier (set on distilled student and eye models by
+                scripts/goggle_classifier.py), or 224
+
+        Classifiers with a crop_mode attribute of 'eyes' classify aligned eye-band crops cut with the eye
+        landmarks of the detector instead of whole faces (see classifyFrame and crop_eyes).
         """
         self.fps = 0
         self.classifier = classifier
         self.device = cuda
+        # quantized (INT8) models only run on the CPU
+        use_cuda = cuda and torch.cuda.is_available() and not is_quantized(classifier)
+        self.torch_device = torch.device("cuda:0" if use_cuda else "cpu")
+        if input_size is None:
+            input_size = getattr(classifier, 'input_size', INPUT_SIZE)
+        self.input_size = input_size
+        self.crop_mode = getattr(classifier, 'crop_mode', 'face')
+        # (height, width) of the classifier input
+        if isinstance(input_size, int):
+            self.input_shape = (input_size, input_size)
+        else:
+            self.input_shape = (input_size[1], input_size[0])
+
+        # ToTensor and Normalize folded into one multiply and add per RGB channel
+        std = torch.tensor(STD, dtype=torch.float32).view(1, 3, 1, 1)
+        mean = torch.tensor(MEAN, dtype=torch.float32).view(1, 3, 1, 1)
+        self.scale = (1 / (255 * std)).to(self.torch_device)
+        self.bias = (-mean / std).to(self.torch_device)
+
+        # Resized faces are written into a preallocated uint8 buffer that only grows when
+        # a frame has more faces than any previous one
+        self.buffer = np.empty((0,) + self.input_shape + (3,), dtype=np.uint8)
+
+    def preprocess(self,
+                   faces: List[np.ndarray]):
+        """
+        Resizes, converts to RGB and normalizes a list of BGR face regions into one batch. The
+        result matches transforms.Resize((224, 224)), ToTensor and Normalize applied to the RGB image.
+        Args:
+            faces - A list of 3D numpy arrays (BGR, uint8) containing facial regions
+
+        Return:
+            face_batch - A 4D float tensor of shape [len(faces), 3, height, width] (224x224 by default) on the
+                classifier device
+        """
+        if len(faces) > len(self.buffer):
+            self.buffer = np.empty((len(faces),) + self.input_shape + (3,), dtype=np.uint8)
+
+        size = (self.input_shape[1], self.input_shape[0])
+        for i, face in enumerate(faces):
+            # PIL's bilinear resize filters over the source pixels when downscaling, which
+            # INTER_AREA approximates more closely than INTER_LINEAR
+            downscale = face.shape[0] > self.input_shape[0] or face.shape[1] > self.input_shape[1]
+            interpolation = cv2.INTER_AREA if downscale else cv2.INTER_LINEAR
+            cv2.resize(np.ascontiguousarray(face), size, dst=self.buffer[i], interpolation=interpolation)
+
+        # BGR -> RGB and NHWC -> NCHW
+        face_batch = torch.from_numpy(self.buffer[:len(faces)]).to(self.torch_device)
+        face_batch = face_batch.flip(3).permute(0, 3, 1, 2).float()
+
+        return face_batch.mul_(self.scale).add_(self.bias)
+
+    def classifyFaces(self,
+                      faces: List[np.ndarray]):
+        """
+        This method classifies a list of face regions in a single forward pass
+        Args:
+            faces - A list of 3D numpy arrays containing facial regions
+
+        Return:
+            labels - A list with the index of the highest class probability of each face
+            probs - A 2D numpy array with the class probabilities of each face
+        """
+        if len(faces) == 0:
+            return [], np.zeros((0, 0), dtype=np.float32)
+
+        with torch.no_grad():
+            face_batch = self.preprocess(faces)
+            outputs = self.classifier(face_batch)
+            probs = torch.nn.functional.softmax(outputs, dim=1)
+            _, preds = torch.max(outputs, 1)
+
+        return preds.tolist(), probs.cpu().numpy()
 
     def classifyFace(self,
                      face: np.ndarray):
         """
-        This method initializaes the transforms and classifies the face region
+        This method classifies a single face region
         Args:
             face - A 3D numpy array containing facial region
 
         Return:
             pred - A tensor containing the index of the highest class probability
         """
+        labels, _ = self.classifyFaces([face])
 
-        classifier = self.classifier
-
-        if 0 in face.shape:
-            pass
-        rgb_face = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
-        pil_face = Image.fromarray(rgb_face)
-        # Transforms applied to image before passing it to classifier. These should be
-        # the same transforms as applied while training model
-        transform = transforms.Compose([
-            transforms.Resize(224),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-        ])
-        transformed_face = transform(pil_face)
-        face_batch = transformed_face.unsqueeze(0)
-        device = torch.device("cuda:0" if self.device and torch.cuda.is_available() else "cpu")
-        with torch.no_grad():
-            face_batch = face_batch.to(device)
-            labels = classifier(face_batch)
-            m = torch.nn.Softmax(1)
-            _, pred = torch.max(labels, 1)
-
-        return pred
+        return torch.tensor(labels)
 
     def classifyFrame(self,
                       img: np.ndarray,
-                      boxes: List[Tuple[np.float64]]):
+                      boxes: List[Tuple[np.float64]],
+                      return_probs=False,
+                      landmarks=None):
         """
-        This method loops through all the bounding boxes in an image, calls classifyFace method
-        to classify face region and finally draws a box around the face.
+        This method crops all the bounding boxes in an image and classifies the face regions
+        in a single batch.
         Args:
             img - A 3d numpy array containing input video frame
             boxes - Coordinates of the bounding box around the face
+            return_probs - Also return the class probabilities of each face
+            landmarks - Facial landmarks of each box, Shape [num_boxes, 5, 2] (FaceDetector.detect with
+                landmarks=True). Required by eye classifiers, which classify aligned eye-band crops
 
         Return:
-            label: Classification label (Goggles, Glasses or Neither)
+            label: Classification label (Goggles, Glasses or Neither) of each box, in box order
+            probs: Class probabilities of each box (only if return_probs)
         """
+        if self.crop_mode == 'eyes':
+            if landmarks is None:
+                raise ValueError('Eye classifiers need the facial landmarks of each box')
+            size = (self.input_shape[1], self.input_shape[0])
+            crops = [crop_eyes(img, landmark, size) for landmark in landmarks]
+        else:
+            crops = [crop_face(img, box) for box in boxes]
+        labels, probs = self.classifyFaces(crops)
+
+        if return_probs:
+            return labels, probs
+        return labels
+
+    def classifyFrameTensor(self,
+                            frame_tensor: torch.Tensor,
+                            boxes: List[Tuple[np.float64]],
+                            frame_shape: Tuple[int],
+                            mean=(104, 117, 123),
+                            return_probs=False):
+        """
+        This method classifies the faces of a frame that was already transformed and uploaded for the
+        face detector. All face crops are resampled to the classifier input size at once with ROI-align,
+        without going back to the numpy frame. Crops are taken at the detector input resolution, so small
+        faces have less detail than with classifyFrame.
+        Args:
+            frame_tensor - Detector input tensor of shape [1, 3, H, W] or [3, H, W] (BGR, mean subtracted)
+            boxes - Coordinates of the bounding boxes around the faces in original frame coordinates
+            frame_shape - Shape (height, width, ...) of the original frame the boxes refer to
+            mean - Mean BGR intensity subtracted from the frame by the detector transform
+            return_probs - Also return the class probabilities of each face
+
+        Return:
+            label: Classification label (Goggles, Glasses or Neither) of each box, in box order
+            probs: Class probabilities of each box (only if return_probs)
+        """
+        if len(boxes) == 0:
+            labels, probs = [], np.zeros((0, 0), dtype=np.float32)
+        else:
+            with torch.no_grad():
+                face_batch = self.preprocessTensor(frame_tensor, boxes, frame_shape, mean)
+                outputs = self.classifier(face_batch)
+                probs = torch.nn.functional.softmax(outputs, dim=1)
+                _, preds = torch.max(outputs, 1)
+            labels, probs = preds.tolist(), probs.cpu().numpy()
+
+        if return_probs:
+            return labels, probs
+        return labels
+
+    def preprocessTensor(self,
+                         frame_tensor: torch.Tensor,
+                         boxes: List[Tuple[np.float64]],
+                         frame_shape: Tuple[int],
+                         mean=(104, 117, 123)):
+        """
+        Extracts fixed size face crops from a detector input tensor with ROI-align and normalizes
+        them like preprocess
+        Args:
+            frame_tensor - Detector input tensor of shape [1, 3, H, W] or [3, H, W] (BGR, mean subtracted)
+            boxes - Coordinates of the bounding boxes around the faces in original frame coordinates
+            frame_shape - Shape (height, width, ...) of the original frame the boxes refer to
+            mean - Mean BGR intensity subtracted from the frame by the detector transform
+
+        Return:
+            face_batch - A 4D float tensor of shape [len(boxes), 3, height, width] on the classifier device
+        """
+        if frame_tensor.dim() == 3:
+            frame_tensor = frame_tensor.unsqueeze(0)
+        frame_tensor = frame_tensor.to(self.torch_device, torch.float32)
+        tensor_h, tensor_w = frame_tensor.shape[2:4]
+
+        # boxes are clipped to the frame like crop_face and scaled to tensor coordinates
+        rois = torch.as_tensor(np.array([box[0:4] for box in boxes], dtype=np.float32), device=self.torch_device)
+        rois[:, 0::2] = rois[:, 0::2].clamp(0, frame_shape[1]) * (tensor_w / frame_shape[1])
+        rois[:, 1::2] = rois[:, 1::2].clamp(0, frame_shape[0]) * (tensor_h / frame_shape[0])
+        rois = torch.cat((torch.zeros((len(rois), 1), device=self.torch_device), rois), 1)
+
+        # aligned=True samples pixel centers, sampling_ratio=-1 averages over source pixels when downscaling
+        face_batch = roi_align(frame_tensor, rois, self.input_shape, spatial_scale=1.0,
+                               sampling_ratio=-1, aligned=True)
+
+        # undo the detector mean subtraction, BGR -> RGB, then normalize
+        face_batch += torch.tensor(mean, dtype=torch.float32, device=self.torch_device).view(1, 3, 1, 1)
+        face_batch = face_batch.flip(1)
+
+        return face_batch.mul_(self.scale).add_(self.bias)
+
+    def classifyFrames(self,
+                       imgs: List[np.ndarray],
+                       boxes_list: List[List[Tuple[np.float64]]],
+                       return_probs=False):
+        """
+        This method classifies the faces of several frames in a single batch.
+        Args:
+            imgs - A list of 3d numpy arrays containing input video frames
+            boxes_list - Coordinates of the bounding boxes around the faces of each frame
+            return_probs - Also return the class probabilities of each face
+
+        Return:
+            labels: Classification labels of each frame, in box order
+            probs: Class probabilities of each frame (only if return_probs)
+        """
+        faces = [crop_face(img, box) for img, boxes in zip(imgs, boxes_list) for box in boxes]
+        all_labels, all_probs = self.classifyFaces(faces)
+
+        labels = []
+        probs = []
+        start = 0
+        for boxes in boxes_list:
+            labels.append(all_labels[start:start + len(boxes)])
+            probs.append(all_probs[start:start + len(boxes)])
+            start += len(boxes)
+
+        if return_probs:
+            return labels, probs
+        return labels
+
+
+def load_classifier(path: str, device: torch.device):
+    """
+    Loads a trained classifier. Both TorchScript files (e.g. the INT8 model saved by
+    scripts/goggle_classifier.py --qat) and pickled models saved with torch.save are supported.
+    Quantized models are always loaded to the CPU.
+    Args:
+        path - Path to the saved classifier
+        device - Device to load a float model to
+
+    Return:
+        classifier - The classifier model in eval mode (or a state_dict if only weights were saved)
+    """
+    try:
+        classifier = torch.jit.load(path, map_location='cpu')
+    except RuntimeError:
+        # not a TorchScript file. Whole pickled models need weights_only=False on newer PyTorch versions
+        kwargs = {'weights_only': False} if 'weights_only' in inspect.signature(torch.load).parameters else {}
+        classifier = torch.load(path, map_location=device, **kwargs)
+
+    if isinstance(classifier, torch.nn.Module):
+        if not is_quantized(classifier):
+            classifier = classifier.to(device)
+        classifier.eval()
+
+    return classifier
+
+
+def is_quantized(model):
+    """
+    Returns true if the model is quantized, i.e. it contains a Quantize module converted from a QuantStub.
+    Works for both eager and TorchScript models.
+    Args:
+        model - A classifier model
+    """
+    if not isinstance(model, torch.nn.Module):
+        return False
+
+    return any(getattr(module, 'original_name', type(module).__name__) == 'Quantize' for module in model.modules())
+
+
+def crop_eyes(img: np.ndarray, landmarks: np.ndarray, size=EYE_SIZE, eye_distance=0.5):
+    """
+    Cuts an eye-band crop aligned with the eyes, so that the eyes are level and at fixed positions.
+    Args:
+        img - A 3d numpy array containing input video frame
+        landmarks - Facial landmarks (x, y) of a face, the first two being the left and right eye, Shape [5, 2]
+        size - (width, height) of the crop
+        eye_distance - Distance between the eyes as a fraction of the crop width
+
+    Return:
+        eyes - A 3D numpy array of shape [height, width, 3] containing the eye region
+    """
+    left_eye, right_eye = np.asarray(landmarks[0], dtype=np.float64), np.asarray(landmarks[1], dtype=np.float64)
+    dx, dy = right_eye - left_eye
+    center = (left_eye + right_eye) / 2
+
+    # rotate around the eye center so the eyes are level, scale to the eye distance and move the center
+    # to the middle of the crop
+    scale = eye_distance * size[0] / max(np.hypot(dx, dy), 1.0)
+    matrix = cv2.getRotationMatrix2D((float(center[0]), float(center[1])), float(np.degrees(np.arctan2(dy, dx))), scale)
+    matrix[:, 2] += np.array([size[0] / 2, size[1] / 2]) - center
+
+    return cv2.warpAffine(img, matrix, size, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
 
-        label = []
-        for box in boxes:
-            x1, y1, x2, y2 = [int(b) for b in box[0:4]]
-            # draw boxes within the frame
-            x1 = max(0, x1)
-            y1 = max(0, y1)
-            x2 = min(img.shape[1], x2)
-            y2 = min(img.shape[0], y2)
 
-            face = img[y1:y2, x1:x2, :]
+def crop_face(img: np.ndarray, box: Tuple[np.float64]):
+    """
+    Crops a bounding box from an image. The box is clipped to the image and is at least one pixel wide and high.
+    Args:
+        img - A 3d numpy array containing input video frame
+        box - Coordinates of the bounding box around the face
 
-            label.append(int(self.classifyFace(face).data))
+    Return:
+        face - A 3D numpy array containing facial region
+    """
+    x1, y1, x2, y2 = [int(b) for b in box[0:4]]
+    # keep boxes within the frame
+    x1 = min(max(0, x1), img.shape[1] - 1)
+    y1 = min(max(0, y1), img.shape[0] - 1)
+    x2 = max(min(img.shape[1], x2), x1 + 1)
+    y2 = max(min(img.shape[0], y2), y1 + 1)
 
-        return label
+    return img[y1:y2, x1:x2, :]
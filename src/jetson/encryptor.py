@@ -1,14 +1,35 @@
-from src.jetson.AES import Encryption as AESEncryptor
+from src.jetson.AES import Encryption as AESEncryptor, MODES, DEFAULT_CHUNK_SIZE
+import os
+import struct
 import numpy as np
 from typing import List, Tuple
 
+# Stored for each face: format version, cipher mode (index in MODES), initialization vector of the frame and byte
+# offset of the face in the encrypted buffer
+INIT_VEC_FORMAT = '>BB16sQ'
+INIT_VEC_VERSION = 1
+# Older records: a bare initialization vector of a face encrypted on its own with CFB-8
+LEGACY_IV_SIZE = 16
+# Mode that still writes the older records, for viewers and scripts that expect them
+LEGACY_MODE = 'legacy'
+
 class Encryptor(object):
-    def __init__(self):
+    def __init__(self, mode: str = LEGACY_MODE,
+                 workers: int = 1,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 key: bytes = None):
         """
         This class acts as a wrapper for the AES encryptor in AES.py and stores the encryption key for decrypting
+        Args:
+            mode: Cipher mode used for encrypting, one of the MODES in AES.py, or LEGACY_MODE to encrypt each face
+                on its own with CFB-8 and a bare initialization vector
+            workers: Number of threads encrypting the faces of a frame in parallel (CTR mode only)
+            chunk_size: Bytes of the faces of a frame encrypted per thread pool task
+            key: Encryption key (see load_key), a new random key if None
         """
-        self.encryptor = AESEncryptor()
+        self.encryptor = AESEncryptor('cfb8' if mode == LEGACY_MODE else mode, workers, chunk_size, key)
         self.key = self.encryptor.key
+        self.mode = mode
 
     def encryptFace(self, coordinates: List[Tuple[int]],
                     img: np.ndarray):
@@ -30,25 +51,124 @@ class Encryptor(object):
     def encryptFrame(self, img: np.ndarray,
                      boxes: List[Tuple[np.float64]]):
         """
-        This method takes the face coordinates, encrypts the facial region, writes encrypted image to file filesystem
+        This method takes the face coordinates and encrypts all facial regions with a single cipher call, in place
         Args:
-            img: A 3D numpy array containing image to be encrypted
+            img: A 3D numpy array containing image to be encrypted, overwritten with the encrypted image
             boxes: facial Coordinates
 
         Return:
             img - Original image with all faces encrypted
-            init_vec_list - list of initialization vectors for each face in image
+            init_vec_list - for each face in image, the format version, cipher mode, initialization vector of the frame
+                and offset of the face in the encrypted buffer, packed with INIT_VEC_FORMAT (the bare initialization
+                vector of the face in LEGACY_MODE)
         """
-        init_vec_list = []
-        for box in boxes:
-            x1, y1, x2, y2 = [int(b) for b in box[0:4]]
-            # draw boxes within the frame
-            x1 = max(0, x1)
-            y1 = max(0, y1)
-            x2 = min(img.shape[1], x2)
-            y2 = min(img.shape[0], y2)
+        coordinates = clip_boxes(boxes, img.shape)
+        if self.mode == LEGACY_MODE:
+            init_vec_list = []
+            for coordinate in coordinates:
+                img, init_vec = self.encryptFace([coordinate], img)
+                init_vec_list.append(init_vec)
+            return img, init_vec_list
 
-            img, init_vec = self.encryptFace([(x1, y1, x2, y2)], img)
-            init_vec_list.append(init_vec)
+        img, init_vec, offsets = self.encryptor.encryptRegions(coordinates, img)
+        mode = MODES.index(self.mode)
+        init_vec_list = [struct.pack(INIT_VEC_FORMAT, INIT_VEC_VERSION, mode, init_vec, offset) for offset in offsets]
 
         return img, init_vec_list
+
+    def decryptFrame(self, img: np.ndarray,
+                     boxes: List[Tuple[np.float64]],
+                     init_vec_list: List[bytes]):
+        """
+        This method decrypts the facial regions of an image encrypted by encryptFrame, including records written before
+        the cipher mode was stored
+        Args:
+            img: A 3D numpy array containing the encrypted image
+            boxes: facial Coordinates, in the order they were encrypted
+            init_vec_list: list of initialization vectors returned by encryptFrame
+
+        Return:
+            img - Image with all faces decrypted
+        """
+        if len(boxes) == 0:
+            return img
+
+        coordinates = clip_boxes(boxes, img.shape)
+        _, mode, init_vec, offset = parse_init_vec(init_vec_list[0])
+        if offset is None:
+            # faces were encrypted one after the other, each with its own initialization vector
+            for coordinate, face_init_vec in reversed(list(zip(coordinates, init_vec_list))):
+                img = self.encryptor.decrypt([coordinate], img, face_init_vec, mode)
+            return img
+
+        return self.encryptor.decryptRegions(coordinates, img, init_vec, mode)
+
+
+def load_key(key_file: str,
+             create: bool = False):
+    """
+    Reads an encryption key from a file holding it as a hex string
+    Args:
+        key_file: path of the key file
+        create: if the file does not exist, write a new random key to it
+
+    Return:
+        key - the encryption key
+    """
+    if create and not os.path.exists(key_file):
+        key = AESEncryptor().key
+        # only the owner may read the key
+        with os.fdopen(os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as file:
+            file.write(key.hex())
+        return key
+
+    with open(key_file) as file:
+        key = bytes.fromhex(file.read().strip())
+    if len(key) not in (16, 24, 32):
+        raise ValueError('{} does not hold a 16, 24 or 32 byte AES key'.format(key_file))
+    return key
+
+
+def parse_init_vec(init_vec: bytes):
+    """
+    Unpacks the initialization vector stored for a face
+    Args:
+        init_vec: An initialization vector returned by encryptFrame, of any format version
+
+    Return:
+        version - format version, 0 for records written before the version was stored
+        mode - cipher mode, one of the MODES in AES.py
+        init_vec - 16 byte initialization vector
+        offset - byte offset of the face in the encrypted buffer, None if the face was encrypted on its own
+    """
+    if len(init_vec) == LEGACY_IV_SIZE:
+        return 0, 'cfb8', bytes(init_vec), None
+
+    version, mode, frame_init_vec, offset = struct.unpack(INIT_VEC_FORMAT, init_vec)
+    if version > INIT_VEC_VERSION or mode >= len(MODES):
+        raise ValueError('Unsupported initialization vector version {} or mode {}'.format(version, mode))
+    return version, MODES[mode], frame_init_vec, offset
+
+
+def clip_boxes(boxes: List[Tuple[np.float64]],
+               shape: Tuple[int]):
+    """
+    Converts face boxes to integer coordinates within the frame
+    Args:
+        boxes: facial Coordinates
+        shape: shape of the frame
+
+    Return:
+        coordinates - list of (x1, y1, x2, y2) tuples
+    """
+    coordinates = []
+    for box in boxes:
+        x1, y1, x2, y2 = [int(b) for b in box[0:4]]
+        # draw boxes within the frame
+        x1 = max(0, x1)
+        y1 = max(0, y1)
+        x2 = min(shape[1], x2)
+        y2 = min(shape[0], y2)
+        coordinates.append((x1, y1, x2, y2))
+
+    return coordinates
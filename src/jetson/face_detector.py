@@ -1,3 +1,6 @@
+import os
+
+import cv2
 import numpy as np
 import torch
 
@@ -5,10 +8,61 @@ from src.jetson.models.Retinaface.data.config import cfg_mnet as cfg
 from src.jetson.models.Retinaface.data.config import cfg_inference as infer_params
 from src.jetson.models.utils.transform import BaseTransform
 from src.jetson.models.Retinaface.layers.functions.prior_box import PriorBox
-from src.jetson.models.utils.box_utils import decode, do_nms, postprocess
+from src.jetson.models.utils.box_utils import decode, decode_landm, do_nms, postprocess
+
+
+def tile_offsets(length: int, tile: int, overlap: float):
+    """
+    Returns the start offsets of overlapping tiles covering one frame dimension.
+    The last tile is aligned with the end of the frame.
+    Args:
+        length: Size of the frame dimension in pixels
+        tile: Size of a tile in pixels
+        overlap: Fraction of the tile shared with its neighbour
+    """
+    if length <= tile:
+        return [0]
+
+    step = max(1, int(tile * (1 - overlap)))
+    offsets = list(range(0, length - tile, step))
+    offsets.append(length - tile)
+    return offsets
+
+
+def motion_regions(previous_frame: np.ndarray, frame: np.ndarray, threshold=25, min_area=64, downscale=4):
+    """
+    Finds the regions of a frame that changed since the previous frame
+    Args:
+        previous_frame: A 3D numpy array containing the previous frame
+        frame: A 3D numpy array containing the current frame
+        threshold: Minimum intensity difference for a pixel to count as moving
+        min_area: Minimum area (in downscaled pixels) of a moving region
+        downscale: Factor the frames are shrunk by before comparing them
+
+    Return:
+        Bounding boxes (upper left corner(x, y), lower right corner(x, y)) of the moving regions in frame coordinates
+    """
+    size = (frame.shape[1] // downscale, frame.shape[0] // downscale)
+    previous_gray = cv2.cvtColor(cv2.resize(previous_frame, size), cv2.COLOR_BGR2GRAY)
+    gray = cv2.cvtColor(cv2.resize(frame, size), cv2.COLOR_BGR2GRAY)
+
+    _, mask = cv2.threshold(cv2.absdiff(previous_gray, gray), threshold, 255, cv2.THRESH_BINARY)
+    mask = cv2.dilate(mask, None, iterations=2)
+    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+
+    regions = []
+    for contour in contours:
+        if cv2.contourArea(contour) < min_area:
+            continue
+        x, y, w, h = cv2.boundingRect(contour)
+        regions.append((x * downscale, y * downscale, (x + w) * downscale, (y + h) * downscale))
+
+    return regions
+
 
 class FaceDetector:
-    def __init__(self, detector: str, detector_type: str, detection_threshold=0.7, cuda=True, set_default_dev=False):
+    def __init__(self, detector: str, detector_type: str, detection_threshold=0.7, cuda=True, set_default_dev=False,
+                 face_size_range=None):
         """
         Creates a FaceDetector object
         Args:
@@ -17,8 +71,12 @@ class FaceDetector:
             detection_threshold: The minimum threshold for a detection to be considered valid
             cuda: Whether or not to enable CUDA
             set_default_dev: Whether or not to set the default device for PyTorch
+            face_size_range: (min, max) expected face size in pixels of the detector input (retinaface only).
+                Anchors and pyramid levels that cannot produce faces of this size are pruned.
+                Defaults to the 'face_size_range' inference parameter
         """
 
+        self.ppe_classes = 0  # number of PPE classes predicted with the boxes (retinaface with a PPE head)
         if cuda and torch.cuda.is_available():
             self.device = torch.device("cuda:0")
             if set_default_dev:
@@ -41,103 +99,250 @@ class FaceDetector:
 
             self.net = BlazeFace(self.device == torch.device("cuda:0"))
             self.net.load_weights(detector)
-            self.net.load_anchors("models/BlazeFace/anchors.npy")
+            self.net.load_anchors(os.path.join(os.path.dirname(__file__), "models/BlazeFace/anchors.npy"))
             self.model_name = 'blazeface'
             self.net.min_score_thresh = 0.75
             self.net.min_suppression_threshold = 0.3
             self.transformer = BaseTransform(128, None)
 
         elif detector_type == 'retinaface':
-            from src.jetson.models.Retinaface.retinaface import RetinaFace, load_model
+            from src.jetson.models.Retinaface.retinaface import RetinaFace, get_ppe_classes, load_model
 
-            self.net = RetinaFace(cfg=cfg, phase='test')
+            # a model trained with a PPE head also classifies the protective equipment of each face
+            self.ppe_classes = get_ppe_classes(detector)
+            self.net = RetinaFace(cfg=dict(cfg, ppe_classes=self.ppe_classes), phase='test', detect_only=True)
             self.net = load_model(self.net, detector, load_to_cpu=self.device == torch.device("cpu"))
             self.model_name = 'retinaface'
             self.image_shape = infer_params["image_shape"]  # (H, W)
             self.resize = infer_params["resize"]
             self.transformer = BaseTransform((self.image_shape[1], self.image_shape[0]), (104, 117, 123))
-            priorbox = PriorBox(cfg, image_size=self.image_shape)
+            if face_size_range is None:
+                face_size_range = infer_params["face_size_range"]
+            priorbox = PriorBox(cfg, image_size=self.image_shape, face_size_range=face_size_range)
+            if face_size_range is not None:
+                self.net.prune_anchors(priorbox.min_sizes)
             priors = priorbox.forward()
             self.prior_data = priors.data.to(self.device)
 
         self.detection_threshold = detection_threshold
+        # Detector input tensor of the last detect call (ssd and retinaface), used to crop faces with ROI-align
+        self.input_tensor = None
         self.net.to(self.device)
         self.net.eval()
 
     def detect(self,
-               frame: np.ndarray):
+               frame: np.ndarray,
+               landmarks=False):
         """
         Performs face detection on the frame passed
         Args:
             frame: A 3D numpy array representing an image
+            landmarks: Also return the five facial landmarks of each face (retinaface only)
 
         Return:
-            The bounding boxes of the face(s) that were detected formatted (upper left corner(x, y) , lower right corner(x,y))
+            The bounding boxes of the face(s) that were detected formatted (upper left corner(x, y) , lower right corner(x,y)).
+            If landmarks is set, also a numpy array of shape [num_boxes, 5, 2] with the (x, y) frame coordinates of the
+            left eye, right eye, nose, left and right mouth corners of each box
         """
+        self.input_tensor = None
+        if landmarks and self.model_name != 'retinaface':
+            raise ValueError('Landmarks are only supported for retinaface')
 
         if self.model_name == 'ssd':
             x = torch.from_numpy(self.transformer(frame)[0]).permute(2, 0, 1)
-            x = Variable(x.unsqueeze(0)).to(self.device)
-            y = self.net(x)
-            detections = y.data
-            scale = torch.Tensor([frame.shape[1], image.shape[0], image.shape[1], image.shape[0]])
-            bboxes = []
-            j = 0
-            while j < detections.shape[2] and detections[0, 1, j, 0] > self.detection_threshold:
-                pt = (detections[0, 1, j, 1:] * scale).cpu().numpy()
-                x1, y1, x2, y2 = pt
-                conf = detections[0, 1, j, 0].item()
-                bboxes.append((x1, y1, x2, y2, conf))
-                j += 1
+            x = x.unsqueeze(0).to(self.device)
+            self.input_tensor = x
+            with torch.no_grad():
+                detections = self.net(x)
+
+            # face detections are sorted by descending score and padded with zeros, convert them all at once
+            faces = detections[0, 1]
+            faces = faces[faces[:, 0] > self.detection_threshold]
+            scale = torch.Tensor([frame.shape[1], frame.shape[0], frame.shape[1], frame.shape[0]]).to(faces.device)
+            faces = torch.cat((faces[:, 1:] * scale, faces[:, :1]), 1).cpu().numpy()
+            bboxes = [tuple(face) for face in faces]
 
             return bboxes
 
         elif self.model_name == 'blazeface':
             transformed_frame = self.transformer(frame)[0].astype(np.float32)
 
-            detections = self.net.predict_on_frame(transformed_frame)
+            detections = self.net.predict_on_image(transformed_frame)
             if isinstance(detections, torch.Tensor):
                 detections = detections.cpu().numpy()
 
             if detections.ndim == 1:
                 detections = np.expand_dims(detections, axis=0)
 
-            bboxes = []
-            for i in range(detections.shape[0]):
-                ymin = detections[i, 0] * frame.shape[0]
-                xmin = detections[i, 1] * frame.shape[1]
-                ymax = detections[i, 2] * frame.shape[0]
-                xmax = detections[i, 3] * frame.shape[1]
-                conf = detections[i, 16]
-
-                transformed_frame = img / 127.5 - 1.0
+            # detections are (ymin, xmin, ymax, xmax) relative to the frame, convert all of them at once
+            scale = np.array([frame.shape[1], frame.shape[0], frame.shape[1], frame.shape[0]], dtype=np.float32)
+            boxes = detections[:, [1, 0, 3, 2]] * scale
+            bboxes = [tuple(det) for det in np.hstack((boxes, detections[:, 16:17]))]
 
-                for k in range(6):
-                    kp_x = detections[i, 4 + k * 2] * transformed_frame.shape[1]
-                    kp_y = detections[i, 4 + k * 2 + 1] * transformed_frame.shape[0]
+            return bboxes
 
-                bboxes.append((xmin, ymin, xmax, ymax, conf))
+        elif self.model_name == 'retinaface':
+            dets = self._detect_retinaface(frame, landmarks=landmarks)
+            bboxes = [tuple(det[0:5]) for det in dets]
 
+            if landmarks:
+                return bboxes, dets[:, 5:15].reshape(-1, 5, 2)
             return bboxes
 
-        elif self.model_name == 'retinaface':
-            transformed_frame = (self.transformer(frame)[0]).transpose(2, 0, 1)
-            transformed_frame = torch.from_numpy(transformed_frame).unsqueeze(0)
-            transformed_frame = transformed_frame.to(self.device)
-            loc, conf, _ = self.net(
-                transformed_frame)  # forward pass: Returns bounding box location, confidence and facial landmark locations
+    def detect_with_labels(self,
+                           frame: np.ndarray):
+        """
+        Performs face detection and PPE classification on the frame passed in a single forward pass
+        (retinaface models trained with a PPE head only)
+        Args:
+            frame: A 3D numpy array representing an image
 
-            boxes = decode(loc.data.squeeze(0), self.prior_data, cfg['variance'])
+        Return:
+            The bounding boxes of the face(s) that were detected formatted (upper left corner(x, y) , lower right corner(x,y)),
+            and the PPE label of each box in the class order of the goggle classifier
+        """
+        if self.ppe_classes == 0:
+            raise ValueError('The detector was not trained with a PPE head')
+
+        dets = self._detect_retinaface(frame, ppe=True)
+        labels = dets[:, 5:5 + self.ppe_classes].argmax(axis=1).tolist()
+
+        return [tuple(det[0:5]) for det in dets], labels
+
+    def _detect_retinaface(self,
+                           frame: np.ndarray,
+                           ppe=False,
+                           landmarks=False):
+        """
+        Runs retinaface on the frame passed
+        Args:
+            frame: A 3D numpy array representing an image
+            ppe: Also return the PPE class probabilities of each detection
+            landmarks: Also return the landmarks of each detection
+
+        Return:
+            A 2D numpy array of detections (upper left corner(x, y), lower right corner(x,y), score) in frame
+            coordinates, followed by the landmarks (x, y) * 5 in frame coordinates if landmarks is set, and by
+            the PPE class probabilities if ppe is set
+        """
+        transformed_frame = (self.transformer(frame)[0]).transpose(2, 0, 1)
+        transformed_frame = torch.from_numpy(transformed_frame).unsqueeze(0)
+        transformed_frame = transformed_frame.to(self.device)
+        self.input_tensor = transformed_frame
+        with torch.no_grad():
+            # forward pass: Returns bounding box location, face confidence and landmarks (landmark heads are
+            # skipped unless requested), followed by the PPE class probabilities for a model with a PPE head
+            outputs = self.net(transformed_frame, landmarks=landmarks)
+        loc, conf = outputs[0], outputs[1]
+
+        # per prior values carried through thresholding and NMS after the score
+        extra = []
+        if landmarks:
+            landms = decode_landm(outputs[2].data.squeeze(0), self.prior_data, cfg['variance'])
+            scale = torch.Tensor([self.image_shape[1], self.image_shape[0]] * 5).to(landms.device)
+            extra.append(landms * scale / self.resize)
+        if ppe:
+            extra.append(outputs[3].squeeze(0))
+
+        boxes = decode(loc.data.squeeze(0), self.prior_data, cfg['variance'])
+        if extra:
+            boxes, scores, extra = postprocess(boxes, conf, self.image_shape, self.detection_threshold, self.resize,
+                                               extra=torch.cat(extra, dim=1))
+            dets = do_nms(boxes, scores, infer_params["nms_thresh"], extra=extra)
+        else:
             boxes, scores = postprocess(boxes, conf, self.image_shape, self.detection_threshold, self.resize)
             dets = do_nms(boxes, scores, infer_params["nms_thresh"])
 
-            #scale box coordinates back to original frame dimensions
-            for det in dets:
-                det[0] *= frame.shape[1] / transformed_frame.shape[3]
-                det[1] *= frame.shape[0] / transformed_frame.shape[2]
-                det[2] *= frame.shape[1] / transformed_frame.shape[3]
-                det[3] *= frame.shape[0] / transformed_frame.shape[2]
+        #scale box (and landmark) coordinates back to original frame dimensions
+        scale = np.array([frame.shape[1] / transformed_frame.shape[3], frame.shape[0] / transformed_frame.shape[2]],
+                         dtype=dets.dtype)
+        dets[:, 0:4] *= np.tile(scale, 2)
+        if landmarks:
+            dets[:, 5:15] *= np.tile(scale, 5)
 
-            bboxes = [tuple(det[0:5]) for det in dets]
+        return dets
 
-            return bboxes
+    def detect_tiled(self,
+                     frame: np.ndarray,
+                     overlap=0.25,
+                     regions=None,
+                     full_frame=True):
+        """
+        Performs face detection on overlapping tiles of a high resolution frame (retinaface only).
+        Tiles have the size of the detector input and are cut at the native frame resolution, so small
+        faces are not shrunk below the smallest anchor. All tiles (plus, optionally, the whole frame
+        resized to the detector input) are run in a single batched forward pass and the detections
+        are merged with a global non-max suppression.
+        Args:
+            frame: A 3D numpy array representing an image
+            overlap: Fraction of a tile shared with its neighbour. Faces smaller than the overlap are
+                always fully contained in a tile
+            regions: Boxes (upper left corner(x, y), lower right corner(x, y)) in frame coordinates, e.g.
+                motion regions or previous detections. Only tiles intersecting a region are run. None runs all tiles
+            full_frame: Also run the detector on the whole frame, which finds faces larger than the overlap
+
+        Return:
+            The bounding boxes of the face(s) that were detected formatted (upper left corner(x, y) , lower right corner(x,y))
+        """
+        # the tiles are not one input tensor, faces cannot be cropped from it with ROI-align
+        self.input_tensor = None
+        if self.model_name != 'retinaface':
+            raise ValueError('Tiled detection is only supported for retinaface')
+
+        tile_h, tile_w = self.image_shape
+        frame_h, frame_w = frame.shape[0:2]
+        margin = 2  # detections this close to a tile edge inside the frame are cut by the tile
+
+        tiles = []
+        for y in tile_offsets(frame_h, tile_h, overlap):
+            for x in tile_offsets(frame_w, tile_w, overlap):
+                if regions is not None and not any(x < r[2] and r[0] < x + tile_w and y < r[3] and r[1] < y + tile_h
+                                                   for r in regions):
+                    continue
+                tiles.append((x, y))
+
+        batch = []
+        for x, y in tiles:
+            crop = frame[y:y + tile_h, x:x + tile_w]
+            tile = np.zeros((tile_h, tile_w, 3), dtype=np.float32)  # padding is the mean color after subtraction
+            tile[:crop.shape[0], :crop.shape[1]] = crop.astype(np.float32) - self.transformer.mean
+            batch.append(tile)
+        if full_frame:
+            batch.append(self.transformer(frame)[0])
+        if len(batch) == 0:
+            return []
+
+        transformed_frames = torch.from_numpy(np.stack(batch).transpose(0, 3, 1, 2)).to(self.device)
+        with torch.no_grad():
+            outputs = self.net(transformed_frames)
+        loc, conf = outputs[0], outputs[1]
+
+        all_boxes = []
+        all_scores = []
+        for i in range(len(batch)):
+            boxes = decode(loc.data[i], self.prior_data, cfg['variance'])
+            boxes, scores = postprocess(boxes, conf[i:i + 1], self.image_shape, self.detection_threshold, self.resize)
+
+            if i < len(tiles):
+                x, y = tiles[i]
+                boxes += np.array([x, y, x, y], dtype=boxes.dtype)
+                cut = np.zeros(len(boxes), dtype=bool)
+                if x > 0:
+                    cut |= boxes[:, 0] < x + margin
+                if y > 0:
+                    cut |= boxes[:, 1] < y + margin
+                if x + tile_w < frame_w:
+                    cut |= boxes[:, 2] > x + tile_w - margin
+                if y + tile_h < frame_h:
+                    cut |= boxes[:, 3] > y + tile_h - margin
+                boxes = boxes[~cut]
+                scores = scores[~cut]
+            else:
+                boxes *= np.array([frame_w / tile_w, frame_h / tile_h, frame_w / tile_w, frame_h / tile_h], dtype=boxes.dtype)
+
+            all_boxes.append(boxes)
+            all_scores.append(scores)
+
+        dets = do_nms(np.concatenate(all_boxes), np.concatenate(all_scores), infer_params["nms_thresh"])
+
+        return [tuple(det[0:5]) for det in dets]
@@ -8,41 +8,54 @@ from multiprocessing import Process, Queue, Value
 import cv2
 import torch
 
-from src.jetson.face_detector import FaceDetector
+from src.jetson.face_detector import FaceDetector, motion_regions
 from src.jetson.video_capturer import VideoCapturer
-from src.jetson.classifier import Classifier
-from src.jetson.encryptor import Encryptor
+from src.jetson.classifier import Classifier, load_classifier
+from src.jetson.encryptor import Encryptor, clip_boxes, load_key
+from src.jetson.storage import IMAGE_FORMATS, ImageWriter, SegmentRecorder, encode_frame, encode_keyframe, \
+    write_frame, write_keyframe
 from src.db import data_insertion
 from src.jetson import name_giver
 
 fileCount = Value('i', 0)
 encryptRet = Queue() # Shared memory queue to allow child encryption process to return to parent
+createdDirs = set() # Output directories writeImg has created, so they are not checked for every frame
 DETECTOR_TYPES = ['blazeface', 'retinaface', 'ssd']
 
 
-def writeImg(img, output_dir):
+def writeImg(img, output_dir, coordinates=(), image_format='jpg', keyframe=None):
     """
     This method is used to write an image to an output directory
     Args:
         img: A 3D numpy array containing image to be written
         output_dir: directory to be written to
+        coordinates: encrypted face coordinates clipped to the image, stored raw in the 'efr' and 'roi' formats
+        image_format: one of the IMAGE_FORMATS in storage.py. 'jpg' is lossy and the faces cannot be decrypted
+        keyframe: file name of the background keyframe in output_dir, for the 'roi' format
     Ret:
         face_file_name: os path to written file
     """
-    if not os.path.isdir(output_dir):
-        os.mkdir(output_dir)
+    if output_dir not in createdDirs:
+        os.makedirs(output_dir, exist_ok=True)
+        createdDirs.add(output_dir)
     global fileCount
-    face_file_name = name_giver.generate_unique_name() + ".jpg"
+    face_file_name = name_giver.generate_unique_name() + "." + image_format
     face_file_path = os.path.join(output_dir, face_file_name)
 
-    cv2.imwrite(face_file_path, img)
+    try:
+        write_frame(face_file_path, img, coordinates, keyframe)
+    except FileNotFoundError:
+        # the directory was removed since it was created, retry once and let a second failure propagate
+        os.makedirs(output_dir, exist_ok=True)
+        write_frame(face_file_path, img, coordinates, keyframe)
     with fileCount.get_lock():
         fileCount.value += 1
 
     return face_file_name
 
 
-def encryptWorker(encryptor, img, boxes, output_dir):
+def encryptWorker(encryptor, img, boxes, output_dir, image_format='jpg', keyframe=None, new_keyframe=False,
+                  encode_only=False):
     """
     This method is intended to be spawned as a separate process to handle encrypting and writing of individual frames
     Args:
@@ -50,9 +63,23 @@ def encryptWorker(encryptor, img, boxes, output_dir):
         img: A 3D numpy array containing an image to be enrypted and written
         boxes: facial Coordinates
         output_dir: directory to be written to
+        image_format: one of the IMAGE_FORMATS in storage.py
+        keyframe: file name (or '#<index>' in a segment) of the background keyframe of the 'roi' format
+        new_keyframe: write the background of this frame as the keyframe
+        encode_only: return the encoded keyframe and frame for the parent to append to its segment or pass to its
+            image writer instead of writing them to files
     """
     encryptedImg, init_vec_list = encryptor.encryptFrame(img, boxes)
-    writtenImg = writeImg(encryptedImg, output_dir)
+    coordinates = clip_boxes(boxes, img.shape)
+    if encode_only:
+        data = encode_frame(encryptedImg, coordinates, image_format, keyframe)
+        keyframe_data = encode_keyframe(encryptedImg, coordinates) if new_keyframe else None
+        encryptRet.put([(keyframe_data, data), init_vec_list])
+        return
+
+    writtenImg = writeImg(encryptedImg, output_dir, coordinates, image_format, keyframe)
+    if new_keyframe:
+        write_keyframe(os.path.join(output_dir, keyframe), encryptedImg, coordinates)
     encryptRet.put([writtenImg, init_vec_list])
 
 
@@ -105,25 +132,63 @@ if __name__ == "__main__":
     output_dir = args["OUTPUT_DIR"]
     gstreamer = args["GSTREAMER"] # This should be true if running on jetson nano with picam
     draw_frame = args["DRAW_FRAME"]
+    face_size_range = args["FACE_SIZE_RANGE"] # (min, max) face size in detector input pixels, null to keep all anchors
+    capture_size = args["CAPTURE_SIZE"] # (width, height) of the gstreamer output frames, null for the default 820x616
+    tiled_detection = args["TILED_DETECTION"] # Detect on overlapping tiles of the full resolution frame (retinaface only)
+    tile_refresh = args["TILE_REFRESH"] # Run all tiles every n frames, otherwise only tiles with motion or previous faces
+    roi_align = args["ROI_ALIGN"] # Crop faces for the classifier from the detector input tensor instead of the frame
+    encryption_mode = args["ENCRYPTION_MODE"] # 'legacy' writes a CFB-8 IV per face, 'ctr', 'cfb128' or 'cfb8' one IV per frame
+    encryption_threads = args["ENCRYPTION_THREADS"] # Threads encrypting the faces of a frame in parallel (ctr only)
+    key_file = args["ENCRYPTION_KEY_FILE"] # Hex key file, created on first run, null for a key lost on exit
+    image_format = args["IMAGE_FORMAT"] # 'efr', 'roi' or 'png' keep the faces exact, 'jpg' faces cannot be decrypted
+    keyframe_interval = args["KEYFRAME_INTERVAL"] # Seconds between the background keyframes of the 'roi' format
+    record_segments = args["RECORD_SEGMENTS"] # Append frames to rolling segment files instead of a file per frame
+    segment_minutes = args["SEGMENT_MINUTES"] # Minutes of recording per segment file
+    writer_threads = args["WRITER_THREADS"] # Threads writing frames to date/hour subdirectories, 0 to write in the workers
+    writer_queue_size = args["WRITER_QUEUE_SIZE"] # Frames waiting to be written before the main loop blocks
+    fsync_batch = args["FSYNC_BATCH"] # Written frames synced to disk together, 0 to leave syncing to the OS
 
     if detector_type not in DETECTOR_TYPES:
         print(
             'Please include a valid detector type (\'blazeface\', \'ssd\', or \'retinaface\'')
         exit(1)
+    if image_format not in IMAGE_FORMATS:
+        print('Please include a valid image format (\'efr\', \'roi\', \'png\', or \'jpg\')')
+        exit(1)
 
     device = torch.device('cpu')
     if cuda and torch.cuda.is_available():
         device = torch.device('cuda:0')
 
-    classifier_model = torch.load(classifier, map_location=device)
-    classifier_model.eval()
-
-    capturer = VideoCapturer(gstreamer)
+    capturer = VideoCapturer(gstreamer, display_size=capture_size)
     detector = FaceDetector(detector=detector, detector_type=detector_type,
-                            cuda=cuda and torch.cuda.is_available(), set_default_dev=True)
-    classifier = Classifier(classifier_model, cuda)
-    encryptor = Encryptor()
+                            cuda=cuda and torch.cuda.is_available(), set_default_dev=True,
+                            face_size_range=face_size_range)
 
+    # A detector trained with a PPE head classifies the faces itself, so the classifier is not needed
+    use_ppe_head = detector.ppe_classes > 0 and not tiled_detection
+    use_landmarks = False
+    if not use_ppe_head:
+        classifier = Classifier(load_classifier(classifier, device), cuda)
+        # eye classifiers need the eye landmarks of each face
+        use_landmarks = classifier.crop_mode == 'eyes'
+        if use_landmarks and (detector_type != 'retinaface' or tiled_detection):
+            print('Eye classifiers need the landmarks of the retinaface detector without tiled detection')
+            exit(1)
+    key = load_key(key_file, create=True) if key_file else None
+    encryptor = Encryptor(encryption_mode, encryption_threads, key=key)
+
+    recorder = SegmentRecorder(output_dir, segment_minutes) if record_segments else None
+    writer = None
+    if recorder is None and writer_threads > 0:
+        writer = ImageWriter(output_dir, writer_threads, writer_queue_size, fsync_batch)
+
+    boxes = []
+    keyframe = None
+    keyframe_time = 0
+    keyframe_shard = None
+    previous_frame = None
+    frame_count = 0
     run_face_detection: bool = True
     while run_face_detection: # main video detection loop that will iterate until ESC key is entered
         start_time = time.time()
@@ -135,21 +200,73 @@ if __name__ == "__main__":
             capturer.reboot()
             frame = capturer.get_frame()
             
-        boxes = detector.detect(frame)
-        encryptedImg = frame.copy() # copy memory for encrypting image separate from unencrypted image
-
+        if tiled_detection:
+            regions = None
+            if previous_frame is not None and frame_count % tile_refresh != 0:
+                regions = list(boxes) + motion_regions(previous_frame, frame)
+            boxes = detector.detect_tiled(frame, regions=regions)
+            previous_frame = frame
+            frame_count += 1
+        elif use_ppe_head:
+            boxes, label = detector.detect_with_labels(frame)
+        elif use_landmarks:
+            boxes, landmarks = detector.detect(frame, landmarks=True)
+        else:
+            boxes = detector.detect(frame)
         if len(boxes) != 0:
+            # a new segment needs its own keyframe
+            if recorder is not None and recorder.rotate(start_time):
+                keyframe = None
+            # as does a new date/hour subdirectory, keyframes are looked up next to the frame
+            if writer is not None and writer.shard(start_time) != keyframe_shard:
+                keyframe, keyframe_shard = None, writer.shard(start_time)
+
+            # in the 'roi' format, only the faces are stored, with a background keyframe every keyframe_interval
+            new_keyframe = image_format == 'roi' and (keyframe is None
+                                                      or start_time - keyframe_time >= keyframe_interval)
+            if new_keyframe:
+                # in a segment, the keyframe is appended right before the frame
+                keyframe = name_giver.generate_unique_name() + ".efr" if recorder is None \
+                    else '#{}'.format(recorder.next_index)
+                keyframe_time = start_time
+
+            # the faces are encrypted in place in the memory of the worker process, which has its own copy of the
+            # frame, so the frame is not copied here
             p1 = Process(target=encryptWorker, args=(
-                encryptor, encryptedImg, boxes, output_dir))
+                encryptor, frame, boxes, output_dir, image_format, keyframe, new_keyframe,
+                recorder is not None or writer is not None))
             p1.daemon = True
             p1.start()
 
-            label = classifier.classifyFrame(frame, boxes)
+            # with the PPE head, labels were already predicted with the boxes
+            if not use_ppe_head:
+                if use_landmarks:
+                    label = classifier.classifyFrame(frame, boxes, landmarks=landmarks)
+                elif roi_align and detector.input_tensor is not None:
+                    label = classifier.classifyFrameTensor(detector.input_tensor, boxes, frame.shape,
+                                                           detector.transformer.mean)
+                else:
+                    label = classifier.classifyFrame(frame, boxes)
 
-            if send_to_database:
+            segment_name, frame_index = None, None
+            if recorder is not None:
+                (keyframe_data, data), init_vec_list = encryptRet.get()
+                if keyframe_data is not None:
+                    recorder.append(keyframe_data)
+                segment_name, frame_index = recorder.segment_name, recorder.append(data)
+                image_name = name_giver.generate_unique_name()
+            elif writer is not None:
+                # written in the background, the database gets the path relative to output_dir
+                (keyframe_data, data), init_vec_list = encryptRet.get()
+                if keyframe_data is not None:
+                    writer.write(keyframe_data, keyframe, start_time)
+                image_name = writer.write(data, name_giver.generate_unique_name() + "." + image_format, start_time)
+            elif send_to_database:
                 image_name, init_vec_list = encryptRet.get()
-                data_insertion.data_insert(
-                    image_name, image_date, image_time, init_vec_list, boxes, output_dir, label)
+
+            if send_to_database:
+                data_insertion.data_insert(image_name, image_date, image_time, init_vec_list, boxes, output_dir, label,
+                                           segment_name, frame_index)
 
             fps = 1 / (time.time() - start_time)
             if draw_frame:
@@ -162,5 +279,9 @@ if __name__ == "__main__":
                 run_face_detection = False
 
     capturer.close()
+    if recorder is not None:
+        recorder.close()
+    if writer is not None:
+        writer.close()
     cv2.destroyAllWindows()
     exit(0)
@@ -258,17 +258,11 @@ class BlazeFace(nn.Module):
         with torch.no_grad():
             out = self.__call__(x)
 
-        # 3. Postprocess the raw predictions:
-        detections = self._tensors_to_detections(out[0], out[1], self.anchors)
+        # 3. Postprocess the raw predictions for the whole batch at once:
+        detections, valid = self._tensors_to_padded_detections(out[0], out[1], self.anchors)
 
         # 4. Non-maximum suppression to remove overlapping detections:
-        filtered_detections = []
-        for i in range(len(detections)):
-            faces = self._weighted_non_max_suppression(detections[i])
-            faces = torch.stack(faces) if len(faces) > 0 else torch.zeros((0, 17))
-            filtered_detections.append(faces)
-
-        return filtered_detections
+        return self._weighted_non_max_suppression_batch(detections, valid)
 
     def _tensors_to_detections(self, raw_box_tensor:torch.Tensor, raw_score_tensor:torch.Tensor, anchors:torch.Tensor):
         """The output of the neural network is a tensor of shape (b, 896, 16)
@@ -315,6 +309,22 @@ class BlazeFace(nn.Module):
 
         return output_detections
 
+    def _tensors_to_padded_detections(self, raw_box_tensor:torch.Tensor, raw_score_tensor:torch.Tensor, anchors:torch.Tensor):
+        """Batched version of _tensors_to_detections. Instead of a list of
+        detections of different lengths, returns all the (b, 896, 17) decoded
+        detections and a (b, 896) mask of the ones above the score threshold.
+        """
+        detection_boxes = self._decode_boxes(raw_box_tensor, anchors)
+
+        thresh = self.score_clipping_thresh
+        raw_score_tensor = raw_score_tensor.clamp(-thresh, thresh)
+        detection_scores = raw_score_tensor.sigmoid()
+
+        detections = torch.cat((detection_boxes, detection_scores), dim=-1)
+        valid = detection_scores.squeeze(dim=-1) >= self.min_score_thresh
+
+        return detections, valid
+
     def _decode_boxes(self, raw_boxes:torch.Tensor, anchors:torch.Tensor):
         """Converts the predictions into actual coordinates using
         the anchor boxes. Processes the entire batch at once.
@@ -332,12 +342,11 @@ class BlazeFace(nn.Module):
         boxes[..., 2] = y_center + h / 2.  # ymax
         boxes[..., 3] = x_center + w / 2.  # xmax
 
-        for k in range(6):
-            offset = 4 + k*2
-            keypoint_x = raw_boxes[..., offset    ] / self.x_scale * anchors[:, 2] + anchors[:, 0]
-            keypoint_y = raw_boxes[..., offset + 1] / self.y_scale * anchors[:, 3] + anchors[:, 1]
-            boxes[..., offset    ] = keypoint_x
-            boxes[..., offset + 1] = keypoint_y
+        # decode the 6 (x, y) keypoints at once
+        keypoint_scale = raw_boxes.new_tensor([self.x_scale, self.y_scale])
+        keypoints = raw_boxes[..., 4:].reshape(raw_boxes.shape[:-1] + (6, 2))
+        keypoints = keypoints / keypoint_scale * anchors[:, None, 2:4] + anchors[:, None, 0:2]
+        boxes[..., 4:] = keypoints.reshape(raw_boxes.shape[:-1] + (12,))
 
         return boxes
 
@@ -399,6 +408,76 @@ class BlazeFace(nn.Module):
         return output_detections
 
 
+    def _weighted_non_max_suppression_batch(self, detections:torch.Tensor, valid:torch.Tensor):
+        """Vectorized version of _weighted_non_max_suppression that processes
+        a whole batch at once.
+
+        The greedy grouping (the highest scoring remaining detection absorbs
+        every remaining detection that overlaps it) is computed from the
+        pairwise IOU matrix: a detection leads a group if no higher scoring
+        leader overlaps it, which is solved as a fixed point over all
+        detections, and every other detection joins the first leader that
+        overlaps it.
+
+        The input detections should be a Tensor of shape (b, count, 17) and
+        valid a (b, count) mask of the detections to consider.
+
+        Returns a list with a (num_faces, 17) tensor for each image in the
+        batch, identical to running _weighted_non_max_suppression per image.
+        """
+        batch_size = detections.shape[0]
+
+        # Sort the detections from highest to lowest score, invalid ones last.
+        scores = detections[..., 16].masked_fill(~valid, -1.0)
+        count = int(valid.sum(dim=1).max()) if batch_size > 0 else 0
+        if count == 0:
+            return [torch.zeros((0, 17)) for _ in range(batch_size)]
+
+        order = torch.argsort(scores, dim=1, descending=True)[:, :count]
+        detections = torch.gather(detections, 1, order.unsqueeze(-1).expand(-1, -1, 17))
+        valid = torch.gather(valid, 1, order)
+
+        # overlaps[b, i, j]: detection j would be absorbed by detection i
+        boxes = detections[..., :4]
+        max_xy = torch.min(boxes[..., None, 2:], boxes[..., None, :, 2:])
+        min_xy = torch.max(boxes[..., None, :2], boxes[..., None, :, :2])
+        inter = torch.clamp((max_xy - min_xy), min=0)
+        inter = inter[..., 0] * inter[..., 1]
+        area = (boxes[..., 2] - boxes[..., 0]) * (boxes[..., 3] - boxes[..., 1])
+        ious = inter / (area[..., :, None] + area[..., None, :] - inter)
+        overlaps = (ious > self.min_suppression_threshold) & valid[..., :, None] & valid[..., None, :]
+
+        # A detection leads a group if no higher scoring leader overlaps it.
+        higher = torch.ones((count, count), dtype=torch.bool, device=detections.device).triu(diagonal=1)
+        overlaps_lower = overlaps & higher
+        leaders = valid
+        while True:
+            suppressed = (leaders[..., :, None] & overlaps_lower).any(dim=1)
+            new_leaders = valid & ~suppressed
+            if torch.equal(new_leaders, leaders):
+                break
+            leaders = new_leaders
+
+        # Every detection joins the first (highest scoring) leader that overlaps it.
+        candidates = leaders[..., :, None] & overlaps
+        membership = candidates & (candidates.long().cumsum(dim=1) == 1)
+
+        # Take an average of the coordinates from the overlapping
+        # detections, weighted by their confidence scores.
+        weights = membership.to(detections.dtype) * detections[..., None, :, 16]
+        total_score = weights.sum(dim=2)
+        group_size = membership.sum(dim=2)
+        weighted = torch.bmm(weights, detections[..., :16]) / total_score.clamp(min=1e-12)[..., None]
+
+        blended = group_size > 1
+        weighted_detections = detections.clone()
+        weighted_detections[..., :16] = torch.where(blended[..., None], weighted, detections[..., :16])
+        weighted_detections[..., 16] = torch.where(blended, total_score / group_size.clamp(min=1).to(detections.dtype),
+                                                   detections[..., 16])
+
+        return [weighted_detections[i, leaders[i]] for i in range(batch_size)]
+
+
 def overlap_similarity(box, other_boxes:torch.Tensor):
     """Computes the IOU between a bounding box and set of other boxes."""
     return jaccard(box.unsqueeze(0), other_boxes).squeeze(0)
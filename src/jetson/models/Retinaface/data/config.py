@@ -5,7 +5,9 @@ cfg_inference = {
                                 #For example, input_shape = (240, 320) => resize = 0.5
     'top_k_before_nms' : 5000,  # Keep top k detections before NMS
     'top_k_after_nms': 750,     #Keep top k detections after NMS
-    'nms_thresh': 0.3           #Non-max suppression threshold
+    'nms_thresh': 0.3,          #Non-max suppression threshold
+    'face_size_range': None     #(min, max) face size in pixels of the detector input. If set, anchors
+                                #and pyramid levels that cannot match faces of this size are pruned
 }
 
 
@@ -27,7 +29,8 @@ cfg_mnet = {
     'pretrain': False,                                          #Use pretrained model
     'return_layers': {'stage1': 1, 'stage2': 2, 'stage3': 3},   #Layers to train
     'in_channel': 32,                                           #Number of input channel
-    'out_channel': 64                                           #Number of output channel
+    'out_channel': 64,                                          #Number of output channel
+    'ppe_classes': 0                                            #Number of PPE classes of the PPE head, 0 for no PPE head
 }
 
 # Resnet50 backbone configurations for training
@@ -48,5 +51,6 @@ cfg_re50 = {
     'pretrain': True,                                           #Use pretrained model
     'return_layers': {'layer2': 1, 'layer3': 2, 'layer4': 3},   #Layers to train
     'in_channel': 256,                                          #Number of input channel
-    'out_channel': 256                                          #Number of output channel
+    'out_channel': 256,                                         #Number of output channel
+    'ppe_classes': 0                                            #Number of PPE classes of the PPE head, 0 for no PPE head
 }
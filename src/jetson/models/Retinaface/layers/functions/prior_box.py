@@ -4,8 +4,27 @@ import numpy as np
 from math import ceil
 
 
+def select_min_sizes(min_sizes, face_size_range, scale=2.0):
+    """Drop the anchor sizes that cannot match a face of the expected size.
+
+    An anchor of size s is kept when the face size range overlaps [s / scale, s * scale],
+    the sizes a face can have and still be regressed from that anchor.
+
+    Args:
+        min_sizes(list) - anchor sizes for each feature map, e.g. cfg['min_sizes']
+        face_size_range(tuple) - (min_face_size, max_face_size) in pixels of the detector input
+        scale(float) - how far a face may be from the anchor size
+
+    Returns the anchor sizes to keep for each feature map. A feature map without
+    anchors left has an empty list.
+    """
+    min_face, max_face = face_size_range
+    return [[size for size in sizes if size * scale >= min_face and size / scale <= max_face]
+            for sizes in min_sizes]
+
+
 class PriorBox(object):
-    def __init__(self, cfg, image_size=None, phase='train'):
+    def __init__(self, cfg, image_size=None, phase='train', face_size_range=None):
         """Compute priorbox coordinates in center-offset form for each source
         feature map.
 
@@ -13,9 +32,13 @@ class PriorBox(object):
             cfg(dict) - configuration of model (MobileNetV1 or Resnet50)
             image_size(tuple) - (image_height, image_width)
             phase(string) - train or test            
+            face_size_range(tuple) - (min_face_size, max_face_size) in pixels. If given, only
+                anchors that can match faces in this range are generated (see select_min_sizes)
         """
         super(PriorBox, self).__init__()
         self.min_sizes = cfg['min_sizes']
+        if face_size_range is not None:
+            self.min_sizes = select_min_sizes(self.min_sizes, face_size_range)
         self.steps = cfg['steps']
         self.clip = cfg['clip']
         self.image_size = image_size
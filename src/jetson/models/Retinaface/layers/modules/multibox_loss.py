@@ -1,10 +1,7 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from torch.autograd import Variable
-from models.utils.box_utils import match, log_sum_exp
-from models.RetinaFace.data import cfg_mnet
-GPU = cfg_mnet['gpu_train']
+from src.jetson.models.utils.box_utils import match_landm, log_sum_exp
 
 class MultiBoxLoss(nn.Module):
     """SSD Weighted Loss Function
@@ -45,36 +42,43 @@ class MultiBoxLoss(nn.Module):
         """Multibox Loss
         Args:
             predictions (tuple): A tuple containing loc preds, conf preds,
-            and prior boxes from SSD net.
+            landmark preds and, for a model with a PPE head, PPE class preds from RetinaFace.
                 conf shape: torch.size(batch_size,num_priors,num_classes)
                 loc shape: torch.size(batch_size,num_priors,4)
-                priors shape: torch.size(num_priors,4)
+                landm shape: torch.size(batch_size,num_priors,10)
+                ppe shape: torch.size(batch_size,num_priors,ppe_classes)
+            priors shape: torch.size(num_priors,4)
 
             ground_truth (tensor): Ground truth boxes and labels for a batch,
-                shape: [batch_size,num_objs,5] (last idx is the label).
+                shape: [batch_size,num_objs,15] (4 box coordinates, 10 landmark coordinates, face label),
+                or [batch_size,num_objs,16] with the PPE label of each face (-1 if unknown) in the last column.
+
+        Return:
+            localization, classification and landmark losses, and the PPE classification loss if PPE preds were given
         """
 
-        localization_data, confidence_data, landmarks_data = predictions          #Split prediction tuple into bounding box locations, confidence, facial landmark locations
+        localization_data, confidence_data, landmarks_data = predictions[:3]      #Split prediction tuple into bounding box locations, confidence, facial landmark locations
+        ppe_data = predictions[3] if len(predictions) > 3 else None              #PPE class predictions of a model with a PPE head
+        device = localization_data.device
         num_preds = localization_data.size(0)                           #Get number of predictions
         num_priors = (priors.size(0))                                   #Get number of priors
 
         # match priors (default boxes) and ground truth boxes
-        localization_tensor = torch.Tensor(num_preds, num_priors, 4)        #Create tensor for prior bounding box locations
-        landmarks_tensor = torch.Tensor(num_preds, num_priors, 10)     #Create tensor for prior facial landmark locations
-        confidence_tensor = torch.LongTensor(num_preds, num_priors)      #Create tensor for prior confidence scores
+        localization_tensor = torch.Tensor(num_preds, num_priors, 4).to(device)        #Create tensor for prior bounding box locations
+        landmarks_tensor = torch.Tensor(num_preds, num_priors, 10).to(device)     #Create tensor for prior facial landmark locations
+        confidence_tensor = torch.LongTensor(num_preds, num_priors).to(device)      #Create tensor for prior confidence scores
+        ppe_tensor = torch.full((num_preds, num_priors), -1, dtype=torch.long, device=device)  #Create tensor for prior PPE labels
         for idx in range(num_preds):
             truths = targets[idx][:, :4].data               #Get ground truth data for bound box locations
-            labels = targets[idx][:, -1].data               #Get ground truth data for classification label
+            labels = targets[idx][:, 14].data               #Get ground truth data for classification label
             landmarks = targets[idx][:, 4:14].data             #Get ground truth data for facial landmark locations
-            defaults = priors.data                          #Get priors data
-            match(self.threshold, truths, defaults, self.variance, labels, landmarks, localization_tensor, confidence_tensor, landmarks_tensor, idx)   #Match priors to ground truth boxes
-        if GPU:
-            #If GPU is available, assign priors to perform computation using cuda. (Enable cuda)
-            localization_tensor = localization_tensor.cuda()
-            confidence_tensor = confidence_tensor.cuda()
-            landmarks_tensor = landmarks_tensor.cuda()
-
-        zeros = torch.tensor(0).cuda()                                      #Create a tensor with value 0
+            defaults = priors.data.to(device)               #Get priors data
+            matched = match_landm(self.threshold, truths.to(device), defaults, self.variance, labels.to(device),
+                                  landmarks.to(device), localization_tensor, confidence_tensor, landmarks_tensor, idx)   #Match priors to ground truth boxes
+            if ppe_data is not None and targets[idx].size(1) > 15:
+                ppe_tensor[idx] = targets[idx][:, 15].data.to(device).long()[matched]  #PPE label of the face matched to each prior
+
+        zeros = torch.tensor(0).to(device)                                      #Create a tensor with value 0
         # landm Loss (Smooth L1)
         # Shape: [batch,num_priors,10]
         pos1 = confidence_tensor > zeros                                               #Get all the priors where confidence is greater than 0
@@ -89,6 +93,13 @@ class MultiBoxLoss(nn.Module):
         pos = confidence_tensor != zeros                                               #Get all the priors where confidence is not 0
         confidence_tensor[pos] = 1                                                     #Set the confidence values of these to 1
 
+        # PPE Loss (CrossEntropy) over the positive priors of faces with a known PPE label
+        if ppe_data is not None:
+            ppe_tensor[~pos] = -1                                                      #Ignore background priors
+            num_pos_ppe = max((ppe_tensor >= 0).sum().float(), 1)                       #Normalization factor of the PPE loss
+            ppe_loss = F.cross_entropy(ppe_data.reshape(-1, ppe_data.size(-1)), ppe_tensor.view(-1),
+                                       ignore_index=-1, reduction='sum') / num_pos_ppe
+
         # Localization Loss (Smooth L1)
         # Shape: [batch,num_priors,4]
         pos_idx = pos.unsqueeze(pos.dim()).expand_as(localization_data)                          #Expand pos_idx to the size of localization_data
@@ -122,4 +133,7 @@ class MultiBoxLoss(nn.Module):
         classification_loss /= N                                                #Calculate final classification loss
         landmarks_loss /= N1                                                    #Calculate localization loss of facial coordinates
 
+        if ppe_data is not None:
+            return localization_loss, classification_loss, landmarks_loss, ppe_loss
+
         return localization_loss, classification_loss, landmarks_loss           #Return losses for weight update
@@ -139,28 +139,35 @@ class FPN(nn.Module):
         self.merge1 = conv_bn(out_channels, out_channels, leaky = leaky)
         self.merge2 = conv_bn(out_channels, out_channels, leaky = leaky)
 
-    def forward(self, input:torch.Tensor):
+    def forward(self, input:torch.Tensor, levels=(0, 1, 2)):
         '''
         Applies network layers and ops on tensor
 
         Args:
             input: tensor outputted by backbone
+            levels: pyramid levels whose output is needed. Branches that only feed
+                lower levels are skipped when those levels are not needed.
 
-        Returns output tensor after performing operations
+        Returns output tensor after performing operations (None for skipped levels)
         '''
         input = list(input.values())
+        lowest_level = min(levels)
 
-        output1 = self.output1(input[0])
-        output2 = self.output2(input[1])
+        output1 = None
+        output2 = None
         output3 = self.output3(input[2])
 
-        up3 = F.interpolate(output3, size=[output2.size(2), output2.size(3)], mode="nearest")
-        output2 = output2 + up3
-        output2 = self.merge2(output2)
-
-        up2 = F.interpolate(output2, size=[output1.size(2), output1.size(3)], mode="nearest")
-        output1 = output1 + up2
-        output1 = self.merge1(output1)
+        if lowest_level <= 1:
+            output2 = self.output2(input[1])
+            up3 = F.interpolate(output3, size=[output2.size(2), output2.size(3)], mode="nearest")
+            output2 = output2 + up3
+            output2 = self.merge2(output2)
+
+        if lowest_level == 0:
+            output1 = self.output1(input[0])
+            up2 = F.interpolate(output2, size=[output1.size(2), output1.size(3)], mode="nearest")
+            output1 = output1 + up2
+            output1 = self.merge1(output1)
 
         out = [output1, output2, output3]
         return out
@@ -46,6 +46,7 @@ class BboxHead(nn.Module):
             num_anchors(int) - Number of anchor boxes
         '''
         super(BboxHead,self).__init__()
+        self.num_anchors = num_anchors
         self.conv1x1 = nn.Conv2d(inchannels,num_anchors*4,kernel_size=(1,1),stride=1,padding=0)
 
     def forward(self,x:torch.Tensor):
@@ -71,6 +72,7 @@ class LandmarkHead(nn.Module):
             num_anchors(int) - Number of anchor boxes
         '''
         super(LandmarkHead,self).__init__()
+        self.num_anchors = num_anchors
         self.conv1x1 = nn.Conv2d(inchannels,num_anchors*10,kernel_size=(1,1),stride=1,padding=0)
 
     def forward(self,x:torch.Tensor):
@@ -86,17 +88,76 @@ class LandmarkHead(nn.Module):
 
         return out.view(out.shape[0], -1, 10)
 
+class PPEHead(nn.Module):
+    def __init__(self,inchannels=512,num_anchors=3,num_classes=3):
+        '''
+        Adds layers on top of feature extractor for classifying the protective equipment
+        (e.g. goggles, glasses or neither) of the face matched to each anchor
+
+        Args:
+            inchannels(int) - Number of input channels
+            num_anchors(int) - Number of anchor boxes
+            num_classes(int) - Number of PPE classes
+        '''
+        super(PPEHead,self).__init__()
+        self.num_anchors = num_anchors
+        self.num_classes = num_classes
+        self.conv1x1 = nn.Conv2d(inchannels,num_anchors*num_classes,kernel_size=(1,1),stride=1,padding=0)
+
+    def forward(self,x:torch.Tensor):
+        """Applies network layers and ops on input tensor x.
+
+        Args:
+            x: tensor outputed by the feature extractor
+
+        Returns reshaped output tensor after passing through a 1x1 conv layer
+        """
+        out = self.conv1x1(x)
+        out = out.permute(0,2,3,1).contiguous()
+
+        return out.view(out.shape[0], -1, self.num_classes)
+
+def prune_head(head:nn.Module, anchors:list):
+    '''
+    Keep only the outputs of the given anchors in a ClassHead, BboxHead, LandmarkHead or PPEHead.
+    The 1x1 convolution is replaced by a smaller one, so the removed anchors are not computed.
+
+    Args:
+        head - head to prune
+        anchors(list) - indices of the anchors to keep
+    '''
+    conv = head.conv1x1
+    values_per_anchor = conv.out_channels // head.num_anchors
+    channels = torch.tensor([anchor * values_per_anchor + value
+                             for anchor in anchors for value in range(values_per_anchor)],
+                            device=conv.weight.device)
+
+    pruned = nn.Conv2d(conv.in_channels, len(channels), kernel_size=(1,1), stride=1, padding=0).to(conv.weight.device)
+    pruned.weight.data = conv.weight.data[channels].clone()
+    pruned.bias.data = conv.bias.data[channels].clone()
+
+    head.conv1x1 = pruned
+    head.num_anchors = len(anchors)
+
 class RetinaFace(nn.Module):
-    def __init__(self, cfg = None, phase = 'train'):
+    def __init__(self, cfg = None, phase = 'train', detect_only = False):
         """
         Retinaface model used for face face detection
 
         Args:
             cfg (dict):  Network related settings.
             phase (string): train or test.
+            detect_only (bool): During test phase, skip the landmark heads unless landmarks are
+                explicitly requested and only compute the face score of the classifications.
+
+        If cfg['ppe_classes'] is more than 0, a PPEHead classifying the protective equipment of each
+        face is added on the SSH features and its output is appended to the outputs of forward.
         """
         super(RetinaFace,self).__init__()
         self.phase = phase
+        self.detect_only = detect_only
+        self.min_sizes = [list(sizes) for sizes in cfg['min_sizes']]
+        self.active_levels = [0, 1, 2]
         backbone = None
 
         if cfg['name'] == 'mobilenet0.25':
@@ -133,6 +194,9 @@ class RetinaFace(nn.Module):
         self.ClassHead = self._make_class_head(fpn_num=3, inchannels=cfg['out_channel'])
         self.BboxHead = self._make_bbox_head(fpn_num=3, inchannels=cfg['out_channel'])
         self.LandmarkHead = self._make_landmark_head(fpn_num=3, inchannels=cfg['out_channel'])
+        self.ppe_classes = cfg.get('ppe_classes', 0)
+        if self.ppe_classes > 0:
+            self.PPEHead = self._make_ppe_head(fpn_num=3, inchannels=cfg['out_channel'], num_classes=self.ppe_classes)
 
     def _make_class_head(self,fpn_num=3,inchannels=64,anchor_num=2):
         '''
@@ -179,42 +243,125 @@ class RetinaFace(nn.Module):
             landmarkhead.append(LandmarkHead(inchannels,anchor_num))
         return landmarkhead
 
-    def forward(self,inputs:torch.Tensor):
+    def _make_ppe_head(self,fpn_num=3,inchannels=64,anchor_num=2,num_classes=3):
+        '''
+        Add layer on top of retinaface for classifying the protective equipment of faces
+
+        Args:
+            fpn_num(int) - Number of feature pyramid network layers
+            inchannels(int) - Number of input channels
+            anchor_num(int) - Number of anchors
+            num_classes(int) - Number of PPE classes
+
+        '''
+        ppehead = nn.ModuleList()
+        for i in range(fpn_num):
+            ppehead.append(PPEHead(inchannels,anchor_num,num_classes))
+        return ppehead
+
+    def prune_anchors(self, min_sizes:list):
+        '''
+        Remove the anchors that are not listed in min_sizes. Pyramid levels without anchors
+        left are skipped entirely, along with the FPN branches that only feed them.
+        Call this after loading the weights, and build the priors from the same min_sizes
+        (see PriorBox face_size_range).
+
+        Args:
+            min_sizes(list) - anchor sizes to keep for each pyramid level (a subset of cfg['min_sizes'])
+        '''
+        active_levels = []
+        for level, (sizes, kept_sizes) in enumerate(zip(self.min_sizes, min_sizes)):
+            anchors = [sizes.index(size) for size in kept_sizes]
+            if len(anchors) == 0:
+                continue
+
+            active_levels.append(level)
+            if len(anchors) < len(sizes):
+                heads = [self.ClassHead[level], self.BboxHead[level], self.LandmarkHead[level]]
+                if self.ppe_classes > 0:
+                    heads.append(self.PPEHead[level])
+                for head in heads:
+                    prune_head(head, anchors)
+
+        if len(active_levels) == 0:
+            raise ValueError('No anchors left after pruning, check the face size range')
+
+        self.min_sizes = [list(sizes) for sizes in min_sizes]
+        self.active_levels = active_levels
+
+    def forward(self,inputs:torch.Tensor, landmarks:bool = None):
         """Applies network layers and ops on input image(s)
 
         Args:
             inputs: input image or batch of images.
+            landmarks: Whether to evaluate the landmark heads. Defaults to False for a detect_only
+                model in test phase and True otherwise.
 
         Return:
             output (tuple):
                 bbox_regressions - bounding box coordinates
-                classifications - class confidences (F.softmax done during test phase to output probability of each class)
-                ldm_regressions - face landmark coordinates
+                classifications - class confidences (F.softmax done during test phase to output probability of each class).
+                    For a detect_only model in test phase this is only the face probability, Shape: [batch,num_priors]
+                ldm_regressions - face landmark coordinates (None if landmarks were not evaluated)
+                ppe_classifications - only if the model has a PPEHead, PPE class scores of each prior
+                    (F.softmax done during test phase). Shape: [batch,num_priors,ppe_classes]
 
         """
+        detect_only = self.detect_only and self.phase != 'train'
+        if landmarks is None:
+            landmarks = not detect_only
+
         out = self.body(inputs)
 
         # FPN
-        fpn = self.fpn(out)
+        fpn = self.fpn(out, self.active_levels)
 
-        # SSH
-        feature1 = self.ssh1(fpn[0])
-        feature2 = self.ssh2(fpn[1])
-        feature3 = self.ssh3(fpn[2])
-        features = [feature1, feature2, feature3]
+        # SSH (only for the pyramid levels that still have anchors)
+        ssh = [self.ssh1, self.ssh2, self.ssh3]
+        features = [(i, ssh[i](fpn[i])) for i in self.active_levels]
 
-        bbox_regressions = torch.cat([self.BboxHead[i](feature) for i, feature in enumerate(features)], dim=1)
-        classifications = torch.cat([self.ClassHead[i](feature) for i, feature in enumerate(features)],dim=1)
-        ldm_regressions = torch.cat([self.LandmarkHead[i](feature) for i, feature in enumerate(features)], dim=1)
+        bbox_regressions = torch.cat([self.BboxHead[i](feature) for i, feature in features], dim=1)
+        classifications = torch.cat([self.ClassHead[i](feature) for i, feature in features],dim=1)
+        ldm_regressions = None
+        if landmarks:
+            ldm_regressions = torch.cat([self.LandmarkHead[i](feature) for i, feature in features], dim=1)
 
         if self.phase == 'train':
             output = (bbox_regressions, classifications, ldm_regressions)
+        elif detect_only:
+            # softmax over (background, face) reduces to a sigmoid of the logit difference
+            face_scores = torch.sigmoid(classifications[..., 1] - classifications[..., 0])
+            output = (bbox_regressions, face_scores, ldm_regressions)
         else:
             output = (bbox_regressions, F.softmax(classifications, dim=-1), ldm_regressions)
 
+        if self.ppe_classes > 0:
+            ppe_classifications = torch.cat([self.PPEHead[i](feature) for i, feature in features], dim=1)
+            if self.phase != 'train':
+                ppe_classifications = F.softmax(ppe_classifications, dim=-1)
+            output = output + (ppe_classifications,)
+
         return output
 
 
+def get_ppe_classes(pretrained_path:str):
+    '''
+    Number of PPE classes of a saved retinaface model, 0 if it has no PPEHead
+    Args:
+        pretrained_path: Contains location of pretrained model weights
+
+    Returns the number of PPE classes, to be set as cfg['ppe_classes'] before building the model
+    '''
+    pretrained_dict = torch.load(pretrained_path, map_location=lambda storage, loc: storage)
+    for name, weight in pretrained_dict.items():
+        if name.startswith('module.'):
+            name = name[7:]
+        if name == 'PPEHead.0.conv1x1.weight':
+            return weight.shape[0] // 2  # 2 anchors per location
+
+    return 0
+
+
 def load_model(model:'RetinaFace Object', pretrained_path:str, load_to_cpu:bool):
     '''
     Load retinaface model
@@ -1,18 +1,94 @@
 import torch
-from torch.autograd import Function
-from models.utils.box_utils import decode
-from models.utils.box_utils import nms_torch as nms
-from models.SSD.data import voc as cfg
+import torch.nn as nn
+from torchvision.ops import batched_nms
+from src.jetson.models.utils.box_utils import decode
+from src.jetson.models.SSD.data import voc as cfg
 from typing import List, Set, Dict, Tuple, Optional
 
 
-class Detect(Function):
+def detect_batch(loc_data:torch.Tensor,
+                 conf_data:torch.Tensor,
+                 prior_data:torch.Tensor,
+                 variance:List[float],
+                 conf_thresh:float,
+                 nms_thresh:float,
+                 top_k:int):
+    """Decode, threshold and apply per class non-maximum suppression to the
+    predictions of a whole batch at once, without looping over images or classes.
+    Class 0 is the background.
+
+    Args:
+        loc_data: (tensor) Loc preds from loc layers
+            Shape: [batch,num_priors,4]
+        conf_data: (tensor) Class probabilities
+            Shape: [batch,num_priors,num_classes]
+        prior_data: (tensor) Prior boxes in center-offset form
+            Shape: [num_priors,4]
+        variance: (list[float]) Variances of priorboxes
+        conf_thresh: (float) Minimum class probability of a detection
+        nms_thresh: (float) The overlap thresh for suppressing unnecessary boxes
+        top_k: (int) The maximum number of detections per image and class.
+            Like nms_torch, only the top_k highest scoring boxes enter the NMS.
+
+    Return:
+        image_idx, class_idx, rank, scores, boxes: (tensors) The kept detections sorted by
+            image, class and descending score. rank is the position of a detection within
+            its image and class, boxes are in point form, Shape: [num_detections,4]
+    """
+    num, num_priors, num_classes = conf_data.shape
+
+    # Decode predictions into bboxes.
+    decoded_boxes = decode(loc_data.reshape(-1, 4), prior_data.repeat(num, 1), variance).view(num, num_priors, 4)
+
+    # Candidate (image, prior, class) triplets above the confidence threshold
+    image_idx, prior_idx, class_idx = (conf_data[:, :, 1:] > conf_thresh).nonzero(as_tuple=True)
+    class_idx = class_idx + 1
+    scores = conf_data[image_idx, prior_idx, class_idx]
+    boxes = decoded_boxes[image_idx, prior_idx]
+    groups = image_idx * num_classes + class_idx
+
+    # keep the top_k highest scoring candidates of every image and class
+    order, rank = _group_rank(groups, scores)
+    order = order[rank < top_k]
+
+    # idx of highest scoring and non-overlapping boxes per image and class
+    keep = order[batched_nms(boxes[order], scores[order], groups[order], nms_thresh)]
+    order, rank = _group_rank(groups[keep], scores[keep])
+    keep = keep[order]
+
+    return image_idx[keep], class_idx[keep], rank, scores[keep], boxes[keep]
+
+
+def _group_rank(groups:torch.Tensor, scores:torch.Tensor):
+    """Sort detections by group and descending score.
+
+    Return:
+        order: (tensor) Indices sorting the detections
+        rank: (tensor) Position of each sorted detection within its group
+    """
+    if groups.numel() == 0:
+        return groups.clone(), groups.clone()
+
+    _, order = scores.sort(descending=True)
+    # sort by group, keeping the score order within a group (the keys are unique, so the sort is stable)
+    keys = groups[order] * order.numel() + torch.arange(order.numel(), device=order.device)
+    order = order[keys.argsort()]
+
+    _, counts = torch.unique_consecutive(groups[order], return_counts=True)
+    starts = torch.cumsum(counts, 0) - counts
+    rank = torch.arange(order.numel(), device=order.device) - torch.repeat_interleave(starts, counts)
+    return order, rank
+
+
+class Detect(nn.Module):
     """At test time, Detect is the final layer of SSD.  Decode location preds,
     apply non-maximum suppression to location predictions based on conf
     scores and threshold to a top_k number of output predictions for both
-    confidence score and locations.
+    confidence score and locations. The whole batch is processed at once
+    (see detect_batch).
     """
     def __init__(self, num_classes:int, bkg_label:int, top_k:int, conf_thresh:float, nms_thresh:float):
+        super(Detect, self).__init__()
         self.num_classes = num_classes
         self.background_label = bkg_label
         self.top_k = top_k
@@ -33,33 +109,19 @@ class Detect(Function):
                 Shape: [batch*num_priors,num_classes]
             prior_data: (tensor) Prior boxes and variances from priorbox layers
                 Shape: [1,num_priors,4]
+
+        Return:
+            (tensor) Detections for each image and class sorted by descending score,
+                padded with zeros. Each detection is (score, xmin, ymin, xmax, ymax)
+                Shape: [batch,num_classes,top_k,5]
         """
         num = loc_data.size(0)  # batch size
         num_priors = prior_data.size(0)
-        output = torch.zeros(num, self.num_classes, self.top_k, 5)
-        conf_preds = conf_data.view(num, num_priors,
-                                    self.num_classes).transpose(2, 1)
-
-        # Decode predictions into bboxes.
-        for i in range(num):
-            decoded_boxes = decode(loc_data[i], prior_data, self.variance)
-            # For each class, perform nms
-            conf_scores = conf_preds[i].clone()
-
-            for cl in range(1, self.num_classes):
-                c_mask = conf_scores[cl].gt(self.conf_thresh)
-                scores = conf_scores[cl][c_mask]
-                if scores.size(0) == 0:
-                    continue
-                l_mask = c_mask.unsqueeze(1).expand_as(decoded_boxes)
-                boxes = decoded_boxes[l_mask].view(-1, 4)
-                # idx of highest scoring and non-overlapping boxes per class
-                ids, count = nms(boxes, scores, self.nms_thresh, self.top_k)
-                output[i, cl, :count] = \
-                    torch.cat((scores[ids[:count]].unsqueeze(1),
-                               boxes[ids[:count]]), 1)
-        flt = output.contiguous().view(num, -1, 5)
-        _, idx = flt[:, :, 0].sort(1, descending=True)
-        _, rank = idx.sort(1)
-        flt[(rank < self.top_k).unsqueeze(-1).expand_as(flt)].fill_(0)
+        output = torch.zeros(num, self.num_classes, self.top_k, 5, device=loc_data.device)
+
+        image_idx, class_idx, rank, scores, boxes = detect_batch(
+            loc_data.view(num, num_priors, 4), conf_data.view(num, num_priors, self.num_classes),
+            prior_data, self.variance, self.conf_thresh, self.nms_thresh, self.top_k)
+        output[image_idx, class_idx, rank] = torch.cat((scores.unsqueeze(1), boxes), 1)
+
         return output
@@ -152,6 +152,54 @@ def match(threshold:float,
     conf_t[idx] = conf  # [num_priors] top class label for each prior
 
 
+def match_landm(threshold:float,
+                truths:torch.Tensor,
+                priors:torch.Tensor,
+                variances:'list[float]',
+                labels:torch.Tensor,
+                landms:torch.Tensor,
+                loc_t:torch.Tensor,
+                conf_t:torch.Tensor,
+                landm_t:torch.Tensor,
+                idx:int):
+    """Match each prior box with the ground truth box of the highest jaccard
+    overlap and encode the bounding boxes and facial landmarks (RetinaFace).
+    Args:
+        threshold: (float) The overlap threshold used when mathing boxes.
+        truths: (tensor) Ground truth boxes, Shape: [num_obj, 4].
+        priors: (tensor) Prior boxes from priorbox layers, Shape: [n_priors,4].
+        variances: (list[float]) Variances of priorboxes
+        labels: (tensor) All the face labels for the image (1, or -1 for faces without landmarks), Shape: [num_obj].
+        landms: (tensor) Ground truth landmarks, Shape [num_obj, 10].
+        loc_t: (tensor) Tensor to be filled w/ endcoded location targets.
+        conf_t: (tensor) Tensor to be filled w/ matched labels for conf preds (0 for background).
+        landm_t: (tensor) Tensor to be filled w/ endcoded landm targets.
+        idx: (int) current batch index
+    Return:
+        The index of the matched ground truth box of each prior, Shape: [num_priors]
+    """
+    overlaps = jaccard(
+        truths,
+        point_form(priors)
+    )
+    # (Bipartite Matching)
+    # [num_objects] best prior for each ground truth
+    best_prior_overlap, best_prior_idx = overlaps.max(1)
+    # [num_priors] best ground truth for each prior
+    best_truth_overlap, best_truth_idx = overlaps.max(0)
+    best_truth_overlap.index_fill_(0, best_prior_idx, 2)  # ensure best prior
+    # ensure every gt matches with its prior of max overlap
+    best_truth_idx[best_prior_idx] = torch.arange(best_prior_idx.size(0), device=best_truth_idx.device)
+
+    conf = labels[best_truth_idx]             # Shape: [num_priors]
+    conf[best_truth_overlap < threshold] = 0  # label as background
+    loc_t[idx] = encode(truths[best_truth_idx], priors, variances)
+    conf_t[idx] = conf
+    landm_t[idx] = encode_landm(landms[best_truth_idx], priors, variances)
+
+    return best_truth_idx
+
+
 def encode(matched:torch.Tensor, priors:torch.Tensor, variances:'list[float]'):
     """Encode the variances from the priorbox layers into the ground truth boxes
     we have matched (based on jaccard overlap) with the prior boxes.
@@ -364,39 +412,49 @@ def nms_numpy(dets:List, thresh:float):
 
 
 
-def postprocess(boxes, conf, image_shape, detection_threshold, resize_factor):
+def postprocess(boxes, conf, image_shape, detection_threshold, resize_factor, extra=None):
     """
     Performs all the postprocessing such as scaling box coordinates
     to match the size of input image, and discarding all boxes and confidence
     scores below a detection threshold
     Args:
         boxes- Box coordinates
-        conf - confidence scores
+        conf - confidence scores, either (background, face) probabilities or face probabilities only
+        extra - Optional per prior values (e.g. PPE class probabilities), Shape: [1, num_priors, k]
 
-    Returns boxes and confidence scores that are above confidence threshold
+    Returns boxes and confidence scores that are above confidence threshold (and the extra values of those boxes if given)
     """
     scale = torch.Tensor([image_shape[1], image_shape[0], image_shape[1], image_shape[0]])
     scale = scale.to(boxes.device)
     boxes = (boxes * scale / resize_factor).to('cpu').numpy()
-    scores = conf.squeeze(0).data.cpu().numpy()[:, 1]
+    scores = conf.squeeze(0).data.cpu().numpy()
+    if scores.ndim == 2:
+        scores = scores[:, 1]
 
     # ignore low scores
     inds = np.where(scores > detection_threshold)[0]
     boxes = boxes[inds]
     scores = scores[inds]
 
+    if extra is not None:
+        extra = extra.reshape(-1, extra.shape[-1])[torch.from_numpy(inds).to(extra.device)].data.cpu().numpy()
+        return boxes, scores, extra
+
     return boxes, scores
 
 
-def do_nms(boxes, scores, nms_threshold):
+def do_nms(boxes, scores, nms_threshold, extra=None):
     """
     Performs non-max suppression to remove boxes that have high intersection
     Args:
         boxes - face coordinates
+        extra - Optional values of each box, Shape: [num_boxes, k]. They are appended to the
+            detections after the score, so they follow the kept boxes
 
     Returns detections that are above a certain IOU threshold
     """
-    dets = np.hstack((boxes, scores[:, np.newaxis])).astype(np.float32, copy=False)
+    columns = (boxes, scores[:, np.newaxis]) if extra is None else (boxes, scores[:, np.newaxis], extra)
+    dets = np.hstack(columns).astype(np.float32, copy=False)
     keep = nms_numpy(dets, nms_threshold)
     dets = dets[keep, :]
 
@@ -0,0 +1,507 @@
+import os
+import struct
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+# Formats encrypted frames can be written in. JPEG is lossy and alters the encrypted pixels, so its faces cannot be
+# decrypted exactly. PNG and EFR are lossless. ROI records are EFR containers holding only the encrypted faces, the
+# rest of the frame comes from a background keyframe written every few frames.
+IMAGE_FORMATS = ['jpg', 'png', 'efr', 'roi']
+# PNG compression level: 1 is the fastest, the encrypted pixels barely compress anyway
+PNG_COMPRESSION = 1
+# JPEG quality of the background of EFR frames
+EFR_QUALITY = 90
+
+# EFR (encrypted frame) container: header, the (x1, y1, x2, y2) of each face, the file name of the keyframe holding the
+# background (empty if the container holds it), the JPEG encoded background (the frame with the faces blanked) and the
+# raw encrypted bytes of each face
+EFR_MAGIC = b'EFR'
+EFR_VERSION = 1
+EFR_HEADER = '>3sBHHBIHH'
+EFR_REGION = '>4H'
+
+
+def encode_frame(img: np.ndarray,
+                 coordinates: List[Tuple[int]],
+                 image_format: str,
+                 keyframe: str = None):
+    """
+    Encodes an encrypted frame
+    Args:
+        img: A 3D numpy array containing the encrypted frame, not modified
+        coordinates: encrypted face coordinates, clipped to the frame (only used by the EFR and ROI formats)
+        image_format: one of IMAGE_FORMATS
+        keyframe: file name of the background keyframe of a ROI record (see encode_keyframe)
+
+    Return:
+        data - the encoded frame
+    """
+    if image_format == 'jpg':
+        return cv2.imencode('.jpg', img)[1].tobytes()
+    if image_format == 'png':
+        return cv2.imencode('.png', img, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION])[1].tobytes()
+    if image_format == 'efr':
+        return encode_efr(img, coordinates)
+    if image_format == 'roi':
+        if not keyframe:
+            raise ValueError('ROI records need the file name of their background keyframe')
+        return encode_efr(img, coordinates, keyframe=keyframe)
+    raise ValueError('Unknown image format {}, expected one of {}'.format(image_format, IMAGE_FORMATS))
+
+
+def encode_keyframe(img: np.ndarray,
+                    coordinates: List[Tuple[int]]):
+    """
+    Encodes the background keyframe of ROI records: an EFR container of the frame with its faces blanked and not stored
+    Args:
+        img: A 3D numpy array containing the frame, not modified
+        coordinates: face coordinates, clipped to the frame
+
+    Return:
+        data - the encoded keyframe
+    """
+    return encode_efr(img, coordinates, store_regions=False)
+
+
+def encode_efr(img: np.ndarray,
+               coordinates: List[Tuple[int]],
+               keyframe: str = '',
+               store_regions: bool = True):
+    """
+    Encodes an EFR container
+    Args:
+        img: A 3D numpy array containing the frame, not modified. The faces are blanked in a copy of it for the
+            background
+        coordinates: face coordinates, clipped to the frame
+        keyframe: file name of the keyframe holding the background, empty to store the background
+        store_regions: store the bytes of the faces
+
+    Return:
+        data - the encoded container
+    """
+    coordinates = [(x1, y1, x2, y2) for x1, y1, x2, y2 in coordinates if x2 > x1 and y2 > y1]
+    regions = [img[y1:y2, x1:x2].tobytes() for x1, y1, x2, y2 in coordinates] if store_regions else []
+
+    background = b''
+    if not keyframe:
+        if coordinates:
+            img = img.copy()
+        for x1, y1, x2, y2 in coordinates:
+            # flat regions cost the JPEG encoder nothing, the encrypted pixels are stored raw
+            img[y1:y2, x1:x2] = 0
+        background = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, EFR_QUALITY])[1].tobytes()
+
+    stored = coordinates if store_regions else []
+    keyframe = keyframe.encode()
+    header = struct.pack(EFR_HEADER, EFR_MAGIC, EFR_VERSION, img.shape[0], img.shape[1], img.shape[2],
+                         len(background), len(stored), len(keyframe))
+    return b''.join([header] + [struct.pack(EFR_REGION, *c) for c in stored] + [keyframe, background] + regions)
+
+
+def parse_efr(data: bytes):
+    """
+    Parses the header of an EFR container
+    Args:
+        data: the encoded container
+
+    Return:
+        shape - (height, width, channels) of the frame
+        coordinates - face coordinates
+        keyframe - file name of the keyframe holding the background, empty if the container holds it
+        background - offset and size of the JPEG encoded background
+        offset - offset of the bytes of the faces
+    """
+    version = data[len(EFR_MAGIC)]
+    if version > EFR_VERSION:
+        raise ValueError('Unsupported EFR version {}'.format(version))
+    _, _, height, width, channels, background_size, count, keyframe_size = struct.unpack_from(EFR_HEADER, data)
+    offset = struct.calcsize(EFR_HEADER)
+
+    coordinates = []
+    for _ in range(count):
+        coordinates.append(struct.unpack_from(EFR_REGION, data, offset))
+        offset += struct.calcsize(EFR_REGION)
+    keyframe = bytes(data[offset:offset + keyframe_size]).decode()
+    offset += keyframe_size
+
+    return (height, width, channels), coordinates, keyframe, (offset, background_size), offset + background_size
+
+
+def decode_frame(data: bytes,
+                 background: np.ndarray = None):
+    """
+    Decodes a frame encoded by encode_frame, in any of the IMAGE_FORMATS
+    Args:
+        data: the encoded frame
+        background: the decoded keyframe of a ROI record (see keyframe_name)
+
+    Return:
+        img - A 3D numpy array containing the encrypted frame
+    """
+    if data[:len(EFR_MAGIC)] != EFR_MAGIC:
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    shape, coordinates, keyframe, (background_offset, background_size), offset = parse_efr(data)
+    if keyframe:
+        if background is None:
+            raise ValueError('The ROI record needs its background keyframe {}'.format(keyframe))
+        img = background.copy()
+    else:
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8, count=background_size, offset=background_offset),
+                           cv2.IMREAD_COLOR)
+
+    channels = shape[2]
+    for x1, y1, x2, y2 in coordinates:
+        size = (y2 - y1) * (x2 - x1) * channels
+        img[y1:y2, x1:x2] = np.frombuffer(data, dtype=np.uint8, count=size, offset=offset).reshape(
+            y2 - y1, x2 - x1, channels)
+        offset += size
+
+    return img
+
+
+def keyframe_name(data: bytes):
+    """
+    Returns the file name of the background keyframe of a ROI record
+    Args:
+        data: the encoded frame
+
+    Return:
+        keyframe - file name of the keyframe, None if the frame holds its background
+    """
+    if data[:len(EFR_MAGIC)] != EFR_MAGIC:
+        return None
+    return parse_efr(data)[2] or None
+
+
+def write_frame(path: str,
+                img: np.ndarray,
+                coordinates: List[Tuple[int]] = (),
+                keyframe: str = None):
+    """
+    Writes an encrypted frame in the format of the extension of the path
+    Args:
+        path: file path ending in one of the IMAGE_FORMATS
+        img: A 3D numpy array containing the encrypted frame, not modified
+        coordinates: encrypted face coordinates, clipped to the frame
+        keyframe: file name of the background keyframe of a ROI record, in the same directory
+
+    Return:
+        size - bytes written
+    """
+    data = encode_frame(img, coordinates, path.rsplit('.', 1)[-1].lower(), keyframe)
+    with open(path, 'wb') as file:
+        file.write(data)
+
+    return len(data)
+
+
+def write_keyframe(path: str,
+                   img: np.ndarray,
+                   coordinates: List[Tuple[int]]):
+    """
+    Writes the background keyframe of ROI records
+    Args:
+        path: file path, ending in .efr
+        img: A 3D numpy array containing the frame, not modified
+        coordinates: face coordinates, clipped to the frame
+
+    Return:
+        size - bytes written
+    """
+    data = encode_keyframe(img, coordinates)
+    with open(path, 'wb') as file:
+        file.write(data)
+
+    return len(data)
+
+
+def read_frame(path: str):
+    """
+    Reads a frame written by write_frame, or any image OpenCV reads. The background of ROI records is read from their
+    keyframe in the same directory.
+    Args:
+        path: file path
+
+    Return:
+        img - A 3D numpy array containing the encrypted frame, None if the file or its keyframe does not exist
+    """
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+    except FileNotFoundError:
+        return None
+
+    keyframe = keyframe_name(data)
+    background = None
+    if keyframe is not None:
+        background = read_frame(os.path.join(os.path.dirname(path), keyframe))
+        if background is None:
+            return None
+
+    return decode_frame(data, background)
+
+
+# Segment files hold encoded frames back to back. The index file next to each segment holds the offset and size of
+# every frame, so a single frame is read with one seek. ROI records in a segment refer to their keyframe by its frame
+# index in the same segment, as '#<index>'.
+SEGMENT_EXTENSION = '.efs'
+SEGMENT_INDEX = '>QI'
+
+
+class SegmentRecorder:
+    def __init__(self, output_dir: str,
+                 segment_minutes: float = 10):
+        """
+        Appends encoded frames to rolling segment files instead of writing a file per frame
+        Args:
+            output_dir: directory the segments are written to
+            segment_minutes: minutes of recording per segment before a new one is started
+        """
+        self.output_dir = output_dir
+        self.segment_seconds = segment_minutes * 60
+        self.segment_name = None
+        self.segment_start = 0
+        self.next_index = 0
+        self.segment = None
+        self.index = None
+
+    def rotate(self, now: float):
+        """
+        Starts a new segment if there is none yet or the current one is older than segment_minutes
+        Args:
+            now: current time in seconds since the epoch
+
+        Return:
+            True if a new segment was started
+        """
+        if self.segment is not None and now - self.segment_start < self.segment_seconds:
+            return False
+
+        self.close()
+        os.makedirs(self.output_dir, exist_ok=True)
+        timestamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(now))
+        self.segment_name = 'segment_{}_{}{}'.format(timestamp, uuid.uuid4().hex[:8], SEGMENT_EXTENSION)
+        path = os.path.join(self.output_dir, self.segment_name)
+        self.segment = open(path, 'ab')
+        self.index = open(path + '.idx', 'ab')
+        self.segment_start = now
+        self.next_index = 0
+        return True
+
+    def append(self, data: bytes):
+        """
+        Appends an encoded frame to the current segment
+        Args:
+            data: the encoded frame (see encode_frame and encode_keyframe)
+
+        Return:
+            index - frame index of the frame in the segment
+        """
+        if self.segment is None:
+            self.rotate(time.time())
+
+        offset = self.segment.tell()
+        self.segment.write(data)
+        self.segment.flush()
+        self.index.write(struct.pack(SEGMENT_INDEX, offset, len(data)))
+        self.index.flush()
+
+        self.next_index += 1
+        return self.next_index - 1
+
+    def close(self):
+        """
+        Closes the current segment
+        """
+        if self.segment is not None:
+            self.segment.close()
+            self.index.close()
+        self.segment = None
+        self.index = None
+
+
+def read_segment_record(path: str,
+                        index: int):
+    """
+    Reads an encoded frame from a segment using its index file
+    Args:
+        path: path of the segment
+        index: frame index of the frame in the segment
+
+    Return:
+        data - the encoded frame, None if the segment does not hold the frame
+    """
+    entry_size = struct.calcsize(SEGMENT_INDEX)
+    try:
+        with open(path + '.idx', 'rb') as index_file:
+            index_file.seek(index * entry_size)
+            entry = index_file.read(entry_size)
+        if index < 0 or len(entry) < entry_size:
+            return None
+
+        offset, size = struct.unpack(SEGMENT_INDEX, entry)
+        with open(path, 'rb') as segment:
+            segment.seek(offset)
+            return segment.read(size)
+    except FileNotFoundError:
+        return None
+
+
+def read_segment_frame(path: str,
+                       index: int):
+    """
+    Reads a frame from a segment. The background of ROI records is read from their keyframe in the same segment.
+    Args:
+        path: path of the segment
+        index: frame index of the frame in the segment
+
+    Return:
+        img - A 3D numpy array containing the encrypted frame, None if the segment does not hold the frame
+    """
+    data = read_segment_record(path, index)
+    if data is None:
+        return None
+
+    keyframe = keyframe_name(data)
+    background = None
+    if keyframe is not None:
+        background = read_segment_frame(path, int(keyframe.lstrip('#')))
+        if background is None:
+            return None
+
+    return decode_frame(data, background)
+
+
+# Output subdirectory of the frames written in an hour, as a time.strftime format
+SHARD_FORMAT = os.path.join('%Y-%m-%d', '%H')
+
+
+class ImageWriter:
+    def __init__(self, output_dir: str,
+                 workers: int = 2,
+                 queue_size: int = 32,
+                 fsync_batch: int = 16):
+        """
+        Writes encoded frames to date/hour subdirectories of the output directory on a background thread pool. A
+        failed write is raised by the next write or close, failures counts all of them
+        Args:
+            output_dir: directory the frames are written to
+            workers: number of writing threads
+            queue_size: number of frames waiting to be written before write blocks
+            fsync_batch: number of written frames synced to disk together, 0 to leave syncing to the OS
+        """
+        self.output_dir = output_dir
+        self.fsync_batch = fsync_batch
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.directories = set()
+        self.unsynced = []
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.error = None # first failed write not raised yet
+
+    def shard(self, now: float):
+        """
+        Returns the subdirectory of the frames written at a time, relative to the output directory
+        Args:
+            now: time in seconds since the epoch
+        """
+        return time.strftime(SHARD_FORMAT, time.localtime(now))
+
+    def write(self, data: bytes,
+              name: str,
+              now: float = None):
+        """
+        Queues an encoded frame to be written, waiting while the queue is full
+        Args:
+            data: the encoded frame (see encode_frame)
+            name: file name of the frame
+            now: time the frame was taken in seconds since the epoch, defaults to the current time
+
+        Return:
+            path - path of the frame relative to the output directory
+        """
+        self.raiseError()
+        relative_path = os.path.join(self.shard(time.time() if now is None else now), name)
+        directory = os.path.dirname(relative_path)
+        if directory not in self.directories:
+            # directories are only created once, not checked for every frame
+            os.makedirs(os.path.join(self.output_dir, directory), exist_ok=True)
+            self.directories.add(directory)
+
+        self.slots.acquire()
+        try:
+            self.executor.submit(self.writeFile, os.path.join(self.output_dir, relative_path), data)
+        except Exception:
+            self.slots.release()
+            raise
+        return relative_path
+
+    def writeFile(self, path: str,
+                  data: bytes):
+        """
+        Writes a frame on a writing thread and syncs it with the frames before it once fsync_batch are written
+        Args:
+            path: file path
+            data: the encoded frame
+        """
+        try:
+            with open(path, 'wb') as file:
+                file.write(data)
+
+            batch = []
+            with self.lock:
+                if self.fsync_batch > 0:
+                    self.unsynced.append(path)
+                    if len(self.unsynced) >= self.fsync_batch:
+                        batch, self.unsynced = self.unsynced, []
+            sync_files(batch)
+        except Exception as e:
+            with self.lock:
+                self.failures += 1
+                if self.error is None:
+                    self.error = e
+        finally:
+            self.slots.release()
+
+    def close(self):
+        """
+        Waits for the queued frames to be written and syncs them to disk
+        """
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            batch, self.unsynced = self.unsynced, []
+        sync_files(batch)
+        self.raiseError()
+
+    def raiseError(self):
+        """
+        Raises the first write that failed since the last call, so frames already recorded in the database are not
+        missing silently
+        """
+        with self.lock:
+            error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+
+def sync_files(paths: List[str]):
+    """
+    Flushes written files and their directory entries to disk
+    Args:
+        paths: file paths
+    """
+    for path in paths + sorted({os.path.dirname(path) for path in paths}):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
@@ -32,26 +32,38 @@ def gstreamer_pipeline(
 
 
 class VideoCapturer(object):
-    def __init__(self, gstreamer, dev=0):
+    def __init__(self, gstreamer, dev=0, display_size=None):
         """
         This class captures videos using open-cv's VideoCapture object
         Args:
             dev: ID of mounted video device to be used for video capture (default is 0)
             gstreamer: Bool that states whether or not gstreamer pipeline should be crated (for pi camera)
+            display_size: (width, height) of the frames output by the gstreamer pipeline. Defaults to 820x616,
+                use a larger size (up to the 3280x2464 capture size) for tiled detection
         """
-        if gstreamer:
-            self.capture = cv2.VideoCapture(gstreamer_pipeline(), cv2.CAP_GSTREAMER)
-        else:
-            self.capture = cv2.VideoCapture(dev)
-
-        _, self.frame = self.capture.read()
         self.gstreamer = gstreamer
         self.dev = dev
+        self.display_size = display_size
+        self.capture = self._open()
+
+        _, self.frame = self.capture.read()
         self.running = True
         self.t1 = Thread(target=self.update, args=())
         self.t1.daemon = True
         self.t1.start()
 
+    def _open(self):
+        """Opens the camera"""
+        if not self.gstreamer:
+            return cv2.VideoCapture(self.dev)
+
+        if self.display_size is None:
+            return cv2.VideoCapture(gstreamer_pipeline(), cv2.CAP_GSTREAMER)
+
+        display_width, display_height = self.display_size
+        return cv2.VideoCapture(gstreamer_pipeline(display_width=display_width, display_height=display_height),
+                                cv2.CAP_GSTREAMER)
+
     def update(self):
         """Get next frame in video stream"""
         while self.running:
@@ -66,10 +78,7 @@ class VideoCapturer(object):
         """Attempts to reestablish connection to camera"""
         ret = False 
         while not ret:
-            if self.gstreamer:
-                self.capture = cv2.VideoCapture(gstreamer_pipeline(), cv2.CAP_GSTREAMER)
-            else:
-                self.capture = cv2.VideoCapture(self.dev)
+            self.capture = self._open()
             print("Failed to connect to camera. Trying again in 5s...")
             time.sleep(5)
             ret, self.frame = self.capture.read()        
@@ -0,0 +1,60 @@
+import os
+
+import torch
+
+from src.jetson.models.BlazeFace.blazeface import BlazeFace
+
+ANCHORS = os.path.join(os.path.dirname(__file__), '..', 'src', 'jetson', 'models', 'BlazeFace', 'anchors.npy')
+
+
+class TestBlazeFace():
+    '''
+    Tests in this class are for the vectorized postprocessing of the BlazeFace model found in
+    src/jetson/models/BlazeFace/blazeface.py. Results are compared with the per image implementation.
+    '''
+    def setup_method(self):
+        torch.manual_seed(0)
+        self.net = BlazeFace(False)
+        self.net.load_anchors(ANCHORS)
+
+        batch_size = 3
+        self.raw_boxes = torch.randn(batch_size, 896, 16) * 10
+        self.raw_boxes[..., 2:4] = torch.rand(batch_size, 896, 2) * 30 + 10
+        self.raw_scores = torch.rand(batch_size, 896, 1) * 6 - 3
+        self.raw_scores[1] -= 10  # image without any face
+
+    def test_decode_boxes(self):
+        '''
+        Tests '_decode_boxes' function
+        Checks:
+            - Keypoints decoded at once are identical to decoding them one at a time
+        '''
+        anchors = self.net.anchors
+        boxes = self.net._decode_boxes(self.raw_boxes, anchors)
+        for k in range(6):
+            offset = 4 + k * 2
+            keypoint_x = self.raw_boxes[..., offset] / self.net.x_scale * anchors[:, 2] + anchors[:, 0]
+            keypoint_y = self.raw_boxes[..., offset + 1] / self.net.y_scale * anchors[:, 3] + anchors[:, 1]
+            assert torch.equal(boxes[..., offset], keypoint_x)
+            assert torch.equal(boxes[..., offset + 1], keypoint_y)
+
+    def test_weighted_non_max_suppression_batch(self):
+        '''
+        Tests '_weighted_non_max_suppression_batch' function
+        Checks:
+            - Every image has the same faces as with '_weighted_non_max_suppression'
+            - Images without detections return an empty (0, 17) tensor
+        '''
+        detections = self.net._tensors_to_detections(self.raw_boxes, self.raw_scores, self.net.anchors)
+        padded, valid = self.net._tensors_to_padded_detections(self.raw_boxes, self.raw_scores, self.net.anchors)
+        faces = self.net._weighted_non_max_suppression_batch(padded, valid)
+
+        assert len(faces) == len(detections)
+        for image_detections, image_faces in zip(detections, faces):
+            expected = self.net._weighted_non_max_suppression(image_detections)
+            expected = torch.stack(expected) if len(expected) > 0 else torch.zeros((0, 17))
+            assert image_faces.shape == expected.shape
+            assert torch.allclose(image_faces, expected, atol=1e-5)
+
+        assert len(detections[0]) > len(faces[0]) > 1
+        assert faces[1].shape == (0, 17)
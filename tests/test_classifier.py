@@ -0,0 +1,255 @@
+import cv2
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+
+from src.jetson.classifier import Classifier, crop_eyes
+
+
+class TestClassifier():
+    '''
+    Tests in this class are for the Classifier class found in src/jetson/classifier.py
+    '''
+    def setup_method(self):
+        torch.manual_seed(0)
+        np.random.seed(0)
+        model = nn.Sequential(nn.Conv2d(3, 8, 5, stride=4), nn.ReLU(), nn.AdaptiveAvgPool2d(1), nn.Flatten(),
+                              nn.Linear(8, 3))
+        model.eval()
+        self.classifier = Classifier(model, False)
+        self.img = (np.random.rand(300, 400, 3) * 255).astype(np.uint8)
+        self.boxes = [(10, 20, 80, 110, 0.9), (150.5, 40.2, 260.7, 190.1, 0.8), (-5, 250, 30, 320, 0.95)]
+
+    def test_classifyFrame(self):
+        '''
+        Tests 'classifyFrame' function
+        Checks:
+            - One label and one probability row per box, in box order
+            - Batched labels equal classifying each face separately
+            - Frames without boxes return no labels
+        '''
+        labels, probs = self.classifier.classifyFrame(self.img, self.boxes, return_probs=True)
+        assert len(labels) == len(self.boxes)
+        assert probs.shape == (len(self.boxes), 3)
+        assert np.allclose(probs.sum(axis=1), 1, atol=1e-5)
+        assert labels == list(probs.argmax(axis=1))
+
+        for box, label in zip(self.boxes, labels):
+            x1, y1, x2, y2 = [max(0, int(b)) for b in box[0:4]]
+            assert int(self.classifier.classifyFace(self.img[y1:y2, x1:x2])) == label
+
+        assert self.classifier.classifyFrame(self.img, []) == []
+
+    def test_classifyFrames(self):
+        '''
+        Tests 'classifyFrames' function
+        Checks:
+            - Labels are split per frame and equal classifying each frame separately
+        '''
+        boxes_list = [self.boxes, [], self.boxes[:1]]
+        labels = self.classifier.classifyFrames([self.img, self.img, self.img[::-1].copy()], boxes_list)
+        assert labels[0] == self.classifier.classifyFrame(self.img, self.boxes)
+        assert labels[1] == []
+        assert labels[2] == self.classifier.classifyFrame(self.img[::-1].copy(), self.boxes[:1])
+
+    def test_preprocess(self):
+        '''
+        Tests 'preprocess' function
+        Checks:
+            - Batch shape and the buffer is reused between calls
+            - Numerical parity with the valaug2 validation transforms used while training, for
+              upscaled, downscaled and unscaled faces
+        '''
+        PIL = pytest.importorskip('PIL.Image')
+        goggle_classifier = pytest.importorskip('scripts.goggle_classifier')
+        valaug2 = goggle_classifier.classifier_transforms['valaug2']
+
+        # smooth images, like real faces, so that interpolation differences stay small
+        faces = []
+        for h, w in [(90, 70), (60, 200), (224, 224), (300, 260), (500, 400)]:
+            noise = (np.random.rand(h // 8 + 2, w // 8 + 2, 3) * 255).astype(np.float32)
+            faces.append(np.clip(cv2.resize(noise, (w, h), interpolation=cv2.INTER_CUBIC), 0, 255).astype(np.uint8))
+
+        batch = self.classifier.preprocess(faces)
+        assert batch.shape == (len(faces), 3, 224, 224)
+        buffer = self.classifier.buffer
+        self.classifier.preprocess(faces[:2])
+        assert self.classifier.buffer is buffer
+
+        expected = torch.stack([valaug2(PIL.fromarray(cv2.cvtColor(face, cv2.COLOR_BGR2RGB))) for face in faces])
+        levels = grey_levels(batch - expected)
+        # unscaled faces are exact and upscaled faces differ by rounding only. Downscaled faces differ by a few
+        # levels, INTER_AREA averages whole source pixels where PIL's antialiased filter weights them. A wrong
+        # interpolation mode or a crop shifted by one pixel differs by 40 levels or more
+        assert levels[2].max() < 1e-3
+        assert levels[:2].max() <= 1.01
+        assert levels[:2].mean() < 0.3
+        assert levels[3:].max() <= 8.01
+        assert levels[3:].mean() < 1.2
+
+    def test_classifyFrameTensor(self):
+        '''
+        Tests 'classifyFrameTensor' function
+        Checks:
+            - One label and one probability row per box, in box order
+            - ROI-align crops of a mean subtracted detector tensor match preprocessing the numpy crops
+            - Boxes are scaled from frame to tensor coordinates
+            - Frames without boxes return no labels
+        '''
+        mean = np.array((104, 117, 123), dtype=np.float32)
+        noise = (np.random.rand(40, 52, 3) * 255).astype(np.float32)
+        img = np.clip(cv2.resize(noise, (400, 300), interpolation=cv2.INTER_CUBIC), 0, 255).astype(np.uint8)
+        frame_tensor = torch.from_numpy((img.astype(np.float32) - mean).transpose(2, 0, 1)).unsqueeze(0)
+        boxes = [(10, 20, 80, 110, 0.9), (150, 40, 260, 190, 0.8), (0, 250, 30, 300, 0.95)]
+
+        labels, probs = self.classifier.classifyFrameTensor(frame_tensor, boxes, img.shape, mean, return_probs=True)
+        assert len(labels) == len(boxes)
+        assert probs.shape == (len(boxes), 3)
+        assert labels == list(probs.argmax(axis=1))
+
+        batch = self.classifier.preprocessTensor(frame_tensor, boxes, img.shape, mean)
+        expected = self.classifier.preprocess([img[y1:y2, x1:x2] for x1, y1, x2, y2, _ in boxes])
+        levels = grey_levels(batch - expected)
+        # ROI-align samples past the crop edges where cv2.resize replicates them, so edge pixels differ by up to
+        # 20 levels. A box shifted by one pixel differs by more than 10 levels on average
+        assert levels.mean() < 1
+        assert levels.max() < 24
+
+        # same boxes on a tensor at half the frame resolution
+        half = torch.nn.functional.interpolate(frame_tensor, scale_factor=0.5, mode='bilinear', align_corners=False)
+        half_batch = self.classifier.preprocessTensor(half[0], boxes, img.shape, mean)
+        assert (half_batch - expected).abs().mean() < 0.05
+
+        assert self.classifier.classifyFrameTensor(frame_tensor, [], img.shape, mean) == []
+
+    def test_load_classifier(self, tmp_path):
+        '''
+        Tests 'load_classifier' function with an INT8 model from quantization-aware training
+        Checks:
+            - Pickled float models and TorchScript INT8 models both load
+            - Quantized models are detected and classified on the CPU
+        '''
+        from torchvision import models
+        from src.jetson.classifier import load_classifier, is_quantized
+        goggle_classifier = pytest.importorskip('scripts.goggle_classifier')
+
+        float_path = str(tmp_path / 'float.pth')
+        torch.save(self.classifier.classifier, float_path)
+        float_model = load_classifier(float_path, torch.device('cpu'))
+        assert not is_quantized(float_model)
+
+        mobilenet = models.mobilenet_v2()
+        mobilenet.classifier = nn.Sequential(nn.Dropout(0.2), nn.Linear(mobilenet.last_channel, 3))
+        qat_model = goggle_classifier.get_qat_model(mobilenet, 'qnnpack')
+        torch.backends.quantized.engine = 'qnnpack'
+        with torch.no_grad():
+            qat_model(torch.randn(2, 3, 224, 224))  # calibrate the fake quantization observers
+        int8_path = str(tmp_path / 'int8.pt')
+        torch.jit.save(goggle_classifier.convert_qat_model(qat_model), int8_path)
+
+        int8_model = load_classifier(int8_path, torch.device('cpu'))
+        assert is_quantized(int8_model)
+        classifier = Classifier(int8_model, True)
+        assert classifier.torch_device == torch.device('cpu')
+        labels, probs = classifier.classifyFrame(self.img, self.boxes, return_probs=True)
+        assert len(labels) == len(self.boxes)
+        assert np.allclose(probs.sum(axis=1), 1, atol=1e-5)
+
+    def test_student_model(self):
+        '''
+        Tests classifying with a distilled student model
+        Checks:
+            - Classifier resizes faces to the input size of the student
+            - The distillation loss is the cross entropy when alpha is 0 and is 0 when the student matches the teacher
+        '''
+        goggle_classifier = pytest.importorskip('scripts.goggle_classifier')
+
+        student = goggle_classifier.get_student_model(width_mult=0.25, input_size=96).eval()
+        classifier = Classifier(student, False)
+        assert classifier.input_size == 96
+        assert classifier.preprocess([self.img]).shape == (1, 3, 96, 96)
+        labels = classifier.classifyFrame(self.img, self.boxes)
+        assert len(labels) == len(self.boxes)
+        assert goggle_classifier.fit_inputs(student, torch.zeros(2, 3, 224, 224)).shape == (2, 3, 96, 96)
+
+        outputs = torch.randn(4, 3)
+        labels = torch.tensor([0, 1, 2, 1])
+        loss = goggle_classifier.distillation_loss(outputs, torch.randn(4, 3), labels, 4.0, 0.0)
+        assert torch.isclose(loss, nn.functional.cross_entropy(outputs, labels))
+        assert goggle_classifier.distillation_loss(outputs, outputs, labels, 4.0, 1.0).abs() < 1e-6
+
+    def test_prune_model(self):
+        '''
+        Tests 'prune_model' function in scripts/goggle_classifier.py
+        Checks:
+            - Hidden channels of the inverted residual blocks are physically removed
+            - The pruned model still classifies faces and the original model is unchanged
+            - Pruning only the weakest channels of a block whose other channels are zero keeps its output
+        '''
+        from torchvision import models
+        goggle_classifier = pytest.importorskip('scripts.goggle_classifier')
+
+        model = models.mobilenet_v2()
+        model.classifier = nn.Sequential(nn.Dropout(0.2), nn.Linear(model.last_channel, 3))
+        model.eval()
+        num_parameters = goggle_classifier.count_parameters(model)
+
+        pruned = goggle_classifier.prune_model(model, 0.5).eval()
+        assert goggle_classifier.count_parameters(model) == num_parameters
+        assert goggle_classifier.count_parameters(pruned) < 0.75 * num_parameters
+        assert pruned.features[1].conv[0][0].out_channels == 32  # no expansion layer, not pruned
+        assert pruned.features[2].conv[0][0].out_channels == 48
+        assert pruned.features[2].conv[1][0].groups == 48
+        assert pruned.features[2].conv[2].in_channels == 48
+        assert len(Classifier(pruned, False).classifyFrame(self.img, self.boxes)) == len(self.boxes)
+
+        # zero the expansion filters of half the channels of a block, pruning them must not change its output
+        block = model.features[2]
+        with torch.no_grad():
+            block.conv[0][0].weight[::2] = 0
+        pruned = goggle_classifier.prune_model(model, 0.5).eval()
+        inputs = torch.randn(1, 16, 56, 56)
+        with torch.no_grad():
+            assert torch.allclose(pruned.features[2](inputs), block(inputs), atol=1e-5)
+
+    def test_crop_eyes(self):
+        '''
+        Tests 'crop_eyes' function and classifying with an eye classifier
+        Checks:
+            - Tilted eyes are level and at fixed positions of the eye-band crop
+            - Eye classifiers classify the eye-band crop of each box and need the landmarks
+        '''
+        img = np.zeros((200, 300, 3), dtype=np.uint8)
+        cv2.circle(img, (100, 80), 3, (255, 0, 0), -1)
+        cv2.circle(img, (160, 110), 3, (0, 0, 255), -1)
+        landmarks = np.array([[100, 80], [160, 110], [130, 120], [110, 140], [150, 150]], dtype=np.float32)
+
+        eyes = crop_eyes(img, landmarks, (96, 48))
+        assert eyes.shape == (48, 96, 3)
+        ys, xs = np.where(eyes[..., 0] > 128)
+        assert abs(xs.mean() - 24) < 1 and abs(ys.mean() - 24) < 1
+        ys, xs = np.where(eyes[..., 2] > 128)
+        assert abs(xs.mean() - 72) < 1 and abs(ys.mean() - 24) < 1
+
+        model = self.classifier.classifier
+        model.input_size = (96, 48)
+        model.crop_mode = 'eyes'
+        classifier = Classifier(model, False)
+        assert classifier.input_shape == (48, 96)
+
+        frame_landmarks = np.stack([landmarks, landmarks + 50])
+        labels, probs = classifier.classifyFrame(self.img, self.boxes[:2], return_probs=True, landmarks=frame_landmarks)
+        expected = classifier.classifyFaces([crop_eyes(self.img, landmark) for landmark in frame_landmarks])
+        assert labels == expected[0]
+        assert np.allclose(probs, expected[1])
+        with pytest.raises(ValueError):
+            classifier.classifyFrame(self.img, self.boxes[:2])
+
+
+def grey_levels(diff: torch.Tensor):
+    '''
+    Converts a difference of normalized [N, 3, H, W] batches to 8-bit grey levels
+    '''
+    std = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+    return diff.abs() * std * 255
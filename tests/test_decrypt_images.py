@@ -0,0 +1,96 @@
+import datetime
+import os
+import random
+
+import cv2
+import numpy as np
+import pytest
+
+from src.jetson.encryptor import Encryptor, clip_boxes
+from src.jetson.storage import SegmentRecorder, encode_frame
+
+decrypt_images = pytest.importorskip('scripts.decrypt_images')
+
+
+class TestDecryptImages():
+    '''
+    Tests in this class are for the bulk decryption tool found in scripts/decrypt_images.py
+    '''
+    def setup_method(self):
+        np.random.seed(0)
+        self.img = (np.random.rand(240, 320, 3) * 255).astype(np.uint8)
+        self.encryptor = Encryptor('ctr')
+        self.boxes = [(10.5, 20.2, 60.7, 90.1), (40, 50, 140, 100), (200, 150, 330, 260)]
+
+    def test_parse_time(self):
+        '''
+        Tests 'parse_time' function
+        Checks:
+            - A date alone is the start or the end of the day, a date and time is kept
+        '''
+        assert decrypt_images.parse_time('2020-10-01') == datetime.datetime(2020, 10, 1)
+        assert decrypt_images.parse_time('2020-10-01', end=True) == datetime.datetime(2020, 10, 1, 23, 59, 59, 999999)
+        assert decrypt_images.parse_time('2020-10-01 13:30:00', end=True) == datetime.datetime(2020, 10, 1, 13, 30)
+
+    def test_check_bbox_key(self):
+        '''
+        Tests 'check_bbox_key' function
+        Checks:
+            - Columns of BBOX are accepted, other names are rejected before they reach the query
+        '''
+        columns = ['ID', 'X_Min', 'Y_Min', 'X_Max', 'Y_Max', 'Image_Name', 'Init_Vector']
+        assert decrypt_images.check_bbox_key('ID', columns) == 'ID'
+        with pytest.raises(ValueError):
+            decrypt_images.check_bbox_key('BBox_ID', columns)
+        with pytest.raises(ValueError):
+            decrypt_images.check_bbox_key('ID; DROP TABLE BBOX', columns)
+
+    def test_decrypt_image(self, tmp_path):
+        '''
+        Tests 'group_images' and 'decrypt_image' functions
+        Checks:
+            - Rows are grouped by image and the boxes put back in the order they were encrypted
+            - Decrypted images written to the output directory equal the original images
+            - Missing images are reported
+        '''
+        encrypted, init_vecs = self.encryptor.encryptFrame(self.img.copy(), self.boxes)
+        cv2.imwrite(str(tmp_path / 'frame.png'), encrypted)
+        rows = [('frame.png',) + tuple(box) + (init_vec,) for box, init_vec in zip(self.boxes, init_vecs)]
+        random.Random(0).shuffle(rows)
+        rows.append(('missing.png', 0, 0, 10, 10, init_vecs[0]))
+
+        images = list(decrypt_images.group_images(rows))
+        assert [image[0] for image in images] == ['frame.png', 'missing.png']
+        assert images[0][1] == self.boxes
+
+        output_dir = tmp_path / 'decrypted'
+        os.makedirs(output_dir)
+        decrypt_images.init_worker(self.encryptor.key)
+        assert decrypt_images.decrypt_image(images[0], str(tmp_path), str(output_dir)) == ('frame.png', self.img.nbytes)
+        assert np.array_equal(cv2.imread(str(output_dir / 'frame.png')), self.img)
+        assert decrypt_images.decrypt_image(images[1], str(tmp_path), str(output_dir)) == ('missing.png', 0)
+
+    def test_decrypt_segment(self, tmp_path):
+        '''
+        Tests 'group_images' and 'decrypt_image' functions with images recorded in segments
+        Checks:
+            - The segment and frame index of the rows are kept and the image is read from the segment
+        '''
+        recorder = SegmentRecorder(str(tmp_path))
+        recorder.rotate(0)
+        encrypted, init_vecs = self.encryptor.encryptFrame(self.img.copy(), self.boxes)
+        recorder.append(encode_frame(self.img, [], 'png'))
+        index = recorder.append(encode_frame(encrypted, clip_boxes(self.boxes, self.img.shape), 'efr'))
+        recorder.close()
+
+        rows = [('frame',) + tuple(box) + (init_vec, recorder.segment_name, index)
+                for box, init_vec in zip(self.boxes, init_vecs)]
+        image = next(decrypt_images.group_images(rows))
+        assert image[3] == (recorder.segment_name, 1)
+
+        decrypt_images.init_worker(self.encryptor.key)
+        assert decrypt_images.decrypt_image(image, str(tmp_path), str(tmp_path)) == ('frame', self.img.nbytes)
+        decrypted = cv2.imread(str(tmp_path / 'frame.png'))
+        for x1, y1, x2, y2 in clip_boxes(self.boxes, self.img.shape):
+            assert np.array_equal(decrypted[y1:y2, x1:x2], self.img[y1:y2, x1:x2])
+
@@ -0,0 +1,197 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from src.jetson.AES import MODES, new_cipher
+from src.jetson.encryptor import Encryptor, LEGACY_MODE, clip_boxes, load_key, parse_init_vec
+
+
+class TestEncryptor():
+    '''
+    Tests in this class are for the Encryptor class found in src/jetson/encryptor.py
+    '''
+    def setup_method(self):
+        np.random.seed(0)
+        self.img = (np.random.rand(240, 320, 3) * 255).astype(np.uint8)
+        self.encryptor = Encryptor('ctr')
+        self.boxes = [(10.5, 20.2, 60.7, 90.1, 0.9), (100, 50, 140, 100, 0.8), (-15, 200, 30, 260, 0.7)]
+
+    def test_clip_boxes(self):
+        '''
+        Tests 'clip_boxes' function
+        Checks:
+            - Coordinates are integers within the frame
+        '''
+        assert clip_boxes(self.boxes, self.img.shape) == [(10, 20, 60, 90), (100, 50, 140, 100), (0, 200, 30, 240)]
+
+    def test_encryptFrame(self):
+        '''
+        Tests 'encryptFrame' function
+        Checks:
+            - All faces share one initialization vector and have increasing offsets
+            - The faces are encrypted as one buffer and pixels outside the faces are unchanged
+            - decryptFrame restores the image
+        '''
+        encrypted, init_vec_list = self.encryptor.encryptFrame(self.img.copy(), self.boxes)
+        unpacked = [parse_init_vec(init_vec)[2:] for init_vec in init_vec_list]
+        init_vec = unpacked[0][0]
+        assert len(init_vec_list) == len(self.boxes)
+        assert all(iv == init_vec for iv, _ in unpacked)
+        assert [offset for _, offset in unpacked] == [0, 50 * 70 * 3, 50 * 70 * 3 + 40 * 50 * 3]
+        assert parse_init_vec(init_vec_list[0])[:2] == (1, 'ctr')
+
+        coordinates = clip_boxes(self.boxes, self.img.shape)
+        plain = np.concatenate([self.img[y1:y2, x1:x2].reshape(-1) for x1, y1, x2, y2 in coordinates])
+        cipher = new_cipher(self.encryptor.key, 'ctr', init_vec).encrypt(memoryview(plain))
+        cipher = np.frombuffer(cipher, dtype=np.uint8)
+        for (x1, y1, x2, y2), (_, offset) in zip(coordinates, unpacked):
+            size = (y2 - y1) * (x2 - x1) * 3
+            assert np.array_equal(encrypted[y1:y2, x1:x2].reshape(-1), cipher[offset:offset + size])
+
+        mask = np.ones(self.img.shape[:2], dtype=bool)
+        for x1, y1, x2, y2 in coordinates:
+            mask[y1:y2, x1:x2] = False
+        assert np.array_equal(encrypted[mask], self.img[mask])
+
+        decrypted = self.encryptor.decryptFrame(encrypted, self.boxes, init_vec_list)
+        assert np.array_equal(decrypted, self.img)
+
+    def test_encryptFrame_overlap(self):
+        '''
+        Tests 'encryptFrame' function with overlapping and empty faces
+        Checks:
+            - Overlapping pixels are encrypted once, so decryptFrame restores the image
+        '''
+        boxes = [(10, 10, 80, 80), (50, 40, 120, 110), (60, 60, 70, 70), (200, 200, 200, 230)]
+        encrypted, init_vec_list = self.encryptor.encryptFrame(self.img.copy(), boxes)
+        offsets = [parse_init_vec(init_vec)[3] for init_vec in init_vec_list]
+        assert offsets == [0, 70 * 70 * 3, (70 * 70 + 70 * 70 - 30 * 40) * 3, (70 * 70 + 70 * 70 - 30 * 40) * 3]
+
+        decrypted = self.encryptor.decryptFrame(encrypted, boxes, init_vec_list)
+        assert np.array_equal(decrypted, self.img)
+
+    @pytest.mark.parametrize('mode', MODES)
+    def test_modes(self, mode):
+        '''
+        Tests 'encryptFrame' function with each cipher mode
+        Checks:
+            - The mode is recorded with the initialization vector
+            - decryptFrame restores the image, also with an encryptor of another mode
+        '''
+        encryptor = Encryptor(mode)
+        encrypted, init_vec_list = encryptor.encryptFrame(self.img.copy(), self.boxes)
+        assert parse_init_vec(init_vec_list[0])[1] == mode
+        assert not np.array_equal(encrypted, self.img)
+
+        other = Encryptor('cfb8' if mode != 'cfb8' else 'ctr')
+        other.encryptor.key = encryptor.key
+        assert np.array_equal(other.decryptFrame(encrypted, self.boxes, init_vec_list), self.img)
+
+    def test_decrypt_legacy(self):
+        '''
+        Tests 'decryptFrame' function with records written before the cipher mode was stored
+        Checks:
+            - Faces encrypted one by one with CFB-8 and a bare initialization vector each are decrypted
+            - LEGACY_MODE, the default, still writes those records
+        '''
+        encryptor = Encryptor('cfb8')
+        boxes = [(10, 10, 80, 80), (50, 40, 120, 110)]
+        encrypted = self.img.copy()
+        init_vec_list = []
+        for coordinate in clip_boxes(boxes, encrypted.shape):
+            encrypted, init_vec = encryptor.encryptFace([coordinate], encrypted)
+            init_vec_list.append(init_vec)
+        assert parse_init_vec(init_vec_list[0]) == (0, 'cfb8', init_vec_list[0], None)
+
+        self.encryptor.encryptor.key = encryptor.key
+        assert np.array_equal(self.encryptor.decryptFrame(encrypted, boxes, init_vec_list), self.img)
+
+        assert Encryptor().mode == LEGACY_MODE
+        legacy = Encryptor(key=encryptor.key)
+        encrypted, init_vec_list = legacy.encryptFrame(self.img.copy(), boxes)
+        assert [len(init_vec) for init_vec in init_vec_list] == [16, 16]
+        assert np.array_equal(self.encryptor.decryptFrame(encrypted, boxes, init_vec_list), self.img)
+
+
+    def test_parallel(self):
+        '''
+        Tests 'encryptFrame' function with chunks encrypted by a thread pool
+        Checks:
+            - The encrypted image does not depend on the number of threads
+            - The thread pool is recreated in a forked process and not copied into pickled encryptors
+        '''
+        boxes = [(0, 0, 300, 200), (10, 150, 120, 240)]
+        encrypted = {}
+        for workers in [1, 2, 3]:
+            encryptor = Encryptor('ctr', workers, chunk_size=1000)
+            encryptor.encryptor.key = self.encryptor.key
+            encryptor.encryptor.transform = self.fixed_iv_transform(encryptor.encryptor.transform)
+            encrypted[workers], init_vec_list = encryptor.encryptFrame(self.img.copy(), boxes)
+            assert np.array_equal(encryptor.decryptFrame(encrypted[workers].copy(), boxes, init_vec_list), self.img)
+        assert encryptor.encryptor.chunk_size == 1008
+        assert np.array_equal(encrypted[1], encrypted[2])
+        assert np.array_equal(encrypted[1], encrypted[3])
+
+        encryptor = Encryptor('ctr', 2)
+        executor = encryptor.encryptor.getExecutor()
+        assert encryptor.encryptor.getExecutor() is executor
+        encryptor.encryptor.executor_pid = -1
+        assert encryptor.encryptor.getExecutor() is not executor
+        assert pickle.loads(pickle.dumps(encryptor)).encryptor.executor is None
+
+    @staticmethod
+    def fixed_iv_transform(transform):
+        '''
+        Wraps 'transform' to ignore the random initialization vector, so encryptions can be compared
+        '''
+        return lambda data, IV, mode, decrypt=False: transform(data, b'\xff' * 8 + bytes(8), mode, decrypt)
+
+    def test_in_place(self):
+        '''
+        Tests 'encryptFrame' function encrypting in the memory of the image
+        Checks:
+            - The image itself is encrypted and returned
+            - A face of whole rows is encrypted without the scratch buffer
+            - Other faces reuse one scratch buffer across frames
+        '''
+        img = self.img.copy()
+        encrypted, init_vec_list = self.encryptor.encryptFrame(img, [(0, 40, 320, 80)])
+        assert encrypted is img
+        assert not np.array_equal(img[40:80], self.img[40:80])
+        assert self.encryptor.encryptor.buffer is None
+        assert np.array_equal(self.encryptor.decryptFrame(img, [(0, 40, 320, 80)], init_vec_list), self.img)
+
+        self.encryptor.encryptFrame(img, self.boxes)
+        buffer = self.encryptor.encryptor.buffer
+        assert buffer is not None
+        encrypted, init_vec_list = self.encryptor.encryptFrame(self.img.copy(), self.boxes[:2])
+        assert self.encryptor.encryptor.buffer is buffer
+        assert np.array_equal(self.encryptor.decryptFrame(encrypted, self.boxes[:2], init_vec_list), self.img)
+
+        img = self.img.copy()
+        encrypted, init_vec = self.encryptor.encryptFace([(10, 10, 50, 50)], img)
+        assert encrypted is img
+        assert np.array_equal(self.encryptor.encryptor.decrypt([(10, 10, 50, 50)], img, init_vec), self.img)
+
+    def test_load_key(self, tmp_path):
+        '''
+        Tests 'load_key' function
+        Checks:
+            - A missing key file is created with a new key, which is read back
+            - An encryptor with the key decrypts the faces of another encryptor with the key
+            - Files without a valid key are rejected
+        '''
+        key_file = str(tmp_path / 'key.hex')
+        key = load_key(key_file, create=True)
+        assert len(key) == 16
+        assert load_key(key_file) == key
+        assert load_key(key_file, create=True) == key
+
+        encrypted, init_vec_list = Encryptor(key=key).encryptFrame(self.img.copy(), self.boxes)
+        assert np.array_equal(Encryptor(key=key).decryptFrame(encrypted, self.boxes, init_vec_list), self.img)
+
+        with open(key_file, 'w') as file:
+            file.write('00ff')
+        with pytest.raises(ValueError):
+            load_key(key_file)
@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from src.jetson.face_detector import FaceDetector, tile_offsets
+from src.jetson.models.Retinaface.retinaface import RetinaFace
+from src.jetson.models.Retinaface.data.config import cfg_mnet
+from src.jetson.models.utils.box_utils import decode, decode_landm
+
+
+class TestFaceDetector():
+    '''
+    Tests in this class are for the FaceDetector class found in src/jetson/face_detector.py
+    '''
+    def setup_method(self):
+        torch.manual_seed(0)
+        np.random.seed(0)
+        self.weights = 'test_retinaface.pth'
+        torch.save(RetinaFace(cfg=cfg_mnet, phase='test').state_dict(), self.weights)
+        self.detector = FaceDetector(self.weights, 'retinaface', detection_threshold=0.495, cuda=False)
+        self.frame = (np.random.rand(480, 640, 3) * 255).astype(np.uint8)
+
+    def teardown_method(self):
+        os.remove(self.weights)
+
+    def test_tile_offsets(self):
+        '''
+        Tests 'tile_offsets' function
+        Checks:
+            - Tiles cover the whole dimension with the requested overlap
+            - A dimension smaller than a tile has a single tile
+        '''
+        assert tile_offsets(1640, 640, 0.25) == [0, 480, 960, 1000]
+        assert tile_offsets(640, 640, 0.25) == [0]
+        assert tile_offsets(500, 640, 0.25) == [0]
+
+    def test_detect_tiled(self):
+        '''
+        Tests 'detect_tiled' function
+        Checks:
+            - A frame of the detector input size gives the same boxes as 'detect'
+            - No tiles are run when no region needs detection
+            - The input tensor of the previous 'detect' call is cleared
+        '''
+        boxes = self.detector.detect(self.frame)
+        tiled_boxes = self.detector.detect_tiled(self.frame, full_frame=False)
+        assert len(boxes) > 0
+        assert np.allclose(np.array(boxes), np.array(tiled_boxes), atol=1e-3)
+        assert self.detector.input_tensor is None
+
+        assert self.detector.detect_tiled(self.frame, regions=[], full_frame=False) == []
+
+    def test_detect_with_labels(self):
+        '''
+        Tests 'detect_with_labels' function with a model trained with a PPE head
+        Checks:
+            - The PPE head is found in the saved weights
+            - Boxes equal those of 'detect' and there is one PPE label per box
+            - Models without a PPE head cannot predict labels
+        '''
+        ppe_weights = 'test_retinaface_ppe.pth'
+        torch.save(RetinaFace(cfg=dict(cfg_mnet, ppe_classes=3), phase='test').state_dict(), ppe_weights)
+        try:
+            detector = FaceDetector(ppe_weights, 'retinaface', detection_threshold=0.495, cuda=False)
+        finally:
+            os.remove(ppe_weights)
+        assert detector.ppe_classes == 3 and self.detector.ppe_classes == 0
+
+        boxes, labels = detector.detect_with_labels(self.frame)
+        assert len(boxes) > 0
+        assert np.allclose(np.array(boxes), np.array(detector.detect(self.frame)))
+        assert len(labels) == len(boxes)
+        assert all(label in (0, 1, 2) for label in labels)
+
+        with pytest.raises(ValueError):
+            self.detector.detect_with_labels(self.frame)
+
+    def test_detect_landmarks(self):
+        '''
+        Tests 'detect' function with landmarks
+        Checks:
+            - Boxes equal those detected without landmarks
+            - The landmarks of a detection are the decoded landmarks of its prior in frame coordinates
+        '''
+        boxes = self.detector.detect(self.frame)
+        landmark_boxes, landmarks = self.detector.detect(self.frame, landmarks=True)
+        assert np.allclose(np.array(boxes), np.array(landmark_boxes))
+        assert landmarks.shape == (len(boxes), 5, 2)
+
+        dets = self.detector._detect_retinaface(self.frame, landmarks=True)
+        with torch.no_grad():
+            loc, _, landms = self.detector.net(self.detector.input_tensor, landmarks=True)
+        scale = np.array([self.frame.shape[1], self.frame.shape[0]] * 5)
+        prior_boxes = decode(loc[0], self.detector.prior_data, cfg_mnet['variance']).numpy() * scale[:4]
+        prior_landmarks = decode_landm(landms[0], self.detector.prior_data, cfg_mnet['variance']).numpy() * scale
+        # the prior each detection was decoded from
+        prior = np.abs(prior_boxes - dets[0, :4]).sum(axis=1).argmin()
+        assert np.allclose(dets[0, 5:15], prior_landmarks[prior], atol=1e-2)
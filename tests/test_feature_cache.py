@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+from torch.utils.data import TensorDataset
+from torchvision import models
+
+feature_cache = pytest.importorskip('scripts.feature_cache')
+
+
+class TestFeatureCache():
+    '''
+    Tests in this class are for the feature cache found in scripts/feature_cache.py
+    '''
+    def setup_method(self):
+        torch.manual_seed(0)
+        self.model = models.mobilenet_v2()
+        self.model.classifier = nn.Sequential(nn.Dropout(0.2), nn.Linear(self.model.last_channel, 3))
+        self.model.eval()
+        self.images = torch.randn(6, 3, 96, 96)
+        self.dataset = TensorDataset(self.images, torch.tensor([0, 1, 2, 0, 1, 2]))
+
+    def test_build_feature_cache(self, tmp_path):
+        '''
+        Tests 'build_feature_cache' function and the MobilenetSuffix class
+        Checks:
+            - One cached feature map and label per image and view
+            - The suffix applied to the cached features equals the whole model applied to the images
+            - Training the suffix trains the layers of the model
+        '''
+        prefix = self.model.features[:4]
+        cache = feature_cache.build_feature_cache(prefix, self.dataset, str(tmp_path / 'train'), views=2,
+                                                  batch_size=4, num_workers=0)
+        assert len(cache) == 12
+        assert cache.features.dtype == np.float16
+        assert list(cache.labels) == [0, 1, 2, 0, 1, 2] * 2
+
+        suffix = feature_cache.MobilenetSuffix(self.model, '3').eval()
+        features = torch.stack([cache[i][0] for i in range(6)])
+        with torch.no_grad():
+            assert torch.allclose(suffix(features), self.model(self.images), atol=1e-2)
+
+        assert suffix.classifier[1].weight is self.model.classifier[1].weight
+        assert len(list(suffix.parameters())) < len(list(self.model.parameters()))
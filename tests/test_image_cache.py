@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torchvision import datasets
+
+image_cache = pytest.importorskip('scripts.image_cache')
+goggle_classifier = pytest.importorskip('scripts.goggle_classifier')
+
+
+class TestImageCache():
+    '''
+    Tests in this class are for the image cache found in scripts/image_cache.py
+    '''
+    def setup_method(self):
+        np.random.seed(0)
+
+    def make_dataset(self, directory):
+        '''Write face crops of different sizes in Imagefolder structure'''
+        for label in ['Glasses', 'Goggles', 'Neither']:
+            os.makedirs(os.path.join(directory, label))
+            for i, size in enumerate([(60, 80), (300, 250), (224, 224)]):
+                image = (np.random.rand(size[0], size[1], 3) * 255).astype(np.uint8)
+                Image.fromarray(image).save(os.path.join(directory, label, '{}.png'.format(i)))
+
+    def test_build_image_cache(self, tmp_path):
+        '''
+        Tests 'build_image_cache' function and the ImageCacheDataset class
+        Checks:
+            - One image and label per file, and the class names of the folder
+            - Images are cached larger than the random training crops by default
+            - Caching at the crop size warns, and its validation transforms equal those of the decoded files
+            - A cache is reused by 'load_image_cache' and works with load_data
+        '''
+        directory = str(tmp_path / 'faces')
+        self.make_dataset(directory)
+        path = str(tmp_path / 'cache' / 'faces')
+
+        cache = image_cache.load_image_cache(directory, path)
+        folder = datasets.ImageFolder(directory)
+        assert len(cache) == len(folder) == 9
+        assert cache.classes == folder.classes
+        assert cache.images.shape == (9, image_cache.CACHE_SIZE, image_cache.CACHE_SIZE, 3)
+
+        with pytest.warns(UserWarning):
+            val_cache = image_cache.build_image_cache(directory, str(tmp_path / 'cache' / 'val'),
+                                                      image_cache.CROP_SIZE)
+        valaug2 = goggle_classifier.classifier_transforms['valaug2']
+        for i in range(len(folder)):
+            image, label = val_cache[i]
+            assert label == folder[i][1] == cache[i][1]
+            assert torch.allclose(valaug2(image), valaug2(folder[i][0]), atol=1e-6)
+
+        assert image_cache.load_image_cache(directory, path).images.filename == cache.images.filename
+
+        data_transforms = {'train': valaug2, 'val': valaug2}
+        data_loaders, dataset_sizes, class_names = goggle_classifier.load_data(directory, data_transforms,
+                                                                               batch_size=8, num_workers=0,
+                                                                               cache=cache)
+        assert dataset_sizes == {'train': 8, 'val': 1}
+        assert class_names == folder.classes
+        inputs, labels = next(iter(data_loaders['train']))
+        assert inputs.shape == (8, 3, 224, 224)
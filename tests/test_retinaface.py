@@ -0,0 +1,109 @@
+import copy
+
+import torch
+
+from src.jetson.models.Retinaface.retinaface import RetinaFace
+from src.jetson.models.Retinaface.data.config import cfg_mnet
+from src.jetson.models.Retinaface.layers.functions.prior_box import PriorBox
+from src.jetson.models.Retinaface.layers.modules.multibox_loss import MultiBoxLoss
+
+
+class TestRetinaFace():
+    '''
+    Tests in this class are for the RetinaFace model found in src/jetson/models/Retinaface/retinaface.py
+    '''
+    def setup_method(self):
+        torch.manual_seed(0)
+        self.net = RetinaFace(cfg=cfg_mnet, phase='test')
+        self.net.eval()
+        self.inputs = torch.randn(2, 3, 64, 96)
+
+    def test_detect_only(self):
+        '''
+        Tests the detect_only inference mode
+        Checks:
+            - Box regressions are unchanged
+            - Face scores equal the face column of the full softmax
+            - Landmarks are skipped unless requested
+        '''
+        with torch.no_grad():
+            loc, conf, landms = self.net(self.inputs)
+            self.net.detect_only = True
+            loc_fast, scores, landms_fast = self.net(self.inputs)
+            _, _, landms_requested = self.net(self.inputs, landmarks=True)
+
+        assert torch.equal(loc, loc_fast)
+        assert scores.shape == conf.shape[:2]
+        assert torch.allclose(scores, conf[..., 1], atol=1e-6)
+        assert landms_fast is None
+        assert torch.equal(landms, landms_requested)
+
+    def test_prune_anchors(self):
+        '''
+        Tests anchor and pyramid level pruning for a face size range
+        Checks:
+            - Pruned priors are the full priors of the kept anchor sizes
+            - Pruned network outputs equal the full outputs for the kept priors
+        '''
+        image_size = (self.inputs.shape[2], self.inputs.shape[3])
+        full_priors = PriorBox(cfg_mnet, image_size=image_size).forward()
+        for face_size_range in [(20, 60), (100, 400), (10, 30)]:
+            priorbox = PriorBox(cfg_mnet, image_size=image_size, face_size_range=face_size_range)
+            priors = priorbox.forward()
+            kept_sizes = torch.tensor([size for sizes in priorbox.min_sizes for size in sizes], dtype=torch.float)
+            keep = (full_priors[:, 2:3] * image_size[1] - kept_sizes).abs().min(dim=1)[0] < 1e-3
+            assert torch.allclose(full_priors[keep], priors)
+
+            pruned = copy.deepcopy(self.net)
+            pruned.prune_anchors(priorbox.min_sizes)
+            with torch.no_grad():
+                loc, conf, landms = self.net(self.inputs)
+                pruned_loc, pruned_conf, pruned_landms = pruned(self.inputs)
+
+            assert torch.allclose(loc[:, keep], pruned_loc, atol=1e-6)
+            assert torch.allclose(conf[:, keep], pruned_conf, atol=1e-6)
+            assert torch.allclose(landms[:, keep], pruned_landms, atol=1e-6)
+
+    def test_ppe_head(self):
+        '''
+        Tests the PPE head and its classification term in MultiBoxLoss
+        Checks:
+            - PPE class probabilities of each prior are appended to the outputs and pruned with the anchors
+            - The loss has a PPE term that trains the PPE head, and unknown PPE labels are ignored
+            - Without PPE predictions the loss is unchanged
+        '''
+        ppe_cfg = dict(cfg_mnet, ppe_classes=3)
+        net = RetinaFace(cfg=ppe_cfg, phase='test')
+        net.eval()
+        with torch.no_grad():
+            loc, conf, landms, ppe = net(self.inputs)
+        assert ppe.shape == (2, loc.shape[1], 3)
+        assert torch.allclose(ppe.sum(dim=-1), torch.ones(2, loc.shape[1]), atol=1e-5)
+
+        image_size = (self.inputs.shape[2], self.inputs.shape[3])
+        priorbox = PriorBox(cfg_mnet, image_size=image_size, face_size_range=(20, 60))
+        pruned = copy.deepcopy(net)
+        pruned.prune_anchors(priorbox.min_sizes)
+        with torch.no_grad():
+            assert pruned(self.inputs)[3].shape == (2, priorbox.forward().shape[0], 3)
+
+        net = RetinaFace(cfg=ppe_cfg, phase='train')
+        inputs = torch.randn(2, 3, 128, 128)
+        priors = PriorBox(cfg_mnet, image_size=(128, 128)).forward()
+        targets = [torch.tensor([[0.1, 0.1, 0.4, 0.5] + [0.2] * 10 + [1, 2]]),
+                   torch.tensor([[0.5, 0.5, 0.9, 0.9] + [-1] * 10 + [-1, -1],
+                                 [0.1, 0.1, 0.3, 0.3] + [0.15] * 10 + [1, 0]])]
+        criterion = MultiBoxLoss(2, 0.35, True, 0, True, 7, 0.35, False)
+
+        predictions = net(inputs)
+        losses = criterion(predictions, priors, targets)
+        assert len(losses) == 4
+        assert all(torch.isfinite(loss) for loss in losses)
+        losses[3].backward()
+        assert net.PPEHead[0].conv1x1.weight.grad.abs().sum() > 0
+        assert net.ClassHead[0].conv1x1.weight.grad is None
+
+        unknown = [torch.cat((target[:, :15], -torch.ones(len(target), 1)), 1) for target in targets]
+        assert criterion(predictions, priors, unknown)[3] == 0
+
+        assert torch.equal(torch.stack(criterion(predictions[:3], priors, targets)), torch.stack(losses[:3]))
@@ -0,0 +1,55 @@
+import torch
+
+from src.jetson.models.SSD.data import wider_face
+from src.jetson.models.SSD.layers.functions.detection import Detect
+from src.jetson.models.SSD.layers.functions.prior_box import PriorBox
+from src.jetson.models.utils.box_utils import decode, nms_torch
+
+
+def detect_per_image(detect, loc_data, conf_data, prior_data):
+    '''Reference implementation looping over images and classes with nms_torch'''
+    num = loc_data.size(0)
+    output = torch.zeros(num, detect.num_classes, detect.top_k, 5)
+    conf_preds = conf_data.transpose(2, 1)
+    for i in range(num):
+        decoded_boxes = decode(loc_data[i], prior_data, detect.variance)
+        conf_scores = conf_preds[i].clone()
+        for cl in range(1, detect.num_classes):
+            c_mask = conf_scores[cl].gt(detect.conf_thresh)
+            scores = conf_scores[cl][c_mask]
+            if scores.size(0) == 0:
+                continue
+            l_mask = c_mask.unsqueeze(1).expand_as(decoded_boxes)
+            boxes = decoded_boxes[l_mask].view(-1, 4)
+            ids, count = nms_torch(boxes, scores, detect.nms_thresh, detect.top_k)
+            output[i, cl, :count] = torch.cat((scores[ids[:count]].unsqueeze(1), boxes[ids[:count]]), 1)
+    return output
+
+
+class TestDetect():
+    '''
+    Tests in this class are for the batched SSD Detect layer found in src/jetson/models/SSD/layers/functions/detection.py
+    '''
+    def setup_method(self):
+        torch.manual_seed(0)
+        self.priors = PriorBox(wider_face).forward()
+        self.loc = torch.randn(3, self.priors.size(0), 4) * 0.5
+        self.conf = torch.softmax(torch.randn(3, self.priors.size(0), 2) * 2, dim=-1)
+        self.conf[1, :, 1] = 0  # image without any face
+
+    def test_forward(self):
+        '''
+        Tests 'forward' function
+        Checks:
+            - Batched output equals the per image and per class output
+            - Results are limited to top_k per image and class
+        '''
+        for top_k, conf_thresh in [(200, 0.01), (50, 0.9)]:
+            detect = Detect(2, 0, top_k, conf_thresh, 0.45)
+            output = detect(self.loc, self.conf, self.priors)
+            expected = detect_per_image(detect, self.loc, self.conf, self.priors)
+
+            assert output.shape == (3, 2, top_k, 5)
+            assert torch.allclose(output, expected, atol=1e-6)
+            assert (output[0, 1, :, 0] > 0).sum() > 0
+            assert (output[1] == 0).all()
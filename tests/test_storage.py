@@ -0,0 +1,165 @@
+import os
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from src.jetson.encryptor import Encryptor, clip_boxes
+from src.jetson.storage import ImageWriter, SegmentRecorder, decode_frame, encode_frame, encode_keyframe, read_frame, \
+    read_segment_frame, write_frame, write_keyframe
+
+
+class TestStorage():
+    '''
+    Tests in this class are for the encrypted frame formats found in src/jetson/storage.py
+    '''
+    def setup_method(self):
+        np.random.seed(0)
+        # a smooth background, like a camera frame, with encrypted faces
+        self.img = cv2.resize((np.random.rand(6, 8, 3) * 255).astype(np.uint8), (320, 240))
+        self.boxes = [(10, 20, 60, 90), (40, 50, 140, 100), (0, 0, 0, 10), (250, 180, 330, 260)]
+        self.encryptor = Encryptor()
+        self.encrypted, self.init_vec_list = self.encryptor.encryptFrame(self.img.copy(), self.boxes)
+        self.coordinates = clip_boxes(self.boxes, self.img.shape)
+
+    @pytest.mark.parametrize('image_format', ['png', 'efr'])
+    def test_lossless(self, image_format):
+        '''
+        Tests 'encode_frame' and 'decode_frame' functions with the lossless formats
+        Checks:
+            - The encrypted faces are decoded exactly, so they can be decrypted
+            - The background of EFR frames is close to the frame
+            - The frame itself is not modified
+        '''
+        encrypted = self.encrypted.copy()
+        data = encode_frame(self.encrypted, self.coordinates, image_format)
+        assert np.array_equal(self.encrypted, encrypted)
+        img = decode_frame(data)
+        assert img.shape == self.img.shape
+        for x1, y1, x2, y2 in self.coordinates:
+            assert np.array_equal(img[y1:y2, x1:x2], self.encrypted[y1:y2, x1:x2])
+        assert np.abs(img.astype(int) - self.encrypted).mean() < 1
+
+        decrypted = self.encryptor.decryptFrame(img, self.boxes, self.init_vec_list)
+        for x1, y1, x2, y2 in self.coordinates:
+            assert np.array_equal(decrypted[y1:y2, x1:x2], self.img[y1:y2, x1:x2])
+
+    def test_write_frame(self, tmp_path):
+        '''
+        Tests 'write_frame' and 'read_frame' functions
+        Checks:
+            - The format follows the file extension and the size written is returned
+            - EFR frames are smaller than PNG frames
+            - JPEG frames are read, missing files give None and unknown formats are rejected
+        '''
+        sizes = {}
+        for image_format in ['jpg', 'png', 'efr']:
+            path = str(tmp_path / ('frame.' + image_format))
+            sizes[image_format] = write_frame(path, self.encrypted, self.coordinates)
+            assert os.path.getsize(path) == sizes[image_format]
+            assert read_frame(path).shape == self.img.shape
+        assert sizes['efr'] < sizes['png']
+        assert np.array_equal(read_frame(str(tmp_path / 'frame.png')), self.encrypted)
+
+        assert read_frame(str(tmp_path / 'missing.efr')) is None
+        with pytest.raises(ValueError):
+            write_frame(str(tmp_path / 'frame.bmp'), self.encrypted)
+
+    def test_roi_records(self, tmp_path):
+        '''
+        Tests ROI records written with 'write_frame' and their keyframe written with 'write_keyframe'
+        Checks:
+            - The keyframe holds the background without the faces
+            - ROI records are much smaller than frames and hold the encrypted faces exactly
+            - The frame is reconstructed from the keyframe, and is None without it
+            - ROI records need a keyframe
+        '''
+        write_keyframe(str(tmp_path / 'key.efr'), self.img, self.coordinates)
+        keyframe = read_frame(str(tmp_path / 'key.efr'))
+        for x1, y1, x2, y2 in self.coordinates[:2]:
+            # blanked, apart from JPEG ringing at the edges
+            assert keyframe[y1 + 4:y2 - 4, x1 + 4:x2 - 4].max() < 16
+
+        size = write_frame(str(tmp_path / 'frame.roi'), self.encrypted, self.coordinates, keyframe='key.efr')
+        assert size < write_frame(str(tmp_path / 'frame.efr'), self.encrypted, self.coordinates)
+        img = read_frame(str(tmp_path / 'frame.roi'))
+        assert np.abs(img.astype(int) - self.encrypted).mean() < 1
+        decrypted = self.encryptor.decryptFrame(img, self.boxes, self.init_vec_list)
+        for x1, y1, x2, y2 in self.coordinates:
+            assert np.array_equal(decrypted[y1:y2, x1:x2], self.img[y1:y2, x1:x2])
+
+        os.remove(str(tmp_path / 'key.efr'))
+        assert read_frame(str(tmp_path / 'frame.roi')) is None
+        with pytest.raises(ValueError):
+            encode_frame(self.encrypted, self.coordinates, 'roi')
+
+
+    def test_segment_recorder(self, tmp_path):
+        '''
+        Tests 'SegmentRecorder' class and 'read_segment_frame' function
+        Checks:
+            - Frames are appended with consecutive indices and read back by index
+            - ROI records are read with their keyframe from the same segment
+            - A new segment is started after segment_minutes
+            - Missing frames and segments give None
+        '''
+        recorder = SegmentRecorder(str(tmp_path), segment_minutes=1)
+        assert recorder.rotate(1000)
+        first = recorder.segment_name
+        frames = [np.roll(self.encrypted, shift, axis=1) for shift in range(3)]
+        assert [recorder.append(encode_frame(frame, [], 'png')) for frame in frames] == [0, 1, 2]
+        assert recorder.append(encode_keyframe(self.encrypted, self.coordinates)) == 3
+        assert recorder.append(encode_frame(self.encrypted, self.coordinates, 'roi', '#3')) == 4
+
+        assert not recorder.rotate(1059)
+        assert recorder.rotate(1060)
+        assert recorder.segment_name != first and recorder.next_index == 0
+        recorder.append(encode_frame(frames[0], [], 'png'))
+        recorder.close()
+
+        path = str(tmp_path / first)
+        assert np.array_equal(read_segment_frame(path, 1), frames[1])
+        img = read_segment_frame(path, 4)
+        for x1, y1, x2, y2 in self.coordinates:
+            assert np.array_equal(img[y1:y2, x1:x2], self.encrypted[y1:y2, x1:x2])
+        assert np.array_equal(read_segment_frame(str(tmp_path / recorder.segment_name), 0), frames[0])
+
+        assert read_segment_frame(path, 5) is None
+        assert read_segment_frame(str(tmp_path / 'missing.efs'), 0) is None
+
+    def test_image_writer(self, tmp_path):
+        '''
+        Tests 'ImageWriter' class
+        Checks:
+            - Frames are written to the date/hour subdirectory of the time they were taken
+            - The returned path is relative to the output directory and the frame is read back from it
+            - ROI records find their keyframe in the same subdirectory
+            - Frames are synced in batches and the rest on close
+            - A failed write is counted and raised by the next write or close
+        '''
+        writer = ImageWriter(str(tmp_path), workers=2, queue_size=2, fsync_batch=3)
+        now = time.mktime((2020, 10, 1, 13, 30, 0, 0, 0, -1))
+        frames = [np.roll(self.encrypted, shift, axis=1) for shift in range(4)]
+        paths = [writer.write(encode_frame(frame, self.coordinates, 'efr'), '{}.efr'.format(i), now)
+                 for i, frame in enumerate(frames)]
+        assert paths[0] == os.path.join('2020-10-01', '13', '0.efr')
+        assert writer.shard(now + 3600) == os.path.join('2020-10-01', '14')
+
+        writer.write(encode_keyframe(self.encrypted, self.coordinates), 'key.efr', now + 3600)
+        roi_path = writer.write(encode_frame(self.encrypted, self.coordinates, 'roi', 'key.efr'), 'roi.roi',
+                                now + 3600)
+        writer.close()
+        assert writer.unsynced == []
+
+        for path, frame in zip(paths + [roi_path], frames + [self.encrypted]):
+            img = read_frame(str(tmp_path / path))
+            for x1, y1, x2, y2 in self.coordinates:
+                assert np.array_equal(img[y1:y2, x1:x2], frame[y1:y2, x1:x2])
+
+        writer = ImageWriter(str(tmp_path), workers=1)
+        writer.write(None, 'broken.efr', now)
+        with pytest.raises(TypeError):
+            writer.close()
+        assert writer.failures == 1
+
@@ -0,0 +1,70 @@
+import csv
+
+import pytest
+
+sweep = pytest.importorskip('scripts.sweep')
+
+
+class TestSweep():
+    '''
+    Tests in this class are for the hyperparameter sweep found in scripts/sweep.py
+    '''
+    def setup_method(self):
+        self.params = {'lr': 0.001, 'momentum': 0.9, 'step_size': 7, 'gamma': 0.1, 'num_epochs': 10}
+
+    def test_get_trials(self):
+        '''
+        Tests 'get_trials' function
+        Checks:
+            - Grid search runs every combination, other hyperparameters come from params.json and the defaults
+            - Random search samples values from lists and within ranges, reproducibly
+            - Grid search rejects ranges
+        '''
+        trials = sweep.get_trials({'method': 'grid', 'parameters': {'lr': [0.1, 0.01], 'frozen': ['-1', '9', '13']}},
+                                  self.params)
+        assert len(trials) == 6
+        assert {(trial['lr'], trial['frozen']) for trial in trials} == {(lr, frozen) for lr in [0.1, 0.01]
+                                                                        for frozen in ['-1', '9', '13']}
+        assert all(trial['momentum'] == 0.9 and trial['aug'] == 3 for trial in trials)
+
+        spec = {'method': 'random', 'num_trials': 20,
+                'parameters': {'lr': {'min': 1e-4, 'max': 1e-1, 'log': True}, 'step_size': {'min': 3, 'max': 9},
+                               'aug': [2, 3]}}
+        trials = sweep.get_trials(spec, self.params, seed=1)
+        assert len(trials) == 20
+        assert all(1e-4 <= trial['lr'] <= 1e-1 for trial in trials)
+        assert all(isinstance(trial['step_size'], int) and 3 <= trial['step_size'] <= 9 for trial in trials)
+        assert {trial['aug'] for trial in trials} <= {2, 3}
+        assert trials == sweep.get_trials(spec, self.params, seed=1)
+
+        with pytest.raises(ValueError):
+            sweep.get_trials({'method': 'grid', 'parameters': {'lr': {'min': 0.1, 'max': 1}}}, self.params)
+
+    def test_should_stop(self):
+        '''
+        Tests 'should_stop' function
+        Checks:
+            - Trials are not stopped during the grace epochs or without enough other trials
+            - Trials below the median of the other trials at the same epoch are stopped
+        '''
+        history = {0: [0.5, 0.6, 0.7], 1: [0.4, 0.5, 0.6], 2: [0.3, 0.3, 0.3]}
+        assert not sweep.should_stop(history, 2, 1, grace_epochs=3)
+        assert sweep.should_stop(history, 2, 2, grace_epochs=1)
+        assert not sweep.should_stop(history, 0, 2, grace_epochs=1)
+        assert not sweep.should_stop({0: [0.5], 1: [0.1]}, 1, 0, grace_epochs=0)
+
+    def test_write_results(self, tmp_path):
+        '''
+        Tests 'write_results' function
+        Checks:
+            - Results are written best trial first with the trial number in the first column
+        '''
+        results = [dict(self.params, trial=0, best_acc=0.7, epochs=10),
+                   dict(self.params, trial=1, best_acc=0.9, epochs=4)]
+        path = str(tmp_path / 'sweep.csv')
+        sweep.write_results(results, path)
+
+        with open(path, newline='') as csv_file:
+            rows = list(csv.DictReader(csv_file))
+        assert [row['trial'] for row in rows] == ['1', '0']
+        assert list(rows[0])[0] == 'trial'